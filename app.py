@@ -11,14 +11,23 @@ import uuid
 import logging
 import io
 import re
-from flask import Flask, request, jsonify
+import heapq
+import itertools
+import queue
+import select
+import sys
+import hashlib
+import gzip
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, send_from_directory, send_file, abort
 from flask_cors import CORS
-from urllib.parse import quote, urlparse
+from urllib.parse import quote, unquote, urlparse
 from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
+from datetime import datetime
 from psycopg2.extras import DictCursor
 from psycopg2 import pool
-from portalsmp import giftsFloors, search, filterFloors
 from psycopg2.extras import execute_values
 
 # --- CONFIGURATION ---
@@ -53,9 +62,100 @@ MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 GIVEAWAY_UPDATE_THROTTLE_SECONDS = 30
 REQUIRED_GIVEAWAY_CHANNEL = "@CompactTelegram"
 
+# --- GIVEAWAY SCHEDULER ---
+GIVEAWAY_SCHEDULER_LOCK_ID = 7_402_611  # Postgres advisory lock key held by the scheduler leader
+GIVEAWAY_NOTIFY_CHANNEL = "giveaway_schedule"
+GIVEAWAY_SCHEDULER_MAX_SLEEP_SECONDS = 300  # Safety net in case a NOTIFY is ever missed
+GIVEAWAY_LEADER_RETRY_SECONDS = 30
+giveaway_wakeup_event = threading.Event()
+giveaway_update_timers = {}  # giveaway_id -> pending threading.Timer for the debounced post edit
+giveaway_update_lock = threading.Lock()
+
+# --- TELEGRAM UPDATE QUEUE ---
+TELEGRAM_UPDATE_WORKERS = int(os.environ.get('TELEGRAM_UPDATE_WORKERS', 4))
+TELEGRAM_UPDATE_QUEUE_SIZE = 1000  # Per worker
+TELEGRAM_UPDATE_DEDUP_WINDOW = 10000  # Recently seen update_ids remembered for dedup
+
+# --- BACKGROUND TASKS ---
+BACKGROUND_MAX_WORKERS = int(os.environ.get('BACKGROUND_MAX_WORKERS', 4))  # Keep well below the DB pool size
+BACKGROUND_MAX_QUEUE_DEPTH = 500
+
 collectible_parts_cache = {}
 CACHE_DURATION_SECONDS = 3600  # Cache for 1 hour
 
+# --- MEDIA STORAGE ---
+# Uploaded images are stored by content hash, on local disk by default or in any S3-compatible
+# bucket when MEDIA_S3_BUCKET is set (needs boto3). Only the short public URL goes into the DB.
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+MEDIA_PUBLIC_BASE_URL = os.environ.get('MEDIA_PUBLIC_BASE_URL', f"{WEBHOOK_URL}/media").rstrip('/')
+MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET')
+MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL')  # e.g. R2/MinIO; unset for AWS
+MEDIA_ROOT_PERSISTENT = os.environ.get('MEDIA_ROOT_PERSISTENT', '').lower() in ('1', 'true', 'yes')  # Set when MEDIA_ROOT is on a persistent disk
+MEDIA_CACHE_MAX_AGE_SECONDS = 31536000  # Content-addressed, so never changes
+AVATAR_SIZE = 256
+AVATAR_WEBP_QUALITY = 82
+AVATAR_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+AVATAR_MAX_PIXELS = 40_000_000
+MAX_AVATAR_URL_LENGTH = 2048
+SEND_IMAGE_MAX_BYTES = 10 * 1024 * 1024  # Telegram's sendPhoto limit
+SEND_IMAGE_MAX_SIDE_SUM = 10000  # Telegram rejects photos whose width + height is larger
+SEND_IMAGE_RECOMPRESS_BYTES = 2 * 1024 * 1024  # Larger uploads (or other formats) are re-encoded as JPEG
+SEND_IMAGE_JPEG_QUALITY = 88
+UPLOAD_SPOOL_MAX_MEMORY_BYTES = 1024 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # Room for form fields and part headers on top of the file
+
+# --- ASSET PROXY ---
+ASSET_PROXY_BASE_URL = os.environ.get('ASSET_PROXY_BASE_URL', f"{WEBHOOK_URL}/assets").rstrip('/')
+ASSET_PROXY_HOSTS = ('cdn.changes.tg', 'raw.githubusercontent.com')  # github.com ?raw=true links are mapped to raw.githubusercontent.com
+ASSET_PROXY_GITHUB_REPOS = ('Vasiliy-katsyka/upgrade/',)  # Plus every repo customgifts.json links to
+ASSET_CACHE_DIR = os.path.join(MEDIA_ROOT, 'asset-cache')  # Always local: it's a cache, not storage
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+ASSET_CACHE_MAX_AGE_SECONDS = 7 * 86400
+ASSET_FETCH_MAX_BYTES = 15 * 1024 * 1024
+ASSET_THUMB_WIDTHS = (64, 128, 256, 512)
+
+# --- GIFT CARD RENDERER ---
+GIFT_CARD_CACHE_DIR = os.path.join(MEDIA_ROOT, 'cards')  # Always local: it's a cache, not storage
+GIFT_CARD_SIZES = {'full': (675, 900), 'thumb': (240, 320)}
+GIFT_CARD_RENDER_VERSION = 1  # Bump when the layout changes so cached cards get re-rendered
+GIFT_CARD_JPEG_QUALITY = 88  # Telegram inline photo results must be JPEG
+GIFT_CARD_PATTERN_OPACITY = 0.07  # Same as the web app's share image
+GIFT_CARD_CACHE_MAX_FILES = 20000
+GIFT_CARD_FONT_PATH = os.environ.get('GIFT_CARD_FONT_PATH', 'DejaVuSans-Bold.ttf')
+
+# --- TELEGRAM MEDIA CACHE ---
+TELEGRAM_FILE_ID_CACHE_MAX_ENTRIES = 5000
+TELEGRAM_STALE_FILE_ID_PATTERN = re.compile(r'file identifier|file_id|FILE_REFERENCE|remote file', re.IGNORECASE)
+telegram_file_id_cache = OrderedDict()  # source key -> file_id, in front of the telegram_media_cache table
+telegram_file_id_cache_lock = threading.Lock()
+
+# --- CHANNEL MEMBERSHIP CACHE ---
+CHANNEL_MEMBER_TTL_SECONDS = 300
+CHANNEL_NON_MEMBER_TTL_SECONDS = 20
+CHANNEL_MEMBERSHIP_CACHE_MAX_ENTRIES = 50000
+NON_MEMBER_STATUSES = ('left', 'kicked')
+channel_membership_cache = {}  # (chat_id, user_id) -> (status, expires_at)
+# Separate from the background pool: membership checks run on the request path and must not queue behind it.
+membership_check_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="membership")
+
+# --- HTTP CACHING & COMPRESSION ---
+COMPRESSION_MIN_BYTES = 1024  # Smaller bodies aren't worth the CPU or the extra header
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/msgpack', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5  # Brotli needs the optional `brotli` package; gzip is used without it
+USER_CHANGES_MAX_ENTITIES = 500  # Past this many changed entities a full reload is cheaper than a delta
+RESOURCE_VERSIONS_CHANNEL = "resource_versions"
+RESOURCE_VERSION_LISTENER_RETRY_SECONDS = 10
+USER_VERSION_CACHE_MAX_ENTRIES = 50000  # Past this, account versions are read from the DB instead of cached
+# Part of every ETag so a deploy that changes a response's shape doesn't revalidate old copies.
+ETAG_BUILD_ID = os.environ.get('RENDER_GIT_COMMIT', '')[:12] or str(int(os.path.getmtime(os.path.abspath(__file__))))
+resource_version_cache = {}  # resource (or 'user:<tg_id>') -> version, only trusted while the NOTIFY listener is connected
+profile_username_ids = {}  # lowercased username -> tg_id, dropped with that account's cached version
+profile_usernames_by_id = {}  # tg_id -> lowercased username, to find the entry above on invalidation
+resource_version_cache_lock = threading.Lock()
+resource_version_cache_generation = 0  # Bumped on every invalidation so racing DB reads don't cache stale versions
+resource_version_listener_connected = False
+
 # --- DATABASE CONNECTION POOL ---
 db_pool = None
 
@@ -100,506 +200,250 @@ def put_db_connection(conn):
     if db_pool and conn and not conn.closed:
         db_pool.putconn(conn)
 
-# --- IN app.py ---
+# --- SHARED BACKGROUND EXECUTOR ---
+# All fire-and-forget work (giveaway processing, message edits, ...) goes through this one
+# bounded pool instead of raw threads, so a burst can never exhaust the DB connection pool.
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_MAX_WORKERS, thread_name_prefix="background")
+background_lock = threading.Lock()
+background_pending_keys = set()
+background_stats = {"submitted": 0, "started": 0, "completed": 0, "failed": 0, "deduplicated": 0, "rejected": 0}
+background_shutting_down = False
 
-# --- NEW: Asset Source Override Map ---
-# This map allows regular (non-custom) gifts to use assets from another gift's folder on the CDN.
-# This is useful when Telegram groups assets, e.g., all artist-specific gifts share one asset pack.
-# NOTE: The source "Snoop Dogg" is used here as per your request and previous patterns.
-ASSET_SOURCE_OVERRIDES = {
-
-    # --- NEWLY ADDED GIFTS (as of late July 2024) ---
-    # These gifts also do not have their own pattern folders and need to be re-routed.
-    "Happy Brownie": {
-        "backdrops_source": "Snoop Dogg", # Assuming same source for consistency
-        "patterns_source": "Snoop Dogg"
-    },
-    "Ice Cream": {
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Spring Basket": {
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Instant Ramen": {
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Faith Amulet": {
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Mousse Cake": {
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    }
-}
+def submit_background_task(fn, *args, dedup_key=None):
+    """
+    Queues fn(*args) on the shared pool.
+    If dedup_key is given and a task with the same key is still waiting to start, the new one is dropped.
+    Returns True if the task was queued.
+    """
+    with background_lock:
+        if background_shutting_down:
+            background_stats["rejected"] += 1
+            return False
+        if dedup_key is not None and dedup_key in background_pending_keys:
+            background_stats["deduplicated"] += 1
+            return False
+        if background_stats["submitted"] - background_stats["started"] >= BACKGROUND_MAX_QUEUE_DEPTH:
+            background_stats["rejected"] += 1
+            app.logger.warning(f"Background queue is full, dropping task {getattr(fn, '__name__', fn)}.")
+            return False
+        if dedup_key is not None:
+            background_pending_keys.add(dedup_key)
+        background_stats["submitted"] += 1
+
+    background_executor.submit(_run_background_task, fn, args, dedup_key)
+    return True
+
+def _run_background_task(fn, args, dedup_key):
+    with background_lock:
+        background_stats["started"] += 1
+        # Release the key once running, so changes made during this run get their own task.
+        if dedup_key is not None:
+            background_pending_keys.discard(dedup_key)
+    try:
+        fn(*args)
+        with background_lock:
+            background_stats["completed"] += 1
+    except Exception as e:
+        with background_lock:
+            background_stats["failed"] += 1
+        app.logger.error(f"Background task {getattr(fn, '__name__', fn)} failed: {e}", exc_info=True)
+
+def get_background_task_stats():
+    with background_lock:
+        stats = dict(background_stats)
+        stats["queue_depth"] = stats["submitted"] - stats["started"]
+        stats["pending_dedup_keys"] = len(background_pending_keys)
+    stats["max_workers"] = BACKGROUND_MAX_WORKERS
+    return stats
+
+def shutdown_background_tasks():
+    """Stops accepting new tasks and waits for queued ones to finish."""
+    global background_shutting_down
+    with background_lock:
+        if background_shutting_down:
+            return
+        background_shutting_down = True
+    app.logger.info(f"Shutting down background executor: {get_background_task_stats()}")
+    background_executor.shutdown(wait=True)
 
 collectible_parts_cache = {}
 CACHE_DURATION_SECONDS = 3600  # Cache for 1 hour
 
 # --- INLINE BOT CACHE ---
-inline_cache = {}
-
-
-# --- CUSTOM GIFT DATA ---
-CUSTOM_GIFTS_DATA = {
-    "Skebob": {
-        "id": "custom_skebob",
-        "models": [
-            {"name": "Nikitka", "rarityPermille": 1, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/refs/heads/main/BackgroundEraser_20250718_145212143.png"},
-            {"name": "Gold", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_220944840-min.png"},
-            {"name": "Plushy", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_221053786-min.png"},
-            {"name": "XXXTentacion", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_222249990-min.png"},
-            {"name": "Cactus King", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013002213-min.png"},
-            {"name": "354 KANON", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013042799-min.png"},
-            {"name": "Duck", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014036288-min.png"},
-            {"name": "Spider King", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_220335725-min.png"},
-            {"name": "Bitcoin", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_012502725-min.png"},
-            {"name": "Move To Heaven", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_012612974-min.png"},
-            {"name": "Frogie", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_012824238-min.png"},
-            {"name": "The King", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_012931928-min.png"},
-            {"name": "Fire On Fire", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013941593-min.png"},
-            {"name": "Icy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_220405846-min.png"},
-            {"name": "Pick Me", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_220906007-min.png"},
-            {"name": "Black Bird", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_221147963-min.png"},
-            {"name": "Pavel Durov", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_222706006-min.png"},
-            {"name": "Banana", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013851152-min.png"},
-            {"name": "Mummy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014247708-min.png"},
-            {"name": "Police Man", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014319952-min.png"},
-            {"name": "Electric BDSM", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014554522-min.png"},
-            {"name": "Glassy", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250717_221020205-min.png"},
-            {"name": "Ancient", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_012541910-min.png"},
-            {"name": "Business", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013214856-min.png"},
-            {"name": "Spookie", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013308503-min.png"},
-            {"name": "Minion", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013343118-min.png"},
-            {"name": "Oh Shit", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_013417326-min.png"},
-            {"name": "Emo Girl", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014533870-min.png"},
-            {"name": "Minecraft", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/skebobs/main/BackgroundEraser_20250718_014750440-min.png"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Baggin' Cat": {
-        "id": "custom_baggin_cat",
-        "defaultImage": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/refs/heads/main/IMG_20250718_234950_164.png",
-        "models": [
-            {"name": "Redo", "rarityPermille": 1, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_154505502.png"},
-            {"name": "Bored Ape", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153421320.png"},
-            {"name": "Snoop Dogg", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153800346.png"},
-            {"name": "Austronaut", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153211676.png"},
-            {"name": "Chinese Dragon", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153332160.png"},
-            {"name": "Radioactive", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_154437815.png"},
-            {"name": "Pink Guard", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_154725761.png"},
-            {"name": "Angel", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155859028.png"},
-            {"name": "Devil", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155937967.png"},
-            {"name": "Minion", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153059849.png"},
-            {"name": "Rainbow", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153251813.png"},
-            {"name": "Spookie", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153836181.png"},
-            {"name": "Spider", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_154055429.png"},
-            {"name": "Dying Light", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_154537813.png"},
-            {"name": "Hippo", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155053345.png"},
-            {"name": "Poo", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155200011.png"},
-            {"name": "Pikachu", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155411045.png"},
-            {"name": "XXXTentacion", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155652114.png"},
-            {"name": "Electric", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155830968.png"},
-            {"name": "Glassy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_160036747.png"},
-            {"name": "Alien", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_160243304.png"},
-            {"name": "Piggy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_160346910.png"},
-            {"name": "Panda", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153136834.png"},
-            {"name": "Capybara", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_153629360.png"},
-            {"name": "Dolphin", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155125393.png"},
-            {"name": "Rabbit", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_155341280.png"},
-            {"name": "Elephant", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_160003197.png"},
-            {"name": "Bee", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/BagginCat/main/BackgroundEraser_20250720_160317620.png"}
-        ],
-        "backdrops_source": "Toy Bear",
-        "patterns_source": "Toy Bear"
-    },
-    "Keychain Dog": {
-        "id": "custom_keychain_dog",
-        "defaultImage": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/IMG_20250814_001025_847.png?raw=true",
-        "models": [
-            {"name": "Eyes Closed", "rarityPermille": 1, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224650949.png?raw=true"},
-            {"name": "Golden Dog", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224121131.png?raw=true"},
-            {"name": "Sapphire", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224146402.png?raw=true"},
-            {"name": "Pavel Du Rove", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224244337.png?raw=true"},
-            {"name": "Dogugu", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224952768.png?raw=true"},
-            {"name": "Fridge", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223539864.png?raw=true"},
-            {"name": "Cabbage", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223714257.png?raw=true"},
-            {"name": "Hot Peach", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223954489.png?raw=true"},
-            {"name": "Emelard", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224215512.png?raw=true"},
-            {"name": "Mathematics", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224336692.png?raw=true"},
-            {"name": "Duck", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224759233.png?raw=true"},
-            {"name": "Hop Nai-Ni-Nai", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_225034482.png?raw=true"},
-            {"name": "Hippo", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223609273.png?raw=true"},
-            {"name": "Pikachu", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223642208.png?raw=true"},
-            {"name": "Bad Doggy", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223841940.png?raw=true"},
-            {"name": "Demonic Dog", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224026427.png?raw=true"},
-            {"name": "Angelic Dog", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224054677.png?raw=true"},
-            {"name": "Frogie", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224626535.png?raw=true"},
-            {"name": "Pick Me", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224726881.png?raw=true"},
-            {"name": "Dying Light", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224830054.png?raw=true"},
-            {"name": "Halloween", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224929413.png?raw=true"},
-            {"name": "Invisible", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_225502804.png?raw=true"},
-            {"name": "Kitten", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223514941.png?raw=true"},
-            {"name": "Tiger", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223743205.png?raw=true"},
-            {"name": "Spider", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_223907805.png?raw=true"},
-            {"name": "Elephant", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224405798.png?raw=true"},
-            {"name": "Ghosty", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224443074.png?raw=true"},
-            {"name": "Banana", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_224857672.png?raw=true"},
-            {"name": "Rainbow", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_225055413.png?raw=true"},
-            {"name": "I Don't Care", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/KeychainDog/blob/main/BackgroundEraser_20250814_225130675.png?raw=true"}
-        ],
-        "backdrops_source": "Toy Bear",
-        "patterns_source": "Toy Bear"
-    },
-    "Taped Eggplant": {
-        "id": "custom_taped_eggplant",
-        "models": [
-            {"name": "Gold Sneaker", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200715791.png?raw=true"},
-            {"name": "Paul The Eggplant", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201628865.png?raw=true"},
-            {"name": "Adult Toy", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201700100.png?raw=true"},
-            {"name": "Golden", "rarityPermille": 8, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195914455.png?raw=true"},
-            {"name": "Silver", "rarityPermille": 8, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200004319.png?raw=true"},
-            {"name": "Sapphire", "rarityPermille": 8, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200031197.png?raw=true"},
-            {"name": "Ducky", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200202226.png?raw=true"},
-            {"name": "Rich", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200532079.png?raw=true"},
-            {"name": "Cigars", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200822737.png?raw=true"},
-            {"name": "Red Bull", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201008559.png?raw=true"},
-            {"name": "iPhone", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201115777.png?raw=true"},
-            {"name": "To The Moon", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201544571.png?raw=true"},
-            {"name": "Wooden", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195940841.png?raw=true"},
-            {"name": "French Baguete", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200121211.png?raw=true"},
-            {"name": "Wild Eggplant", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200229914.png?raw=true"},
-            {"name": "Spray Can", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200601835.png?raw=true"},
-            {"name": "Bowling", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200851078.png?raw=true"},
-            {"name": "Brick", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200927659.png?raw=true"},
-            {"name": "Minion", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201042405.png?raw=true"},
-            {"name": "Pasta", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201518384.png?raw=true"},
-            {"name": "Banana", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195534071.png?raw=true"},
-            {"name": "Musical", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195604308.png?raw=true"},
-            {"name": "Bug", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195644493.png?raw=true"},
-            {"name": "Mop", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195719096.png?raw=true"},
-            {"name": "Mango", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195739251.png?raw=true"},
-            {"name": "Tooth Brush", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195800972.png?raw=true"},
-            {"name": "Newspaper", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_195826700.png?raw=true"},
-            {"name": "Kebab", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_200259658.png?raw=true"},
-            {"name": "Power Strip", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/Taped-Eggplant/blob/main/BackgroundEraser_20250827_201451237.png?raw=true"}
-        ],
-        "backdrops_source": "Plush Pepe",
-        "patterns_source": "Plush Pepe"
-    },
-    "Vintage Ferrari": {
-        "id": "custom_vintage_ferrari",
-        "models": [
-            {"name": "Bored Ape", "rarityPermille": 1, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232837620.png"},
-            {"name": "Diamond", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230807795.png"},
-            {"name": "Ford Mustang", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230929829.png"},
-            {"name": "The Swamp", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231349161.png"},
-            {"name": "North Korea", "rarityPermille": 8, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232859265.png"},
-            {"name": "Gold Ferrari", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230022017.png"},
-            {"name": "Leclerc F1", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230353227.png"},
-            {"name": "Tsunoda F1", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230633177.png"},
-            {"name": "Rothmans Porsche", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231207311.png"},
-            {"name": "Cybertruck", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232446458.png"},
-            # {"name": "Shaiba", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232614195.png"},
-            {"name": "American", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232648128.png"},
-            {"name": "Hell Car", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232813077.png"},
-            {"name": "Lamborghini", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_225824432.png"},
-            {"name": "Motorcycle", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230108359.png"},
-            {"name": "Helicopter", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230841030.png"},
-            {"name": "Bugatti", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230952790.png"},
-            {"name": "Aerostat", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231323581.png"},
-            {"name": "Beetle", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231520676.png"},
-            {"name": "Take Me Back To London", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231715347.png"},
-            {"name": "Beautiful People", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231955163.png"},
-            {"name": "Roller Coaster", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232330112.png"},
-            {"name": "Future", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232356807.png"},
-            {"name": "Upside Down", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232716367.png"},
-            {"name": "Accident", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232746147.png"},
-            {"name": "Golf Cart", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230709859.png"},
-            {"name": "Taxi", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_230905043.png"},
-            {"name": "Back To The Future", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231014793.png"},
-            {"name": "Tractor", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231244911.png"},
-            {"name": "Despicable Me", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231414903.png"},
-            {"name": "Ghostbusters", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_231520676.png"},
-            {"name": "Mr. Bean", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232118455.png"},
-            {"name": "Ducky", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232300190.png"},
-            {"name": "Transporter T1", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232513956.png"},
-            {"name": "Watermelon", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/Vintage-Ferrari/main/BackgroundEraser_20250829_232543790.png"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Rich Frog": {
-        "id": "custom_rich_frog",
-        "limit": 300,
-        "models": [
-            {"name": "Old Movie", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012742001.png"},
-            {"name": "Diamond", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012429267.png"},
-            {"name": "Red Diamond", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012455524.png"},
-            {"name": "Business", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012520124.png"},
-            {"name": "Telegram", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013004928.png"},
-            {"name": "Pepe", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013048306.png"},
-            {"name": "Galaxy", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013237557.png"},
-            # {"name": "Shaiba", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013427809.png"},
-            {"name": "Silver", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012356530.png"},
-            {"name": "From The Hell", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012409591.png"},
-            {"name": "Old", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012443079.png"},
-            {"name": "Soldier", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012558144.png"},
-            {"name": "Poker", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012757225.png"},
-            {"name": "Zombie", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013004928.png"},
-            {"name": "Satoshi Natokama", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013017488.png"},
-            {"name": "The Open Network", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013033825.png"},
-            {"name": "BDSM", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013107410.png"},
-            {"name": "Angelic", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013121916.png"},
-            {"name": "Rapper", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013335968.png"},
-            {"name": "Mermaid", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013354933.png"},
-            {"name": "Freddy's Frog", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013459472.png"},
-            {"name": "Umbrella", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012540549.png"},
-            {"name": "Wooden", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012623191.png"},
-            {"name": "Bad Quality", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012643696.png"},
-            {"name": "Pink", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012815025.png"},
-            {"name": "Butterfly", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012831763.png"},
-            {"name": "Rainbow", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012857269.png"},
-            {"name": "Hawaii", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013140547.png"},
-            {"name": "Gamer", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013207148.png"},
-            {"name": "Pickme", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013221620.png"},
-            {"name": "Watermelon", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013250229.png"},
-            {"name": "Cactus", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013304943.png"},
-            {"name": "Red", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013441382.png"},
-            {"name": "Snowy", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013518774.png"},
-            {"name": "Tiger", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_013900673.png"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Sheeran Guitar": {
-        "id": "custom_sheeran_guitar",
-        "limit": 500,
-        "models": [
-            {"name": "Minion", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010828869.png"},
-            {"name": "Darkness", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010917671.png"},
-            {"name": "Sponge Bob", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011122889.png"},
-            {"name": "Emelard", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011206969.png"},
-            {"name": "Golden", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_022612251.png"},
-            {"name": "Sapphire", "rarityPermille": 8, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_022557588.png"},
-            {"name": "Electric", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010415814.png"},
-            {"name": "Watery", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010543207.png"},
-            {"name": "Lava Stone", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010608356.png"},
-            {"name": "Old", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010725595.png"},
-            {"name": "Banjo", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010740321.png"},
-            {"name": "Russian", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010843719.png"},
-            {"name": "Slipknot", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010943972.png"},
-            {"name": "Yellow Wood", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005818708.png"},
-            {"name": "Virus", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005851841.png"},
-            {"name": "Mathematics", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005949661.png"},
-            {"name": "Divide", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010004362.png"},
-            {"name": "Multiply", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010049483.png"},
-            {"name": "Plus", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010142885.png"},
-            {"name": "Equals", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010221112.png"},
-            {"name": "Subtract", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010314441.png"},
-            {"name": "Emo", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010440657.png"},
-            {"name": "Poopie", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010630535.png"},
-            {"name": "Stickers", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010654844.png"},
-            {"name": "Mexican", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010756062.png"},
-            {"name": "Chinese", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010810805.png"},
-            {"name": "Fire On Fire", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011024645.png"},
-            {"name": "Witch", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011107534.png"},
-            {"name": "Hawaii", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011136893.png"},
-            {"name": "Minecraft", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005837327.png"},
-            {"name": "Ancient", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005913329.png"},
-            {"name": "Greenwood", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_005933291.png"},
-            {"name": "Fluffy", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010330086.png"},
-            {"name": "Electric Purple", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_010519545.png"},
-            {"name": "Lego House", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011041563.png"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Dancing Cactus": {
-        "id": "custom_dancing_cactus",
-        "limit": 1000,
-        "models": [
-            {"name": "Golden", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011316070.png"},
-            {"name": "Diamonds", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011350480.png"},
-            {"name": "Rainbow", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011445647.png"},
-            {"name": "Drought", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011516035.png"},
-            {"name": "Electric", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011559687.png"},
-            {"name": "Silver", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011754280.png"},
-            {"name": "Virus", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011906408.png"},
-            {"name": "Milfa", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012304698.png"},
-            {"name": "Arabic", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012318660.png"},
-            {"name": "Plushy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011410903.png"},
-            {"name": "Sky", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011626338.png"},
-            {"name": "Egypt", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011640892.png"},
-            {"name": "Chinese", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011707770.png"},
-            {"name": "Greek", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011723289.png"},
-            {"name": "Owww", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011821198.png"},
-            {"name": "Business", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011834166.png"},
-            {"name": "Skeleton", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011925666.png"},
-            {"name": "Cabels", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011942350.png"},
-            {"name": "Creepy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012014199.png"},
-            {"name": "Budni Cowboya", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012028668.png"},
-            {"name": "Marble", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012132211.png"},
-            {"name": "Hawaii", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012157170.png"},
-            {"name": "Ed Sheeran", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012210326.png"},
-            {"name": "Pandemic", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012223282.png"},
-            {"name": "Play", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011302760.png"},
-            {"name": "Ancient", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011335854.png"},
-            {"name": "Wooden", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011500397.png"},
-            {"name": "Pink", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011530016.png"},
-            {"name": "In Pain", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011740171.png"},
-            {"name": "Sandy", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_011959216.png"},
-            {"name": "Kissed", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012044125.png"},
-            {"name": "Blue", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012059061.png"},
-            {"name": "Robotic", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012112591.png"},
-            {"name": "Sapphire", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012236420.png"},
-            {"name": "Gray", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/sheeranGifts/main/BackgroundEraser_20250911_012250549.png"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Precious Capybara": {
-        "id": "custom_precious_capybara",
-        "limit": 500,
-        "models": [
-            {"name": "Jacuzzi", "rarityPermille": 2, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210307885.png"},
-            {"name": "Golden", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210240489.png"},
-            {"name": "Adult One", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225206788.png"},
-            {"name": "Pumpkin", "rarityPermille": 5, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225544940.png"},
-            {"name": "Forggy", "rarityPermille": 8, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210319839.png"},
-            {"name": "Rapper", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210330068.png"},
-            {"name": "Frankenstein", "rarityPermille": 10, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225554989.png"},
-            {"name": "Glassy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210253371.png"},
-            {"name": "Way Of Water", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210352147.png"},
-            {"name": "Galaxy", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210404469.png"},
-            {"name": "Spider", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225231111.png"},
-            {"name": "Toddler", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225240417.png"},
-            {"name": "Santa", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225336333.png"},
-            {"name": "Poseidon", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225414819.png"},
-            {"name": "Angel", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225423656.png"},
-            {"name": "Pickme", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225441409.png"},
-            {"name": "Toxic", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225452770.png"},
-            {"name": "Firing", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225503008.png"},
-            {"name": "Biohazard", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225512435.png"},
-            {"name": "Orange", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225522038.png"},
-            {"name": "Trapped", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225605504.png"},
-            {"name": "Bee", "rarityPermille": 20, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225615944.png"},
-            {"name": "Astronaut", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210418934.png"},
-            {"name": "Fog", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_210434612.png"},
-            {"name": "Octopus", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225218187.png"},
-            {"name": "Lava", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225249443.png"},
-            {"name": "Halloween", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225259219.png"},
-            {"name": "Clown", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225309107.png"},
-            {"name": "Wooden", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225318227.png"},
-            {"name": "Ancient", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225327084.png"},
-            {"name": "Indian", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225346205.png"},
-            {"name": "Egypt", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225355579.png"},
-            {"name": "Chinese", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225405044.png"},
-            {"name": "Cherry", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225432503.png"},
-            {"name": "Icy", "rarityPermille": 30, "image": "https://raw.githubusercontent.com/Vasiliy-katsyka/capybara/main/BackgroundEraser_20251015_225532869.png"}
-        ],
-        "backdrops_source": "Toy Bear",
-        "patterns_source": "Toy Bear"
-    },
-    "Precious Toilet": {
-        "id": "custom_precious_toilet",
-        "price": 200,
-        "limit": 500,
-        "defaultImage": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_170327637.png?raw=true",
-        "models": [
-            {"name": "Skibidi Toilet", "rarityPermille": 1, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162519102.png?raw=true"},
-            {"name": "Frogs", "rarityPermille": 2, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162953946.png?raw=true"},
-            {"name": "Ducks", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163305571.png?raw=true"},
-            {"name": "Bitcoin", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163357228.png?raw=true"},
-            {"name": "Ton", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163421791.png?raw=true"},
-            {"name": "Pickachu", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163444319.png?raw=true"},
-            {"name": "Sapphire", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162435851.png?raw=true"},
-            {"name": "Wooden", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162712404.png?raw=true"},
-            {"name": "Witch", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162930035.png?raw=true"},
-            {"name": "Poopy", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163552921.png?raw=true"},
-            {"name": "Deathly", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163614265.png?raw=true"},
-            {"name": "Sharp", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163637245.png?raw=true"},
-            {"name": "Beach Toilet", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163707253.png?raw=true"},
-            {"name": "Spiders", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163732843.png?raw=true"},
-            {"name": "Dirty", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163817901.png?raw=true"},
-            {"name": "Easter", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163841820.png?raw=true"},
-            {"name": "Subway", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163932812.png?raw=true"},
-            {"name": "Black & White", "rarityPermille": 20, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_164030257.png?raw=true"},
-            {"name": "Light Blue", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162533757.png?raw=true"},
-            {"name": "Tropical Toilet", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162546519.png?raw=true"},
-            {"name": "Cyberpunk", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162611345.png?raw=true"},
-            {"name": "Marble", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_162858374.png?raw=true"},
-            {"name": "Ferrari", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163020303.png?raw=true"},
-            {"name": "Red Bull", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163050578.png?raw=true"},
-            {"name": "Ancient", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163755259.png?raw=true"},
-            {"name": "Grave Toilet", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163906810.png?raw=true"},
-            {"name": "Emo Toilet", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/toilets/blob/main/BackgroundEraser_20251101_163953834.png?raw=true"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Lovely Bottle": {
-        "id": "custom_lovely_bottle",
-        "price": 500000,
-        "limit": 100,
-        "defaultImage": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_013117076.png?raw=true",
-        "models": [
-            {"name": "Cryptoking", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011940129.png?raw=true"},
-            {"name": "Golden", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012052637.png?raw=true"},
-            {"name": "Aquarium", "rarityPermille": 5, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_165843462.png?raw=true"},
-            {"name": "Devil Heart", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011245257.png?raw=true"},
-            {"name": "Heaven", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011309728.png?raw=true"},
-            {"name": "Froggy Heart", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011443155.png?raw=true"},
-            {"name": "JBL Speaker", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011918718.png?raw=true"},
-            {"name": "Circus", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012124462.png?raw=true"},
-            {"name": "Catty", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012231268.png?raw=true"},
-            {"name": "Jackpot", "rarityPermille": 10, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012326319.png?raw=true"},
-            {"name": "Emo Heart", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011219423.png?raw=true"},
-            {"name": "Halloween", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011332491.png?raw=true"},
-            {"name": "Aztec Heart", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011356537.png?raw=true"},
-            {"name": "Frozen Love", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011533200.png?raw=true"},
-            {"name": "Rocky", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011558060.png?raw=true"},
-            {"name": "Cyberpunk", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011745125.png?raw=true"},
-            {"name": "Swamp", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011813760.png?raw=true"},
-            {"name": "Soviet Love", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012026952.png?raw=true"},
-            {"name": "Pickme", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012258274.png?raw=true"},
-            {"name": "Silver", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012352140.png?raw=true"},
-            {"name": "Talk Dirty", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012440735.png?raw=true"},
-            {"name": "Pink", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012504913.png?raw=true"},
-            {"name": "Electric Love", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012528059.png?raw=true"},
-            {"name": "Honeycomb", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012551391.png?raw=true"},
-            {"name": "Slime", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012642262.png?raw=true"},
-            {"name": "Witch", "rarityPermille": 25, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012723059.png?raw=true"},
-            {"name": "Beach", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011420726.png?raw=true"},
-            {"name": "Hawaii Love", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011509869.png?raw=true"},
-            {"name": "Chinese", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011623214.png?raw=true"},
-            {"name": "Egypt", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011720439.png?raw=true"},
-            {"name": "Submarine", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_011855527.png?raw=true"},
-            {"name": "Rainbow", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012004148.png?raw=true"},
-            {"name": "BBQ", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012154250.png?raw=true"},
-            {"name": "Formula 1", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012416485.png?raw=true"},
-            {"name": "Asphalt", "rarityPermille": 30, "image": "https://github.com/Vasiliy-katsyka/13-gifts/blob/main/BackgroundEraser_20251112_012613417.png?raw=true"}
-        ],
-        "backdrops_source": "Snoop Dogg",
-        "patterns_source": "Snoop Dogg"
-    },
-    "Rocky Present": {
-        "id": "custom_rocky_present",
-        "price": 5000,
-        "limit": 500,
-        "defaultImage": "https://raw.githubusercontent.com/Vasiliy-katsyka/13-gifts/refs/heads/main/MadEmoji_AgADCj4AAovVoEk.png"
-    },
-    "Lovely Letter": {
-        "id": "custom_lovely_letter",
-        "price": 500,
-        "limit": 5000,
-        "defaultImage": "https://raw.githubusercontent.com/Vasiliy-katsyka/13-gifts/refs/heads/main/BirthdayCollection_AgADMj0AAksZ-Eg.png"
+# Inline queries write nothing. A result id names the action and the user it was offered to
+# ("send:<tg_id>:<nonce>"), and chosen_inline_result carries the query the result came from, so the
+# action is resolved again from that query when the user picks it. pending_inline_actions only
+# records chosen results, so a chosen_inline_result delivered twice (possibly to two workers) runs
+# once; run_pending_inline_action_expiry clears rows older than PENDING_INLINE_ACTION_TTL_SECONDS.
+PENDING_INLINE_ACTION_TTL_SECONDS = 600
+INLINE_ACTION_COMMANDS = {"send": "send", "create_and_send": "createandsend"}  # action -> inline command
+
+def new_inline_result_id(action, sender_id):
+    return f"{action}:{sender_id}:{uuid.uuid4().hex[:16]}"
+
+def claim_inline_result(cur, result_id, action_details):
+    """Records a chosen inline result. False if it was already handled. The caller commits."""
+    cur.execute(
+        "INSERT INTO pending_inline_actions (result_id, payload) VALUES (%s, %s) ON CONFLICT (result_id) DO NOTHING RETURNING result_id;",
+        (result_id, json.dumps(action_details))
+    )
+    return cur.fetchone() is not None
+
+def expire_pending_inline_actions():
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM pending_inline_actions WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s);",
+                (PENDING_INLINE_ACTION_TTL_SECONDS,)
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Failed to expire pending inline actions: {e}", exc_info=True)
+    finally:
+        put_db_connection(conn)
+
+def run_pending_inline_action_expiry():
+    """Background loop; every worker runs it, and a DELETE that finds nothing is cheap."""
+    while True:
+        time.sleep(PENDING_INLINE_ACTION_TTL_SECONDS)
+        expire_pending_inline_actions()
+
+def get_pending_inline_action_stats():
+    """Size of the chosen inline result log, for /api/metrics."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)) FROM pending_inline_actions;",
+                (PENDING_INLINE_ACTION_TTL_SECONDS,)
+            )
+            total, expired = cur.fetchone()
+        return {"size": total, "expired": expired, "ttl_seconds": PENDING_INLINE_ACTION_TTL_SECONDS}
+    except Exception as e:
+        app.logger.error(f"Failed to read pending inline action stats: {e}", exc_info=True)
+        return None
+    finally:
+        put_db_connection(conn)
+
+
+# --- CUSTOM GIFT CATALOG ---
+# Custom gifts, asset source overrides for regular gifts and gift authors live in customgifts.json.
+# The file is loaded once at import and re-read when its mtime changes (checked at most every
+# CUSTOM_GIFTS_RELOAD_CHECK_SECONDS), so catalog edits don't need a redeploy.
+CUSTOM_GIFTS_PATH = os.environ.get('CUSTOM_GIFTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'customgifts.json'))
+CUSTOM_GIFTS_RELOAD_CHECK_SECONDS = 5
+
+CUSTOM_GIFTS_DATA = {}
+ASSET_SOURCE_OVERRIDES = {}
+custom_gift_catalog = {}
+custom_gift_catalog_lock = threading.Lock()
+
+def _build_custom_gift_catalog(doc, mtime):
+    custom_gifts = doc.get('custom_gifts', {})
+    overrides = doc.get('asset_source_overrides', {})
+
+    authors = dict(doc.get('authors', {}))
+    authors.update({name: data['author'] for name, data in custom_gifts.items() if data.get('author')})
+    by_author = {}
+    for name, author in authors.items():
+        by_author.setdefault(author, []).append(name)
+
+    parts_sources = {}
+    for name, data in list(overrides.items()) + list(custom_gifts.items()):
+        parts_sources[name] = {
+            "backdrops_source": data.get('backdrops_source', name),
+            "patterns_source": data.get('patterns_source', name)
+        }
+
+    # GitHub repos the catalog's images come from; the asset proxy fetches from no others.
+    github_repos = set(re.findall(r'https://(?:raw\.githubusercontent\.com|github\.com)/([^/"\s]+/[^/"\s]+/)', json.dumps(doc)))
+
+    return {
+        "custom_gifts": custom_gifts,
+        "asset_source_overrides": overrides,
+        "github_repos": frozenset(github_repos),
+        "by_id": {data['id']: name for name, data in custom_gifts.items() if data.get('id')},
+        "limits": {data['id']: data['limit'] for data in custom_gifts.values() if data.get('id') and 'limit' in data},
+        "prices": {name: data.get('price', 0) for name, data in custom_gifts.items()},
+        "authors": authors,
+        "by_author": by_author,
+        "parts_sources": parts_sources,
+        "mtime": mtime,
+        "checked_at": time.monotonic()
     }
-}
+
+def load_custom_gift_catalog():
+    global CUSTOM_GIFTS_DATA, ASSET_SOURCE_OVERRIDES, custom_gift_catalog
+    mtime = os.stat(CUSTOM_GIFTS_PATH).st_mtime
+    with open(CUSTOM_GIFTS_PATH, encoding='utf-8') as f:
+        catalog = _build_custom_gift_catalog(json.load(f), mtime)
+    with custom_gift_catalog_lock:
+        custom_gift_catalog = catalog
+        CUSTOM_GIFTS_DATA = catalog['custom_gifts']
+        ASSET_SOURCE_OVERRIDES = catalog['asset_source_overrides']
+    return catalog
+
+def reload_custom_gift_catalog_if_changed():
+    """Reloads customgifts.json if it changed on disk. A broken file keeps the previous catalog."""
+    catalog = custom_gift_catalog
+    now = time.monotonic()
+    if now - catalog['checked_at'] < CUSTOM_GIFTS_RELOAD_CHECK_SECONDS:
+        return False
+    catalog['checked_at'] = now
+
+    try:
+        mtime = os.stat(CUSTOM_GIFTS_PATH).st_mtime
+    except OSError as e:
+        app.logger.error(f"Cannot stat the custom gift catalog: {e}")
+        return False
+    if mtime == catalog['mtime']:
+        return False
+
+    try:
+        new_catalog = load_custom_gift_catalog()
+    except (OSError, ValueError) as e:
+        catalog['mtime'] = mtime  # Don't retry until the file changes again.
+        app.logger.error(f"Keeping the previous custom gift catalog, reload failed: {e}")
+        return False
+
+    # Derived caches hold models, sources and names from the old catalog.
+    collectible_parts_cache.clear()
+    submit_background_task(refresh_gift_name_index, dedup_key="gift_name_index")
+    if new_catalog['limits'] != catalog['limits']:
+        submit_background_task(sync_limited_gift_stock_now, dedup_key="limited_gift_stock")
+    app.logger.info(f"Reloaded custom gift catalog: {len(new_catalog['custom_gifts'])} custom gifts.")
+    return True
+
+def get_custom_gift_name_by_id(gift_type_id):
+    return custom_gift_catalog['by_id'].get(gift_type_id)
+
+def get_custom_gift_price(gift_name):
+    return custom_gift_catalog['prices'].get(gift_name, 0)
+
+def is_limited_gift_type(gift_type_id):
+    return gift_type_id in custom_gift_catalog['limits']
+
+def get_gift_author(gift_name):
+    return custom_gift_catalog['authors'].get(gift_name)
+
+def get_gifts_by_author(author):
+    return custom_gift_catalog['by_author'].get(author, [])
+
+def get_gift_parts_sources(gift_name):
+    """Where on the CDN a gift's backdrops and patterns live; most gifts use their own folders."""
+    return custom_gift_catalog['parts_sources'].get(gift_name) or {"backdrops_source": gift_name, "patterns_source": gift_name}
+
+load_custom_gift_catalog()
+
+@app.before_request
+def check_custom_gift_catalog():
+    reload_custom_gift_catalog_if_changed()
 
 MAX_BUY_PER_LEVEL_MAP = {
     1: 20, 2: 50, 3: 100, 4: 500, 5: 1000, 6: 5000, 7: 10000,
@@ -640,249 +484,135 @@ def calculate_user_level(gift_count):
     return 1
 
 # --- DATABASE HELPERS ---
-def init_db():
-    conn = get_db_connection()
-    if not conn:
-        app.logger.warning("Database connection failed during initialization.")
-        return
-
-    try:
-        with conn.cursor() as cur:
-            # --- UPDATED: accounts table with stars_balance and music_status ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS accounts (
-                    tg_id BIGINT PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE,
-                    full_name VARCHAR(255),
-                    avatar_url TEXT,
-                    bio TEXT,
-                    phone_number VARCHAR(50) UNIQUE,
-                    bot_state VARCHAR(255),
-                    music_status TEXT,
-                    stars_balance NUMERIC(20, 2) DEFAULT 0.0,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Add unique constraint if it doesn't exist
-            cur.execute("""
-                DO $$ BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM pg_constraint WHERE conname = 'accounts_phone_number_key'
-                    ) THEN
-                        ALTER TABLE accounts ADD CONSTRAINT accounts_phone_number_key UNIQUE (phone_number);
-                    END IF;
-                END $$;
-            """)
-            # Add new columns to existing accounts table if they don't exist
-            cur.execute("""
-                DO $$ BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='accounts' AND column_name='stars_balance') THEN
-                        ALTER TABLE accounts ADD COLUMN stars_balance NUMERIC(20, 2) DEFAULT 0.0;
-                    END IF;
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='accounts' AND column_name='music_status') THEN
-                        ALTER TABLE accounts ADD COLUMN music_status TEXT;
-                    END IF;
-                END $$;
-            """)
-
-            # --- UPDATED: gifts table with is_on_sale and sale_price ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS gifts (
-                    instance_id VARCHAR(50) PRIMARY KEY,
-                    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    sender_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL, -- NEW
-                    gift_type_id VARCHAR(255) NOT NULL, gift_name VARCHAR(255) NOT NULL,
-                    original_image_url TEXT, lottie_path TEXT, is_collectible BOOLEAN DEFAULT FALSE,
-                    collectible_data JSONB, collectible_number INT,
-                    acquired_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    is_hidden BOOLEAN DEFAULT FALSE, is_pinned BOOLEAN DEFAULT FALSE, is_worn BOOLEAN DEFAULT FALSE,
-                    pin_order INT, is_on_sale BOOLEAN DEFAULT FALSE, sale_price INT
-                );
-            """)
-            # Add new columns to existing gifts table if they don't exist
-            cur.execute("""
-                DO $$ BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='is_on_sale') THEN
-                        ALTER TABLE gifts ADD COLUMN is_on_sale BOOLEAN DEFAULT FALSE;
-                    END IF;
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='sale_price') THEN
-                        ALTER TABLE gifts ADD COLUMN sale_price INT;
-                    END IF;
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='sender_id') THEN
-                        ALTER TABLE gifts ADD COLUMN sender_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL;
-                    END IF;
-                END $$;
-            """)
-            # Add new columns to existing gifts table if they don't exist
-            cur.execute("""
-                DO $$ BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='is_on_sale') THEN
-                        ALTER TABLE gifts ADD COLUMN is_on_sale BOOLEAN DEFAULT FALSE;
-                    END IF;
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='sale_price') THEN
-                        ALTER TABLE gifts ADD COLUMN sale_price INT;
-                    END IF;
-                END $$;
-            """)
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS friends (
-                    id SERIAL PRIMARY KEY,
-                    user_one_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    user_two_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_one_id, user_two_id)
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_friends_user_one ON friends (user_one_id);")
-            
-            # --- Indexes for gifts table ---
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_gifts_owner_id ON gifts (owner_id);")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_gifts_type_and_number ON gifts (gift_type_id, collectible_number);")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_gifts_pin_order ON gifts (owner_id, pin_order);")
-
-            # --- Other tables (unchanged from original) ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS collectible_usernames (
-                    id SERIAL PRIMARY KEY,
-                    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    username VARCHAR(255) UNIQUE NOT NULL
-                );
-            """)
-            
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS posts (
-                    id SERIAL PRIMARY KEY,
-                    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    content TEXT NOT NULL,
-                    views INT DEFAULT 0,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_owner_id ON posts (owner_id);")
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS post_reactions (
-                    id SERIAL PRIMARY KEY,
-                    post_id INT REFERENCES posts(id) ON DELETE CASCADE,
-                    user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    reaction_emoji VARCHAR(10) NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(post_id, user_id, reaction_emoji)
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_post_reactions_post_id ON post_reactions (post_id);")
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_subscriptions (
-                    id SERIAL PRIMARY KEY,
-                    subscriber_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    target_user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    notification_type VARCHAR(20) NOT NULL, -- 'mentions' or 'new_posts'
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(subscriber_id, target_user_id, notification_type)
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_user_subscriptions_target ON user_subscriptions (target_user_id, notification_type);")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_PATTERN = re.compile(r'^(\d{4})_([\w-]+)\.sql$')
+SCHEMA_MIGRATION_LOCK_ID = 7_402_612
+
+def load_migrations():
+    """Returns [(version, name, path)] for migrations/NNNN_name.sql, ordered by version."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {MIGRATIONS_DIR}")
+    return migrations
+
+def _current_schema_version(cur):
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+def run_migrations(conn):
+    """Applies pending migrations, one transaction each. Returns the number applied.
+
+    The version check runs without a lock, so an up-to-date database costs two cheap queries.
+    Otherwise a session advisory lock makes concurrent processes wait while one of them migrates.
+    """
+    migrations = load_migrations()
+    latest = migrations[-1][0] if migrations else 0
+    with conn.cursor() as cur:
+        current = _current_schema_version(cur)
+        conn.commit()
+        if current >= latest:
+            return 0
 
+        cur.execute("SELECT pg_advisory_lock(%s);", (SCHEMA_MIGRATION_LOCK_ID,))
+        try:
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS giveaways (
-                    id SERIAL PRIMARY KEY,
-                    creator_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL,
-                    channel_id BIGINT,
-                    end_date TIMESTAMP WITH TIME ZONE,
-                    winner_rule VARCHAR(20) NOT NULL,
-                    status VARCHAR(20) NOT NULL DEFAULT 'pending_setup',
-                    message_id BIGINT,
-                    last_update_time TIMESTAMP WITH TIME ZONE,
-                    required_channels TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
                 );
             """)
-            cur.execute("""
-                DO $$ BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='giveaways' AND column_name='required_channels') THEN
-                        ALTER TABLE giveaways ADD COLUMN required_channels TEXT;
-                    END IF;
-                END $$;
-            """)
+            conn.commit()
+            # Another process may have migrated while we waited for the lock.
+            current = _current_schema_version(cur)
+            applied = 0
+            for version, name, path in migrations:
+                if version <= current:
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    sql = f.read()
+                started = time.monotonic()
+                try:
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s);", (version, name))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    app.logger.error(f"Migration {version:04d}_{name} failed.", exc_info=True)
+                    raise
+                applied += 1
+                app.logger.info(f"Applied migration {version:04d}_{name} in {time.monotonic() - started:.2f}s.")
+            return applied
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (SCHEMA_MIGRATION_LOCK_ID,))
+            conn.commit()
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS giveaway_gifts (
-                    id SERIAL PRIMARY KEY,
-                    giveaway_id INT REFERENCES giveaways(id) ON DELETE CASCADE,
-                    gift_instance_id VARCHAR(50) REFERENCES gifts(instance_id) ON DELETE CASCADE
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS giveaway_participants (
-                    id SERIAL PRIMARY KEY,
-                    giveaway_id INT REFERENCES giveaways(id) ON DELETE CASCADE,
-                    user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    join_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(giveaway_id, user_id)
-                );
-            """)
-            
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users_with_custom_gifts_enabled (
-                    tg_id BIGINT PRIMARY KEY REFERENCES accounts(tg_id) ON DELETE CASCADE
-                );
-            """)
+def sync_limited_gift_stock(cur):
+    """Brings limited_gifts_stock in line with the limits in CUSTOM_GIFTS_DATA, touching only rows that changed."""
+    desired = custom_gift_catalog['limits']
+    if not desired:
+        return 0
+    cur.execute("SELECT gift_type_id, total_stock FROM limited_gifts_stock WHERE gift_type_id = ANY(%s);", (list(desired),))
+    current = {row[0]: row[1] for row in cur.fetchall()}
+    changed = [(gift_type_id, limit) for gift_type_id, limit in desired.items() if current.get(gift_type_id) != limit]
+    if not changed:
+        return 0
+    # New rows start at the limit minus gifts already minted; existing rows only change their total, as before.
+    execute_values(cur, """
+        INSERT INTO limited_gifts_stock (gift_type_id, total_stock, remaining_stock)
+        SELECT v.gift_type_id, v.total_stock, v.total_stock - minted.count
+        FROM (VALUES %s) AS v(gift_type_id, total_stock)
+        CROSS JOIN LATERAL (SELECT COUNT(*) AS count FROM gifts g WHERE g.gift_type_id = v.gift_type_id) AS minted
+        ON CONFLICT (gift_type_id) DO UPDATE SET total_stock = EXCLUDED.total_stock;
+    """, changed, template="(%s, %s::int)")
+    return len(changed)
+
+def sync_limited_gift_stock_now():
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            synced = sync_limited_gift_stock(cur)
+        conn.commit()
+        app.logger.info(f"Synced {synced} limited gift stock rows.")
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Failed to sync limited gift stock: {e}", exc_info=True)
+    finally:
+        put_db_connection(conn)
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS collections (
-                    id SERIAL PRIMARY KEY,
-                    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
-                    name VARCHAR(255) NOT NULL,
-                    display_order INT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(owner_id, name)
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS gift_collections (
-                    id SERIAL PRIMARY KEY,
-                    gift_instance_id VARCHAR(50) REFERENCES gifts(instance_id) ON DELETE CASCADE,
-                    collection_id INT REFERENCES collections(id) ON DELETE CASCADE,
-                    order_in_collection INT,
-                    UNIQUE(gift_instance_id, collection_id)
-                );
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_collections_owner_id ON collections (owner_id);")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_gift_collections_collection_id ON gift_collections (collection_id);")
-            
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS limited_gifts_stock (
-                    gift_type_id VARCHAR(255) PRIMARY KEY,
-                    total_stock INT NOT NULL,
-                    remaining_stock INT NOT NULL
-                );
-            """)
+def seed_reference_data(cur):
+    cur.execute("""
+        INSERT INTO accounts (tg_id, username, full_name, avatar_url, bio)
+        VALUES (%s, %s, %s, %s, %s) ON CONFLICT (tg_id) DO NOTHING;
+    """, (TEST_ACCOUNT_TG_ID, 'system_test_account', 'Test Account', 'https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/main/DMJTGStarsEmoji_AgADUhMAAk9WoVI.png', 'This account holds sold gifts.'))
 
-            # --- Data Initialization Logic (unchanged from original) ---
-            for gift_name, gift_data in CUSTOM_GIFTS_DATA.items():
-                if 'limit' in gift_data:
-                    gift_type_id = gift_data['id']
-                    limit = gift_data['limit']
-                    cur.execute("""
-                        INSERT INTO limited_gifts_stock (gift_type_id, total_stock, remaining_stock)
-                        SELECT %s, %s, %s - (SELECT COUNT(*) FROM gifts WHERE gift_type_id = %s)
-                        ON CONFLICT (gift_type_id) DO UPDATE
-                        SET total_stock = EXCLUDED.total_stock;
-                    """, (gift_type_id, limit, limit, gift_type_id))
+def init_db():
+    conn = get_db_connection()
+    if not conn:
+        app.logger.warning("Database connection failed during initialization.")
+        return
 
-            cur.execute("SELECT 1 FROM accounts WHERE tg_id = %s;", (TEST_ACCOUNT_TG_ID,))
-            if not cur.fetchone():
-                cur.execute("""
-                    INSERT INTO accounts (tg_id, username, full_name, avatar_url, bio)
-                    VALUES (%s, %s, %s, %s, %s) ON CONFLICT (tg_id) DO NOTHING;
-                """, (TEST_ACCOUNT_TG_ID, 'system_test_account', 'Test Account', 'https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/main/DMJTGStarsEmoji_AgADUhMAAk9WoVI.png', 'This account holds sold gifts.'))
-            
-            # --- Final Commit and Logging ---
-            conn.commit()
-            app.logger.info("Database initialized successfully.")
-            
+    try:
+        started = time.monotonic()
+        applied = run_migrations(conn)
+        with conn.cursor() as cur:
+            if applied:
+                seed_reference_data(cur)
+            stock_rows = sync_limited_gift_stock(cur)
+        conn.commit()
+        app.logger.info(f"Database initialized in {(time.monotonic() - started) * 1000:.0f}ms "
+                        f"({applied} migrations applied, {stock_rows} stock rows synced).")
     except Exception as e:
         app.logger.error(f"Error during DB initialization: {e}", exc_info=True)
         if conn: conn.rollback()
@@ -890,6 +620,17 @@ def init_db():
         if conn: put_db_connection(conn)
 
 # --- UTILITY & HELPER FUNCTIONS ---
+def resolve_account_by_username(cur, username, columns="tg_id, username"):
+    """Case-insensitive account lookup by username ('@name' or 'name') through the username_lower index.
+
+    `columns` is interpolated into the query, so only pass literal column lists.
+    """
+    username = (username or '').strip().lstrip('@')
+    if not username:
+        return None
+    cur.execute(f"SELECT {columns} FROM accounts WHERE username_lower = LOWER(%s) LIMIT 1;", (username,))
+    return cur.fetchone()
+
 def is_custom_gift(gift_name):
     return gift_name in CUSTOM_GIFTS_DATA
 
@@ -903,13 +644,6 @@ def has_custom_gifts_enabled(cur, tg_id):
     except (ValueError, TypeError):
         return False
 
-def get_gift_author(gift_name):
-    if gift_name in ["Snoop Dogg", "Swag Bag", "Snoop Cigar", "Low Rider", "Westside Sign"]:
-        return "snoopdogg"
-    elif gift_name in ["Dildo", "Skebob", "Baggin' Cat"]:
-        return "Vasiliy939"
-    return None
-
 def get_chat_member(chat_id, user_id):
     url = f"{TELEGRAM_API_URL}/getChatMember"
     payload = {'chat_id': chat_id, 'user_id': user_id}
@@ -921,6 +655,42 @@ def get_chat_member(chat_id, user_id):
         app.logger.error(f"Failed to get chat member for user {user_id} in chat {chat_id}: {e}", exc_info=True)
         return None
 
+def get_chat_member_status(chat_id, user_id):
+    """
+    Returns the user's membership status in a chat ('member', 'left', ...) or None if the check failed.
+    Successful answers are cached per (chat, user); 'left'/'kicked' answers expire sooner so
+    users who subscribe after being told to are let in quickly. Failures are never cached.
+    """
+    cache_key = (str(chat_id).lower(), int(user_id))
+    now = time.time()
+    cached = channel_membership_cache.get(cache_key)
+    if cached:
+        status, expires_at = cached
+        if now < expires_at:
+            return status
+
+    member_info = get_chat_member(chat_id, user_id)
+    if not member_info or not member_info.get('ok'):
+        return None
+
+    status = member_info['result']['status']
+    ttl = CHANNEL_NON_MEMBER_TTL_SECONDS if status in NON_MEMBER_STATUSES else CHANNEL_MEMBER_TTL_SECONDS
+    if len(channel_membership_cache) >= CHANNEL_MEMBERSHIP_CACHE_MAX_ENTRIES:
+        # Drop expired entries first; if that's not enough, start over rather than grow unbounded.
+        for key in [k for k, (_, exp) in list(channel_membership_cache.items()) if exp <= now]:
+            channel_membership_cache.pop(key, None)
+        if len(channel_membership_cache) >= CHANNEL_MEMBERSHIP_CACHE_MAX_ENTRIES:
+            channel_membership_cache.clear()
+    channel_membership_cache[cache_key] = (status, now + ttl)
+    return status
+
+def get_unsubscribed_channels(channels, user_id):
+    """Checks all channels concurrently and returns the ones the user has not joined (or that could not be checked)."""
+    if not channels:
+        return []
+    statuses = list(membership_check_executor.map(lambda channel: get_chat_member_status(channel, user_id), channels))
+    return [channel for channel, status in zip(channels, statuses) if status is None or status in NON_MEMBER_STATUSES]
+
 def send_telegram_message(chat_id, text, reply_markup=None, disable_web_page_preview=False):
     url = f"{TELEGRAM_API_URL}/sendMessage"
     payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': disable_web_page_preview}
@@ -936,26 +706,110 @@ def send_telegram_message(chat_id, text, reply_markup=None, disable_web_page_pre
         app.logger.error(f"Failed to send message to chat_id {chat_id}: {e}", exc_info=True)
         return None
 
-def send_telegram_photo(chat_id, photo, caption=None, reply_markup=None):
+def telegram_media_cache_key(photo):
+    """Key under which a photo's Telegram file_id is cached: its URL, or the hash of its bytes."""
+    if isinstance(photo, str) and photo.startswith('http'):
+        return f"url:{photo}"
+    if isinstance(photo, str) and os.path.isfile(photo):
+        with open(photo, 'rb') as f:
+            return f"sha256:{hashlib.sha256(f.read()).hexdigest()}"
+    if isinstance(photo, bytes):
+        return f"sha256:{hashlib.sha256(photo).hexdigest()}"
+    if hasattr(photo, 'read'):
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: photo.read(65536), b''):
+            digest.update(chunk)
+        photo.seek(0)
+        return f"sha256:{digest.hexdigest()}"
+    return None  # Already a file_id
+
+def get_cached_telegram_file_id(cache_key):
+    with telegram_file_id_cache_lock:
+        file_id = telegram_file_id_cache.get(cache_key)
+    if file_id:
+        return file_id
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT file_id FROM telegram_media_cache WHERE source_key = %s;", (cache_key,))
+            row = cur.fetchone()
+    except Exception as e:
+        app.logger.error(f"Failed to read telegram media cache: {e}", exc_info=True)
+        return None
+    finally:
+        put_db_connection(conn)
+    if row:
+        _remember_telegram_file_id_locally(cache_key, row[0])
+        return row[0]
+    return None
+
+def _remember_telegram_file_id_locally(cache_key, file_id):
+    with telegram_file_id_cache_lock:
+        telegram_file_id_cache[cache_key] = file_id
+        telegram_file_id_cache.move_to_end(cache_key)
+        while len(telegram_file_id_cache) > TELEGRAM_FILE_ID_CACHE_MAX_ENTRIES:
+            telegram_file_id_cache.popitem(last=False)
+
+def store_telegram_file_id(cache_key, file_id):
+    _remember_telegram_file_id_locally(cache_key, file_id)
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO telegram_media_cache (source_key, file_id) VALUES (%s, %s)
+                ON CONFLICT (source_key) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = CURRENT_TIMESTAMP;
+            """, (cache_key, file_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Failed to store telegram file_id for {cache_key}: {e}", exc_info=True)
+    finally:
+        put_db_connection(conn)
+
+def forget_telegram_file_id(cache_key):
+    with telegram_file_id_cache_lock:
+        telegram_file_id_cache.pop(cache_key, None)
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM telegram_media_cache WHERE source_key = %s;", (cache_key,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Failed to forget telegram file_id for {cache_key}: {e}", exc_info=True)
+    finally:
+        put_db_connection(conn)
+
+def _post_telegram_photo(chat_id, photo, caption=None, reply_markup=None):
+    """Calls sendPhoto once. Returns (response JSON, None) on success or (None, Telegram's error description)."""
     url = f"{TELEGRAM_API_URL}/sendPhoto"
     data = {'chat_id': chat_id}
     files = None
     file_to_close = None
 
-    if isinstance(photo, str) and photo.startswith('http'):
-        data['photo'] = photo
+    if isinstance(photo, str) and (photo.startswith('http') or not os.path.isfile(photo)):
+        data['photo'] = photo  # URL or a Telegram file_id
     elif isinstance(photo, str):
         try:
             file_to_close = open(photo, 'rb')
             files = {'photo': file_to_close}
         except IOError as e:
             app.logger.error(f"Could not open file {photo} to send to chat_id {chat_id}: {e}", exc_info=True)
-            return None
-    elif isinstance(photo, (bytes, io.BytesIO)):
+            return None, None
+    elif isinstance(photo, bytes):
         files = {'photo': ('generated_gift.png', photo, 'image/png')}
+    elif hasattr(photo, 'read'):
+        photo.seek(0)  # May be a retry after a stale file_id
+        files = {'photo': ('generated_gift', photo)}
     else:
         app.logger.error(f"Unsupported photo type for chat_id {chat_id}: {type(photo)}")
-        return None
+        return None, None
 
     if caption:
         data['caption'] = caption
@@ -965,15 +819,43 @@ def send_telegram_photo(chat_id, photo, caption=None, reply_markup=None):
 
     try:
         response = requests.post(url, data=data, files=files, timeout=20)
+        if response.status_code == 400:
+            description = response.json().get('description', '')
+            app.logger.error(f"Telegram rejected photo for chat_id {chat_id}: {description}")
+            return None, description
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        return response.json(), None
+    except (requests.RequestException, ValueError) as e:
         app.logger.error(f"Failed to send photo to chat_id {chat_id}: {e}", exc_info=True)
-        return None
+        return None, None
     finally:
         if file_to_close and not file_to_close.closed:
             file_to_close.close()
 
+def send_telegram_photo(chat_id, photo, caption=None, reply_markup=None, cache_key=None):
+    """
+    Sends a photo given as URL, file path, bytes, open file or Telegram file_id.
+    The file_id Telegram returns is cached under `cache_key` (default: the URL or content hash),
+    so the next send of the same image is a reference instead of an upload. A cached id that
+    Telegram no longer accepts is dropped and the original photo is sent instead.
+    """
+    if cache_key is None:
+        cache_key = telegram_media_cache_key(photo)
+    file_id = get_cached_telegram_file_id(cache_key) if cache_key else None
+    if file_id:
+        result, error = _post_telegram_photo(chat_id, file_id, caption, reply_markup)
+        if result or not (error and TELEGRAM_STALE_FILE_ID_PATTERN.search(error)):
+            return result
+        app.logger.warning(f"Dropping stale telegram file_id for {cache_key}: {error}")
+        forget_telegram_file_id(cache_key)
+
+    result, _ = _post_telegram_photo(chat_id, photo, caption, reply_markup)
+    if result and cache_key:
+        photo_sizes = result.get('result', {}).get('photo') or []
+        if photo_sizes:
+            store_telegram_file_id(cache_key, photo_sizes[-1]['file_id'])
+    return result
+
 def edit_telegram_message_text(chat_id, message_id, text, reply_markup=None, disable_web_page_preview=False):
     url = f"{TELEGRAM_API_URL}/editMessageText"
     payload = {'chat_id': chat_id, 'message_id': message_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': disable_web_page_preview}
@@ -1054,20 +936,13 @@ def fetch_collectible_parts(gift_name):
     patterns_source_encoded = gift_name_encoded
     models_list = []  # Initialize here
 
-    # Priority 1: Check for a hardcoded override for regular gifts with special asset paths.
-    if gift_name in ASSET_SOURCE_OVERRIDES:
-        override = ASSET_SOURCE_OVERRIDES[gift_name]
-        # Models are usually unique, so we don't override the models_url itself,
-        # but we do respect backdrop/pattern source overrides.
-        backdrops_source_encoded = quote(override.get("backdrops_source", gift_name))
-        patterns_source_encoded = quote(override.get("patterns_source", gift_name))
-    
-    # Priority 2: Check if it's a custom gift with its own source definitions.
-    elif gift_name in CUSTOM_GIFTS_DATA:
-        custom_data = CUSTOM_GIFTS_DATA[gift_name]
-        models_list = custom_data.get("models", [])
-        backdrops_source_encoded = quote(custom_data.get("backdrops_source", gift_name))
-        patterns_source_encoded = quote(custom_data.get("patterns_source", gift_name))
+    # Backdrops and patterns may come from another gift's folder (asset overrides and custom gifts).
+    # Models are usually unique, so only custom gifts bring their own models list.
+    sources = get_gift_parts_sources(gift_name)
+    backdrops_source_encoded = quote(sources["backdrops_source"])
+    patterns_source_encoded = quote(sources["patterns_source"])
+    if gift_name not in ASSET_SOURCE_OVERRIDES and gift_name in CUSTOM_GIFTS_DATA:
+        models_list = CUSTOM_GIFTS_DATA[gift_name].get("models", [])
 
     # --- CONSTRUCT URLs based on the determined sources ---
     # Only fetch models.json if it's not a custom gift with a predefined models_list
@@ -1126,6 +1001,466 @@ def normalize_and_build_clone_url(input_str):
         return f"https://t.me/nft/{name_part}-{number_part}"
     return None
 
+# --- TELEGRAM UPDATE QUEUE ---
+# The webhook only enqueues updates. Each update is routed to a worker by chat, so updates
+# from one chat are handled in order while different chats are processed concurrently.
+update_queues = []
+update_worker_threads = []
+update_queue_lock = threading.Lock()
+recent_update_ids = OrderedDict()  # update_id -> None, bounded to TELEGRAM_UPDATE_DEDUP_WINDOW
+update_queue_stats = {"received": 0, "duplicates": 0, "rejected": 0, "processed": 0, "failed": 0, "last_lag_seconds": 0.0, "max_lag_seconds": 0.0}
+
+def _telegram_update_chat_key(update):
+    """The id used to keep per-chat ordering: the chat for messages, the user for everything else."""
+    if "message" in update:
+        return update["message"]["chat"]["id"]
+    for update_type in ("callback_query", "inline_query", "chosen_inline_result"):
+        if update_type in update:
+            return update[update_type]["from"]["id"]
+    return update.get("update_id", 0)
+
+def _start_telegram_update_workers():
+    """Starts the worker threads on first use, so every forked gunicorn worker gets its own."""
+    if update_worker_threads:
+        return
+    for i in range(TELEGRAM_UPDATE_WORKERS):
+        q = queue.Queue(maxsize=TELEGRAM_UPDATE_QUEUE_SIZE)
+        worker = threading.Thread(target=_telegram_update_worker, args=(q,), name=f"telegram-update-{i}", daemon=True)
+        update_queues.append(q)
+        update_worker_threads.append(worker)
+        worker.start()
+
+def enqueue_telegram_update(update):
+    """Queues an update for processing. Returns False if the queue is full and Telegram should retry."""
+    update_id = update.get("update_id")
+    with update_queue_lock:
+        _start_telegram_update_workers()
+        update_queue_stats["received"] += 1
+        if update_id is not None and update_id in recent_update_ids:
+            update_queue_stats["duplicates"] += 1
+            return True
+
+        target_queue = update_queues[hash(_telegram_update_chat_key(update)) % len(update_queues)]
+        try:
+            target_queue.put_nowait((time.monotonic(), update))
+        except queue.Full:
+            update_queue_stats["rejected"] += 1
+            app.logger.warning(f"Telegram update queue is full, rejecting update {update_id}.")
+            return False
+
+        if update_id is not None:
+            recent_update_ids[update_id] = None
+            if len(recent_update_ids) > TELEGRAM_UPDATE_DEDUP_WINDOW:
+                recent_update_ids.popitem(last=False)
+    return True
+
+def _telegram_update_worker(q):
+    while True:
+        enqueued_at, update = q.get()
+        lag = time.monotonic() - enqueued_at
+        with update_queue_lock:
+            update_queue_stats["last_lag_seconds"] = round(lag, 3)
+            update_queue_stats["max_lag_seconds"] = round(max(update_queue_stats["max_lag_seconds"], lag), 3)
+        try:
+            process_telegram_update(update)
+            with update_queue_lock:
+                update_queue_stats["processed"] += 1
+        except Exception as e:
+            with update_queue_lock:
+                update_queue_stats["failed"] += 1
+            app.logger.error(f"Error processing Telegram update {update.get('update_id')}: {e}", exc_info=True)
+        finally:
+            q.task_done()
+
+def get_telegram_update_queue_stats():
+    with update_queue_lock:
+        stats = dict(update_queue_stats)
+        stats["queue_depth"] = sum(q.qsize() for q in update_queues)
+        stats["oldest_wait_seconds"] = round(max((time.monotonic() - q.queue[0][0] for q in update_queues if q.queue), default=0.0), 3)
+    stats["workers"] = len(update_worker_threads)
+    return stats
+
+def drain_telegram_update_queues(timeout=10):
+    """Gives queued updates a chance to finish before the worker process exits."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(q.unfinished_tasks for q in update_queues):
+        time.sleep(0.1)
+
+# --- GIFT TRAITS ---
+# Models, backdrops and patterns are stored once per gift name in gift_models, gift_backdrops and
+# gift_patterns; gifts reference them by id and keep only per-gift fields (supply, author) in
+# collectible_data. hydrate_collectible_data rebuilds the full collectible_data for responses from
+# an in-memory copy of the trait tables, which only ever grow and never change once written.
+GIFT_TRAIT_TABLES = {"model": "gift_models", "backdrop": "gift_backdrops", "pattern": "gift_patterns"}
+GIFT_TRAIT_ID_COLUMNS = {"model": "model_id", "backdrop": "backdrop_id", "pattern": "pattern_id"}
+COLLECTIBLE_ASSET_URL_FIELDS = ("modelImage", "lottieModelPath", "patternImage")  # Served through the asset proxy
+gift_traits_by_id = {kind: {} for kind in GIFT_TRAIT_TABLES}  # kind -> id -> trait dict
+gift_trait_cache_lock = threading.Lock()
+
+def ensure_gift_trait_ids(cur, gift_name, model, backdrop, pattern):
+    """
+    Returns {kind: (id, stored data)} for the three traits, inserting the ones not stored yet on the
+    caller's cursor, so they commit or roll back with the gift that uses them. The first stored
+    copy of a trait wins; callers compare the stored data with their own.
+    """
+    traits = {"model": model, "backdrop": backdrop, "pattern": pattern}
+    inserts, selects, params, select_params = [], [], [], []
+    for kind, table in GIFT_TRAIT_TABLES.items():
+        name = traits[kind]['name']
+        inserts.append(f"{kind}_new AS (INSERT INTO {table} (gift_name, name, data) VALUES (%s, %s, %s) ON CONFLICT (gift_name, name) DO NOTHING RETURNING id, data)")
+        selects.append(f"(SELECT jsonb_build_array(id, data) FROM (SELECT id, data FROM {kind}_new UNION ALL SELECT id, data FROM {table} WHERE gift_name = %s AND name = %s) t LIMIT 1)")
+        params.extend([gift_name, name, json.dumps(traits[kind])])
+        select_params.extend([gift_name, name])
+    query = f"WITH {', '.join(inserts)} SELECT {', '.join(selects)};"
+
+    cur.execute("SAVEPOINT gift_traits;")
+    try:
+        # A trait inserted by a concurrent transaction is neither inserted nor visible to this
+        # statement's snapshot; running it again once that transaction has committed finds it.
+        for _ in range(2):
+            cur.execute(query, params + select_params)
+            row = cur.fetchone()
+            if all(row[i] for i in range(len(GIFT_TRAIT_TABLES))):
+                break
+        else:
+            raise psycopg2.DatabaseError(f"Could not store traits for '{gift_name}'.")
+    except Exception:
+        cur.execute("ROLLBACK TO SAVEPOINT gift_traits;")
+        raise
+    cur.execute("RELEASE SAVEPOINT gift_traits;")
+    return {kind: tuple(row[i]) for i, kind in enumerate(GIFT_TRAIT_TABLES)}
+
+def build_collectible_row(cur, gift_name, model, backdrop, pattern, **fields):
+    """
+    (collectible_data JSON, model_id, backdrop_id, pattern_id) for a new collectible; `fields` are
+    per-gift extras like supply. If a stored trait differs from the one given, the gift keeps its
+    full collectible_data instead of pointing at the stored copy.
+    """
+    traits = {"model": model, "backdrop": backdrop, "pattern": pattern}
+    stored = ensure_gift_trait_ids(cur, gift_name, model, backdrop, pattern)
+    ids = {kind: trait_id for kind, (trait_id, data) in stored.items() if data == traits[kind]}
+    if len(ids) < len(traits):
+        fields = collectible_data_from_traits(gift_name, model, backdrop, pattern, fields)
+    return (json.dumps(fields), ids.get("model"), ids.get("backdrop"), ids.get("pattern"))
+
+def collectible_data_from_traits(gift_name, model, backdrop, pattern, fields=None):
+    """The full collectible_data clients expect, derived from the trait objects."""
+    pattern_source = get_gift_parts_sources(gift_name)['patterns_source']
+    data = {
+        "model": model, "backdrop": backdrop, "pattern": pattern,
+        "modelImage": model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(model['name'])}.png",
+        "lottieModelPath": model['lottie'] if model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(model['name'])}.json",
+        "patternImage": f"{CDN_BASE_URL}patterns/{quote(pattern_source)}/png/{quote(pattern['name'])}.png",
+        "backdropColors": backdrop.get('hex')
+    }
+    data.update(fields or {})
+    return data
+
+def hydrate_collectible_data(cur, gifts):
+    """
+    Replaces the stored (slim) collectible_data of gift row dicts with the full object, in place,
+    and drops the trait id columns. Rows need gift_name and the trait id columns; rows without
+    trait ids keep whatever collectible_data they have. Image URLs point at the asset proxy.
+    """
+    wanted = {kind: set() for kind in GIFT_TRAIT_TABLES}
+    for gift in gifts:
+        for kind, column in GIFT_TRAIT_ID_COLUMNS.items():
+            trait_id = gift.get(column)
+            if trait_id and trait_id not in gift_traits_by_id[kind]:
+                wanted[kind].add(trait_id)
+    for kind, trait_ids in wanted.items():
+        if trait_ids:
+            cur.execute(f"SELECT id, data FROM {GIFT_TRAIT_TABLES[kind]} WHERE id = ANY(%s);", (list(trait_ids),))
+            # Ids are never reused, so caching a row of a transaction that later rolls back is harmless.
+            with gift_trait_cache_lock:
+                gift_traits_by_id[kind].update((row[0], row[1]) for row in cur.fetchall())
+
+    for gift in gifts:
+        trait_ids = {kind: gift.pop(column, None) for kind, column in GIFT_TRAIT_ID_COLUMNS.items()}
+        data = gift.get('collectible_data')
+        if isinstance(data, str):
+            data = json.loads(data)
+        traits = {kind: gift_traits_by_id[kind].get(trait_id) for kind, trait_id in trait_ids.items() if trait_id}
+        if len(traits) == 3 and all(traits.values()):
+            data = collectible_data_from_traits(gift['gift_name'], traits['model'], traits['backdrop'], traits['pattern'], data)
+        if isinstance(data, dict):
+            for key in COLLECTIBLE_ASSET_URL_FIELDS:
+                if data.get(key):
+                    data[key] = proxied_asset_url(data[key])
+        gift['collectible_data'] = data
+    return gifts
+
+# --- COMPACT INVENTORY RESPONSES ---
+# With ?format=compact, inventory responses send each distinct model, backdrop and pattern (with
+# the URLs derived from it) once in a top-level `traits` dictionary, and every gift's
+# collectible_data carries only indexes into it ("m", "b", "p") plus its own fields. Clients that
+# also send `Accept: application/msgpack` get the payload msgpack-encoded when the msgpack package
+# is installed, and plain JSON otherwise. index.html's decodeCompactGifts undoes both.
+COMPACT_TRAIT_FIELDS = {
+    "m": ("models", ("model", "modelImage", "lottieModelPath")),
+    "b": ("backdrops", ("backdrop", "backdropColors")),
+    "p": ("patterns", ("pattern", "patternImage")),
+}
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+def compact_gift_list(gifts, traits):
+    """Copies of hydrated gift dicts whose trait objects are replaced by indexes into `traits`."""
+    seen = {}
+    compact = []
+    for gift in gifts:
+        cd = gift.get('collectible_data')
+        if not isinstance(cd, dict) or not all(isinstance(cd.get(k), dict) for k in ('model', 'backdrop', 'pattern')):
+            compact.append(gift)
+            continue
+        cd = dict(cd)
+        for ref, (bucket, fields) in COMPACT_TRAIT_FIELDS.items():
+            entry = {field: cd.pop(field, None) for field in fields}
+            key = (bucket, json.dumps(entry, sort_keys=True))
+            if key not in seen:
+                seen[key] = len(traits[bucket])
+                traits[bucket].append(entry)
+            cd[ref] = seen[key]
+        compact.append({**gift, 'collectible_data': cd})
+    return compact
+
+def inventory_response(payload, gifts_key='owned_gifts'):
+    """jsonify(payload), or its compact (and possibly msgpack) form when the client asked for it."""
+    if request.args.get('format') != 'compact':
+        return jsonify(payload)
+    traits = {bucket: [] for bucket, _ in COMPACT_TRAIT_FIELDS.values()}
+    payload = {**payload, gifts_key: compact_gift_list(payload.get(gifts_key) or [], traits), 'traits': traits}
+
+    if request.accept_mimetypes[MSGPACK_MIMETYPE] > request.accept_mimetypes['application/json']:
+        try:
+            import msgpack
+        except ImportError:
+            msgpack = None
+        if msgpack:
+            # Round-trip through the JSON provider so dates serialize exactly as in JSON responses.
+            body = json.loads(app.json.dumps(payload))
+            response = app.response_class(msgpack.packb(body), mimetype=MSGPACK_MIMETYPE)
+            response.vary.add('Accept')
+            return response
+    response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+# --- HTTP CACHING & COMPRESSION ---
+# Shared resources (see migrations/0004_resource_versions.sql) carry version counters that DB
+# triggers bump and announce with NOTIFY. Each worker keeps the versions it has seen in memory while
+# its listener is connected, so a conditional GET for unchanged data is answered with a 304 without
+# a query. Routes opt in with resource_etag / is_not_modified / with_etag. Account versions
+# (user_versions) are announced on the same channel as 'user:<tg_id>' and cached the same way.
+def _invalidate_resource_versions(resources=None):
+    """Drops cached versions (all of them when `resources` is None)."""
+    global resource_version_cache_generation
+    with resource_version_cache_lock:
+        resource_version_cache_generation += 1
+        if resources is None:
+            resource_version_cache.clear()
+            profile_username_ids.clear()
+            profile_usernames_by_id.clear()
+        else:
+            for resource in resources:
+                resource_version_cache.pop(resource, None)
+                # A username change bumps the account, so its cached name is dropped with it.
+                if resource.startswith('user:') and resource[5:].isdigit():
+                    username = profile_usernames_by_id.pop(int(resource[5:]), None)
+                    if username is not None:
+                        profile_username_ids.pop(username, None)
+
+def cached_versions(names):
+    """{name: version} for resource names and 'user:<tg_id>' keys, or None unless all are cached."""
+    with resource_version_cache_lock:
+        if not resource_version_listener_connected or any(name not in resource_version_cache for name in names):
+            return None
+        return {name: resource_version_cache[name] for name in names}
+
+def cached_profile_user_id(username):
+    """The tg_id last seen for `username` ('@name' or 'name'), or None."""
+    with resource_version_cache_lock:
+        if not resource_version_listener_connected:
+            return None
+        return profile_username_ids.get((username or '').strip().lstrip('@').lower())
+
+def cache_profile_username(username, tg_id, generation):
+    """Remembers username -> tg_id, read after resource_version_cache_generation was `generation`."""
+    key = (username or '').strip().lstrip('@').lower()
+    with resource_version_cache_lock:
+        # Only if no notification arrived since the lookup, and while a user:<tg_id> one can still drop it.
+        if (key and resource_version_listener_connected and generation == resource_version_cache_generation
+                and f"user:{tg_id}" in resource_version_cache):
+            stale = profile_usernames_by_id.pop(tg_id, None)
+            if stale is not None:
+                profile_username_ids.pop(stale, None)
+            profile_username_ids[key] = tg_id
+            profile_usernames_by_id[tg_id] = key
+
+def get_resource_version(resource, cur=None):
+    """
+    The current version of `resource`, or None if it can't be read right now.
+    Pass `cur` when holding a connection already; a miss is then read on it instead of a second one.
+    """
+    with resource_version_cache_lock:
+        if resource_version_listener_connected and resource in resource_version_cache:
+            return resource_version_cache[resource]
+        generation = resource_version_cache_generation
+
+    if cur is not None:
+        cur.execute("SELECT version FROM resource_versions WHERE resource = %s;", (resource,))
+        row = cur.fetchone()
+    else:
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM resource_versions WHERE resource = %s;", (resource,))
+                row = cur.fetchone()
+        except psycopg2.Error as e:
+            app.logger.error(f"Could not read version of {resource}: {e}", exc_info=True)
+            return None
+        finally:
+            put_db_connection(conn)
+
+    version = row[0] if row else 0
+    with resource_version_cache_lock:
+        # A NOTIFY that arrived while we were reading may already make this value stale.
+        if resource_version_listener_connected and generation == resource_version_cache_generation:
+            resource_version_cache[resource] = version
+    return version
+
+def versioned_etag(versions):
+    """
+    Weak ETag for a response built only from the data behind `versions` ({name: version}).
+    The query string and Accept header are folded in because they select the response variant.
+    """
+    parts = [ETAG_BUILD_ID, request.path, request.query_string.decode('latin-1'), request.headers.get('Accept', '')]
+    parts += [f"{name}:{version}" for name, version in sorted(versions.items())]
+    return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()[:20]
+
+def resource_etag(*resources):
+    """versioned_etag for shared resources, or None when a version is unavailable."""
+    versions = {}
+    for resource in resources:
+        versions[resource] = get_resource_version(resource)
+        if versions[resource] is None:
+            return None
+    return versioned_etag(versions)
+
+def get_user_versions(cur, tg_ids, cache=False):
+    """
+    {tg_id: data version} from user_versions, which triggers bump on every write to an account's
+    gifts, collections, posts and profile (see migrations/0005_user_versions.sql). Read on the
+    caller's cursor before the data itself, so a concurrent write can only make a response look
+    older than it is, never newer. Bumps are announced as 'user:<tg_id>' (migrations/0007), so
+    with `cache` the versions read here are kept like resource versions; only pass it from
+    read-only transactions, as a version the caller's own write bumped could still roll back.
+    """
+    tg_ids = [int(tg_id) for tg_id in tg_ids]
+    with resource_version_cache_lock:
+        generation = resource_version_cache_generation
+    cur.execute("SELECT tg_id, version FROM user_versions WHERE tg_id = ANY(%s);", (tg_ids,))
+    versions = {tg_id: 0 for tg_id in tg_ids}
+    versions.update({row[0]: row[1] for row in cur.fetchall()})
+    with resource_version_cache_lock:
+        if (cache and resource_version_listener_connected and generation == resource_version_cache_generation
+                and len(resource_version_cache) < USER_VERSION_CACHE_MAX_ENTRIES):
+            resource_version_cache.update({f"user:{tg_id}": version for tg_id, version in versions.items()})
+    return versions
+
+def is_not_modified(etag):
+    return bool(etag) and request.if_none_match.contains_weak(etag)
+
+def not_modified_response(etag):
+    response = app.response_class(status=304)
+    return with_etag(response, etag)
+
+def with_etag(response, etag):
+    """Tags the response and asks clients to revalidate it on every use."""
+    if etag:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def run_resource_version_listener():
+    """Background loop that keeps this worker's resource version cache in sync via LISTEN/NOTIFY."""
+    global resource_version_listener_connected
+    while True:
+        listen_conn = None
+        try:
+            # Keepalives so a silently dropped connection is noticed and the cache stops being trusted.
+            listen_conn = psycopg2.connect(DATABASE_URL, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+            listen_conn.autocommit = True
+            with listen_conn.cursor() as cur:
+                cur.execute(f"LISTEN {RESOURCE_VERSIONS_CHANNEL};")
+            # Anything cached before now may have missed notifications.
+            _invalidate_resource_versions()
+            with resource_version_cache_lock:
+                resource_version_listener_connected = True
+
+            while True:
+                select.select([listen_conn], [], [], 60)
+                listen_conn.poll()
+                if listen_conn.notifies:
+                    resources = {notify.payload for notify in listen_conn.notifies}
+                    listen_conn.notifies.clear()
+                    _invalidate_resource_versions(resources)
+        except Exception as e:
+            app.logger.error(f"Resource version listener failed: {e}", exc_info=True)
+        finally:
+            with resource_version_cache_lock:
+                resource_version_listener_connected = False
+            if listen_conn and not listen_conn.closed:
+                listen_conn.close()
+        time.sleep(RESOURCE_VERSION_LISTENER_RETRY_SECONDS)
+
+brotli_module = None  # False once the import has failed
+
+def get_brotli():
+    global brotli_module
+    if brotli_module is None:
+        try:
+            import brotli
+            brotli_module = brotli
+        except ImportError:
+            brotli_module = False
+    return brotli_module or None
+
+def choose_content_encoding():
+    """'br', 'gzip' or None, by the client's Accept-Encoding preferences."""
+    accepted = request.accept_encodings
+    br_quality = accepted['br'] if get_brotli() else 0
+    gzip_quality = accepted['gzip']
+    if not br_quality and not gzip_quality:
+        return None
+    return 'br' if br_quality >= gzip_quality else 'gzip'
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = choose_content_encoding()
+    if not encoding:
+        return response
+
+    if encoding == 'br':
+        response.set_data(get_brotli().compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ, so a strong validator would no longer be accurate.
+        response.set_etag(etag, weak=True)
+    return response
+
 # --- BOT & GIVEAWAY LOGIC ---
 def update_giveaway_message(giveaway_id):
     conn = get_db_connection()
@@ -1139,8 +1474,7 @@ def update_giveaway_message(giveaway_id):
 
             cur.execute("""SELECT gf.gift_name, gf.collectible_number FROM gifts gf JOIN giveaway_gifts gg ON gf.instance_id = gg.gift_instance_id WHERE gg.giveaway_id = %s ORDER BY gf.acquired_date;""", (giveaway_id,))
             gifts = cur.fetchall()
-            cur.execute("SELECT COUNT(*) FROM giveaway_participants WHERE giveaway_id = %s;", (giveaway_id,))
-            participant_count = cur.fetchone()[0]
+            participant_count = giveaway['participant_count']
 
             rewards = ""
             emojis = ["🥇", "🥈", "🥉"]
@@ -1167,6 +1501,40 @@ def update_giveaway_message(giveaway_id):
     finally:
         if conn: put_db_connection(conn)
 
+def schedule_giveaway_message_update(giveaway_id):
+    """
+    Trailing-edge debounce for giveaway post edits.
+    The first join in a window starts a timer; joins that arrive while it is pending are
+    folded into the same edit, which reads the participant counter when it fires.
+    """
+    with giveaway_update_lock:
+        if giveaway_id in giveaway_update_timers:
+            return
+        timer = threading.Timer(GIVEAWAY_UPDATE_THROTTLE_SECONDS, _flush_giveaway_message_update, args=(giveaway_id,))
+        timer.daemon = True
+        giveaway_update_timers[giveaway_id] = timer
+        timer.start()
+
+def _flush_giveaway_message_update(giveaway_id):
+    with giveaway_update_lock:
+        giveaway_update_timers.pop(giveaway_id, None)
+    submit_background_task(update_giveaway_message, giveaway_id, dedup_key=f"giveaway_message:{giveaway_id}")
+
+def flush_pending_giveaway_message_updates():
+    """
+    Publishes pending edits right away instead of losing them when the worker exits.
+    Runs them on the calling thread: at exit the background executor may no longer take tasks.
+    """
+    with giveaway_update_lock:
+        pending = list(giveaway_update_timers.items())
+        giveaway_update_timers.clear()
+    for giveaway_id, timer in pending:
+        timer.cancel()
+        try:
+            update_giveaway_message(giveaway_id)
+        except Exception as e:
+            app.logger.error(f"Error flushing giveaway message update for {giveaway_id}: {e}", exc_info=True)
+
 def handle_giveaway_setup(conn, cur, user_id, user_state, text):
     state_parts = user_state.split('_')
     giveaway_id = int(state_parts[-1])
@@ -1224,6 +1592,163 @@ def handle_giveaway_setup(conn, cur, user_id, user_state, text):
         except ValueError:
             send_telegram_message(user_id, "Invalid date format. Please use `DD.MM.YYYY HH:MM` (UTC).")
 
+# --- INLINE QUERY LOOKUPS ---
+# Telegram sends a new inline query on nearly every keystroke, so recipient and gift
+# lookups are memoised per user for a short time, and gift names are matched against
+# a prefix index instead of the database.
+INLINE_LOOKUP_TTL_SECONDS = 30
+INLINE_LOOKUP_CACHE_MAX_ENTRIES = 20000
+GIFT_NAME_INDEX_REFRESH_SECONDS = 600
+GIFT_NAME_SUGGESTION_LIMIT = 10
+
+inline_lookup_cache = OrderedDict()
+inline_lookup_lock = threading.Lock()
+_INLINE_LOOKUP_MISS = object()
+
+gift_name_index = {"by_key": {}, "by_prefix": {}, "type_ids": {}, "names_by_type": {}, "built_at": 0.0}
+gift_name_index_lock = threading.Lock()
+
+def _inline_lookup_get(user_id, kind, key):
+    cache_key = (user_id, kind, key)
+    with inline_lookup_lock:
+        entry = inline_lookup_cache.get(cache_key)
+        if entry is None:
+            return _INLINE_LOOKUP_MISS
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del inline_lookup_cache[cache_key]
+            return _INLINE_LOOKUP_MISS
+        inline_lookup_cache.move_to_end(cache_key)
+        return value
+
+def _inline_lookup_set(user_id, kind, key, value):
+    with inline_lookup_lock:
+        inline_lookup_cache[(user_id, kind, key)] = (value, time.monotonic() + INLINE_LOOKUP_TTL_SECONDS)
+        inline_lookup_cache.move_to_end((user_id, kind, key))
+        while len(inline_lookup_cache) > INLINE_LOOKUP_CACHE_MAX_ENTRIES:
+            inline_lookup_cache.popitem(last=False)
+
+def normalize_gift_name_key(name):
+    """'Plush Pepe', 'plushpepe' and 'PlushPepe' all map to 'plushpepe'."""
+    return re.sub(r'[^0-9a-z]', '', (name or '').lower())
+
+def _build_gift_name_index(names, type_ids):
+    by_key = {}
+    for name in sorted(names):
+        by_key.setdefault(normalize_gift_name_key(name), name)
+    by_prefix = {}
+    for key, name in by_key.items():
+        for i in range(1, len(key) + 1):
+            bucket = by_prefix.setdefault(key[:i], [])
+            if len(bucket) < GIFT_NAME_SUGGESTION_LIMIT:
+                bucket.append(name)
+    names_by_type = {type_id: name for name, type_id in type_ids.items()}
+    return {"by_key": by_key, "by_prefix": by_prefix, "type_ids": type_ids, "names_by_type": names_by_type, "built_at": time.time()}
+
+def refresh_gift_name_index(include_catalog=True):
+    """Rebuilds the index from the bundled gift data and, unless include_catalog is False, gift_catalog."""
+    names = set(CUSTOM_GIFTS_DATA) | set(ASSET_SOURCE_OVERRIDES)
+    # Asset sources name real gifts too, e.g. custom gifts borrowing Plush Pepe backdrops.
+    for data in list(ASSET_SOURCE_OVERRIDES.values()) + list(CUSTOM_GIFTS_DATA.values()):
+        names.update(v for k, v in data.items() if k.endswith('_source') and isinstance(v, str))
+    type_ids = {name: data['id'] for name, data in CUSTOM_GIFTS_DATA.items() if data.get('id')}
+    conn = get_db_connection() if include_catalog else None
+    if conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT gift_name, gift_type_id FROM gift_catalog;")
+                for gift_name, gift_type_id in cur.fetchall():
+                    names.add(gift_name)
+                    type_ids.setdefault(gift_name, gift_type_id)
+        except Exception as e:
+            app.logger.error(f"Failed to load gift names for the gift name index: {e}", exc_info=True)
+        finally:
+            put_db_connection(conn)
+
+    index = _build_gift_name_index(names, type_ids)
+    with gift_name_index_lock:
+        if not include_catalog:
+            if gift_name_index["built_at"]:
+                return  # A full build got there first
+            index["built_at"] = time.time() - GIFT_NAME_INDEX_REFRESH_SECONDS  # Stale, so the next use queues a full build
+        gift_name_index.update(index)
+    app.logger.info(f"Gift name index rebuilt with {len(index['by_key'])} names.")
+
+def _get_gift_name_index():
+    # Callers often hold a pooled connection already, so a missing index is never filled from the
+    # database here. start_background_services builds it before the first request; until then the
+    # bundled names stand in and gift_catalog is loaded in the background.
+    built_at = gift_name_index["built_at"]
+    if not built_at:
+        refresh_gift_name_index(include_catalog=False)
+        submit_background_task(refresh_gift_name_index, dedup_key="gift_name_index")
+    elif time.time() - built_at > GIFT_NAME_INDEX_REFRESH_SECONDS:
+        submit_background_task(refresh_gift_name_index, dedup_key="gift_name_index")
+    return gift_name_index
+
+def resolve_gift_name(raw_name):
+    """Maps compact or differently-cased input ('PlushPepe') to the stored gift name ('Plush Pepe')."""
+    raw_name = raw_name.strip()
+    return _get_gift_name_index()["by_key"].get(normalize_gift_name_key(raw_name), raw_name)
+
+def resolve_gift_identity(identifier):
+    """Returns (gift_name, gift_type_id) for a gift name in any spelling or a gift type id, else None.
+
+    gift_type_id is None for names that are known but have no collectible minted yet.
+    """
+    index = _get_gift_name_index()
+    identifier = identifier.strip()
+    name = index["by_key"].get(normalize_gift_name_key(identifier)) or index["names_by_type"].get(identifier)
+    if not name:
+        return None
+    return name, index["type_ids"].get(name)
+
+def gift_identity_clause(gift_name, collectible_number, alias="gifts"):
+    """WHERE clause and params selecting the collectible `gift_name` #`collectible_number`.
+
+    Matches on the name via the (LOWER(gift_name), collectible_number) index. Type ids can't be used:
+    every generated gift shares 'generated_gift' and gift_catalog keeps one type id per name, so a
+    type id could miss the gift or pick another one with the same number.
+    """
+    identity = resolve_gift_identity(gift_name)
+    return (f"LOWER({alias}.gift_name) = LOWER(%s) AND {alias}.collectible_number = %s AND {alias}.is_collectible = TRUE",
+            [identity[0] if identity else gift_name.strip(), collectible_number])
+
+def suggest_gift_names(prefix):
+    index = _get_gift_name_index()
+    key = normalize_gift_name_key(prefix)
+    if not key:
+        return list(index["by_key"].values())[:GIFT_NAME_SUGGESTION_LIMIT]
+    return index["by_prefix"].get(key, [])
+
+def _gift_name_suggestion_results(prefix, usage):
+    return [
+        {"type": "article", "id": f"suggest_{normalize_gift_name_key(name)}", "title": name, "description": f"Add -<number>, e.g. {name.replace(' ', '')}-1", "input_message_content": {"message_text": usage}}
+        for name in suggest_gift_names(prefix)
+    ]
+
+def _lookup_account_by_username(cur, user_id, username):
+    cache_key = username.lstrip('@').lower()
+    cached = _inline_lookup_get(user_id, "account", cache_key)
+    if cached is not _INLINE_LOOKUP_MISS:
+        return cached
+    row = resolve_account_by_username(cur, username)
+    account = dict(row) if row else None
+    _inline_lookup_set(user_id, "account", cache_key, account)
+    return account
+
+def _lookup_sender(cur, sender_id):
+    cached = _inline_lookup_get(sender_id, "sender", sender_id)
+    if cached is not _INLINE_LOOKUP_MISS:
+        return cached
+    cur.execute("SELECT username FROM accounts WHERE tg_id = %s;", (sender_id,))
+    row = cur.fetchone()
+    sender = {"username": row['username']} if row else None
+    # Unregistered senders are not cached, so registering in the app takes effect immediately.
+    if sender:
+        _inline_lookup_set(sender_id, "sender", sender_id, sender)
+    return sender
+
 # --- INLINE BOT HANDLERS ---
 def handle_inline_query(inline_query):
     query_id = inline_query['id']
@@ -1256,13 +1781,31 @@ def handle_inline_query(inline_query):
 def handle_chosen_inline_result(chosen_result):
     result_id = chosen_result['result_id']
     from_user = chosen_result['from']
-    
-    action_details = inline_cache.pop(result_id, None)
-    if not action_details:
+
+    action, _, rest = result_id.partition(':')
+    if action not in INLINE_ACTION_COMMANDS or rest.split(':', 1)[0] != str(from_user['id']):
+        return
+    parts = chosen_result.get('query', '').strip().split(' ', 2)
+    if len(parts) != 3 or parts[0].lower() != INLINE_ACTION_COMMANDS[action]:
         return
 
-    if from_user['id'] != action_details['sender_id']:
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            if action == 'send':
+                action_details, _, _ = _resolve_inline_send(cur, from_user['id'], parts[1], parts[2])
+            else:
+                action_details, _ = _resolve_inline_create_and_send(cur, from_user['id'], parts[1], parts[2])
+            if not action_details or not claim_inline_result(cur, result_id, action_details):
+                return
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error resolving chosen inline result {result_id}: {e}", exc_info=True)
         return
+    finally:
+        put_db_connection(conn)
 
     if action_details['action'] == 'send':
         _execute_gift_transfer(
@@ -1281,6 +1824,36 @@ def handle_chosen_inline_result(chosen_result):
             comment="Created and sent via inline command."
         )
 
+def _resolve_inline_send(cur, sender_id, recipient_username, gift_str):
+    """(action_details, gift, None) for `send <recipient> <gift>`, or (None, None, error results)."""
+    sender = _lookup_sender(cur, sender_id)
+    if not sender: return None, None, []
+
+    recipient = _lookup_account_by_username(cur, sender_id, recipient_username)
+    if not recipient: return None, None, [{"type": "article", "id": "error_recipient", "title": f"Error: User @{recipient_username} not found", "input_message_content": {"message_text": f"Could not find user @{recipient_username}."}}]
+    recipient_id = recipient['tg_id']
+
+    match = re.match(r'^(.+?)-(\d+)$', gift_str)
+    if not match:
+        suggestions = _gift_name_suggestion_results(gift_str, f"Usage: @{BOT_USERNAME} send <recipient> <GiftName-Number>")
+        return None, None, suggestions or [{"type": "article", "id": "error_gift_format", "title": "Error: Invalid gift format", "description": "Use format like: PlushPepe-1", "input_message_content": {"message_text": "Invalid gift format."}}]
+
+    gift_name, collectible_number = resolve_gift_name(match.group(1)), int(match.group(2))
+
+    gift = _inline_lookup_get(sender_id, "owned_gift", (gift_name, collectible_number))
+    if gift is _INLINE_LOOKUP_MISS:
+        clause, params = gift_identity_clause(gift_name, collectible_number)
+        cur.execute(f"SELECT instance_id, gift_type_id, gift_name, collectible_data, model_id, backdrop_id, pattern_id FROM gifts WHERE owner_id = %s AND {clause};", [sender_id] + params)
+        row = cur.fetchone()
+        gift = hydrate_collectible_data(cur, [dict(row)])[0] if row else None
+        # Ownership is re-checked when the transfer runs, so a stale hit here is harmless.
+        _inline_lookup_set(sender_id, "owned_gift", (gift_name, collectible_number), gift)
+
+    if not gift: return None, None, [{"type": "article", "id": "error_gift_not_found", "title": "Error: Gift not found in your collection", "description": f"You do not own {gift_name} #{collectible_number}", "input_message_content": {"message_text": "Could not find this gift in your collection."}}]
+
+    action_details = {"action": "send", "sender_id": sender_id, "sender_username": sender['username'], "receiver_id": recipient_id, "recipient_username": recipient_username, "instance_id": gift['instance_id'], "gift_name": gift_name, "gift_number": collectible_number, "gift_type_id": gift['gift_type_id']}
+    return action_details, gift, None
+
 def handle_inline_send(from_user, recipient_username, gift_str):
     conn = get_db_connection()
     if not conn: return []
@@ -1288,71 +1861,59 @@ def handle_inline_send(from_user, recipient_username, gift_str):
     results = []
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            sender_id = from_user['id']
-            cur.execute("SELECT username FROM accounts WHERE tg_id = %s;", (sender_id,))
-            sender = cur.fetchone()
-            if not sender: return []
-
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (recipient_username,))
-            recipient = cur.fetchone()
-            if not recipient: return [{"type": "article", "id": "error_recipient", "title": f"Error: User @{recipient_username} not found", "input_message_content": {"message_text": f"Could not find user @{recipient_username}."}}]
-            recipient_id = recipient['tg_id']
-
-            match = re.match(r'^(.+?)-(\d+)$', gift_str)
-            if not match: return [{"type": "article", "id": "error_gift_format", "title": "Error: Invalid gift format", "description": "Use format like: PlushPepe-1", "input_message_content": {"message_text": "Invalid gift format."}}]
-            
-            gift_name, collectible_number = match.group(1).strip(), int(match.group(2))
+            action_details, gift, errors = _resolve_inline_send(cur, from_user['id'], recipient_username, gift_str)
+            if not action_details: return errors
+            gift_name, collectible_number = action_details['gift_name'], action_details['gift_number']
 
-            cur.execute("SELECT instance_id, gift_type_id, collectible_data FROM gifts WHERE owner_id = %s AND gift_name = %s AND collectible_number = %s AND is_collectible = TRUE;", (sender_id, gift_name, collectible_number))
-            gift = cur.fetchone()
-
-            if not gift: return [{"type": "article", "id": "error_gift_not_found", "title": "Error: Gift not found in your collection", "description": f"You do not own {gift_name} #{collectible_number}", "input_message_content": {"message_text": "Could not find this gift in your collection."}}]
-
-            result_id = str(uuid.uuid4())
-            inline_cache[result_id] = {"action": "send", "sender_id": sender_id, "sender_username": sender['username'], "receiver_id": recipient_id, "recipient_username": recipient_username, "instance_id": gift['instance_id'], "gift_name": gift_name, "gift_number": collectible_number, "gift_type_id": gift['gift_type_id']}
-            
             cd = gift.get('collectible_data', {})
             thumb_url = cd.get('modelImage') if isinstance(cd, dict) else ''
 
-            results.append({"type": "article", "id": result_id, "title": f"Send {gift_name} #{collectible_number} to @{recipient_username}", "description": "Click here to confirm and send the gift.", "thumb_url": thumb_url, "input_message_content": {"message_text": f"Preparing to send {gift_name} #{collectible_number} to @{recipient_username}..."}})
+            results.append({"type": "article", "id": new_inline_result_id("send", from_user['id']), "title": f"Send {gift_name} #{collectible_number} to @{recipient_username}", "description": "Click here to confirm and send the gift.", "thumb_url": thumb_url, "input_message_content": {"message_text": f"Preparing to send {gift_name} #{collectible_number} to @{recipient_username}..."}})
     except Exception as e:
         app.logger.error(f"Error in handle_inline_send: {e}", exc_info=True)
     finally:
         if conn: put_db_connection(conn)
     return results
 
-def handle_inline_create_and_send(from_user, recipient_username, gift_components_str):
+def _resolve_inline_create_and_send(cur, sender_id, recipient_username, gift_components_str):
+    """(action_details, None) for `createAndSend <recipient> <Name,Model,Backdrop[,Pattern]>`, or (None, error results)."""
     parts = [p.strip() for p in gift_components_str.split(',', 3)]
-    if len(parts) < 3: return [{"type": "article", "id": "error_create_format", "title": "Error: Invalid format", "description": "Use: Name,Model,Backdrop,Pattern", "input_message_content": {"message_text": "Invalid format."}}]
+    if len(parts) < 3: return None, [{"type": "article", "id": "error_create_format", "title": "Error: Invalid format", "description": "Use: Name,Model,Backdrop,Pattern", "input_message_content": {"message_text": "Invalid format."}}]
 
-    gift_name, model_name, backdrop_name = parts[0], parts[1], parts[2]
+    gift_name, model_name, backdrop_name = resolve_gift_name(parts[0]), parts[1], parts[2]
     pattern_name = parts[3] if len(parts) > 3 and parts[3] else None
-    
+
+    sender = _lookup_sender(cur, sender_id)
+    if not sender: return None, []
+
+    recipient = _lookup_account_by_username(cur, sender_id, recipient_username)
+    if not recipient: return None, []
+    recipient_id = recipient['tg_id']
+
+    if is_custom_gift(gift_name) and not has_custom_gifts_enabled(cur, sender_id): return None, [{"type": "article", "id": "error_custom_disabled", "title": "Error: Custom Gifts are disabled", "input_message_content": {"message_text": "You must enable Custom Gifts in settings."}}]
+
+    gift_count = _inline_lookup_get(sender_id, "gift_count", recipient_id)
+    if gift_count is _INLINE_LOOKUP_MISS:
+        cur.execute("SELECT COUNT(*) FROM gifts WHERE owner_id = %s;", (recipient_id,))
+        gift_count = cur.fetchone()[0]
+        # _execute_create_and_send checks the limit again, so a stale count here is harmless.
+        _inline_lookup_set(sender_id, "gift_count", recipient_id, gift_count)
+    if gift_count >= GIFT_LIMIT_PER_USER: return None, [{"type": "article", "id": "error_limit_reached", "title": f"Error: @{recipient_username}'s gift box is full", "input_message_content": {"message_text": f"Recipient's inventory is full."}}]
+
+    return {"action": "create_and_send", "sender_id": sender_id, "sender_username": sender['username'], "receiver_id": recipient_id, "recipient_username": recipient_username, "gift_name": gift_name, "model_name": model_name, "backdrop_name": backdrop_name, "pattern_name": pattern_name}, None
+
+def handle_inline_create_and_send(from_user, recipient_username, gift_components_str):
     conn = get_db_connection()
     if not conn: return []
     
     results = []
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            sender_id = from_user['id']
-            cur.execute("SELECT username FROM accounts WHERE tg_id = %s;", (sender_id,))
-            sender = cur.fetchone()
-            if not sender: return []
-            
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (recipient_username,))
-            recipient = cur.fetchone()
-            if not recipient: return []
-            recipient_id = recipient['tg_id']
+            action_details, errors = _resolve_inline_create_and_send(cur, from_user['id'], recipient_username, gift_components_str)
+            if not action_details: return errors
+            gift_name, model_name, backdrop_name, pattern_name = (action_details[k] for k in ("gift_name", "model_name", "backdrop_name", "pattern_name"))
 
-            if is_custom_gift(gift_name) and not has_custom_gifts_enabled(cur, sender_id): return [{"type": "article", "id": "error_custom_disabled", "title": "Error: Custom Gifts are disabled", "input_message_content": {"message_text": "You must enable Custom Gifts in settings."}}]
-            
-            cur.execute("SELECT COUNT(*) FROM gifts WHERE owner_id = %s;", (recipient_id,))
-            if cur.fetchone()[0] >= GIFT_LIMIT_PER_USER: return [{"type": "article", "id": "error_limit_reached", "title": f"Error: @{recipient_username}'s gift box is full", "input_message_content": {"message_text": f"Recipient's inventory is full."}}]
-            
-            result_id = str(uuid.uuid4())
-            inline_cache[result_id] = {"action": "create_and_send", "sender_id": sender_id, "sender_username": sender['username'], "recipient_id": recipient_id, "recipient_username": recipient_username, "gift_name": gift_name, "model_name": model_name, "backdrop_name": backdrop_name, "pattern_name": pattern_name}
-
-            results.append({"type": "article", "id": result_id, "title": f"Create & Send {gift_name} to @{recipient_username}", "description": f"Model: {model_name}, Backdrop: {backdrop_name}, Pattern: {pattern_name or 'Random'}", "input_message_content": {"message_text": f"Preparing to create and send a custom {gift_name} to @{recipient_username}..."}})
+            results.append({"type": "article", "id": new_inline_result_id("create_and_send", from_user['id']), "title": f"Create & Send {gift_name} to @{recipient_username}", "description": f"Model: {model_name}, Backdrop: {backdrop_name}, Pattern: {pattern_name or 'Random'}", "input_message_content": {"message_text": f"Preparing to create and send a custom {gift_name} to @{recipient_username}..."}})
     except Exception as e:
         app.logger.error(f"Error in handle_inline_create_and_send: {e}", exc_info=True)
     finally:
@@ -1360,32 +1921,41 @@ def handle_inline_create_and_send(from_user, recipient_username, gift_components
     return results
 
 def handle_inline_image(from_user, gift_str):
-    conn = get_db_connection()
-    if not conn: return []
+    match = re.match(r'^(.+?)-(\d+)$', gift_str)
+    if not match:
+        return _gift_name_suggestion_results(gift_str, f"Usage: @{BOT_USERNAME} image <GiftName-Number>")
+
+    gift_name, collectible_number = resolve_gift_name(match.group(1)), int(match.group(2))
+    gift = _inline_lookup_get(from_user['id'], "gift", (gift_name, collectible_number))
+    conn = None
     
     results = []
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            match = re.match(r'^(.+?)-(\d+)$', gift_str)
-            if not match: return []
-            
-            gift_name, collectible_number = match.group(1).strip(), int(match.group(2))
-            
-            cur.execute("SELECT g.collectible_data, a.username as owner_username FROM gifts g JOIN accounts a ON g.owner_id = a.tg_id WHERE g.gift_name = %s AND g.collectible_number = %s AND g.is_collectible = TRUE;", (gift_name, collectible_number))
-            gift = cur.fetchone()
+        if gift is _INLINE_LOOKUP_MISS:
+            conn = get_db_connection()
+            if not conn: return []
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                clause, params = gift_identity_clause(gift_name, collectible_number, alias="g")
+                cur.execute(f"SELECT g.gift_name, g.collectible_data, g.model_id, g.backdrop_id, g.pattern_id, a.username as owner_username FROM gifts g JOIN accounts a ON g.owner_id = a.tg_id WHERE {clause};", params)
+                row = cur.fetchone()
+                gift = hydrate_collectible_data(cur, [dict(row)])[0] if row else None
+            _inline_lookup_set(from_user['id'], "gift", (gift_name, collectible_number), gift)
 
-            if not gift or not isinstance(gift.get('collectible_data'), dict): return []
+        if not gift or not isinstance(gift.get('collectible_data'), dict): return []
+        
+        cd = gift['collectible_data']
+        model_img = cd.get('modelImage')
+        if not model_img: return []
             
-            cd = gift['collectible_data']
-            model_img = cd.get('modelImage')
-            if not model_img: return []
-                
-            caption = (f"<b>{gift_name} #{collectible_number}</b>\n\n"
-                       f"<b>Model:</b> {cd.get('model', {}).get('name', 'N/A')}\n"
-                       f"<b>Backdrop:</b> {cd.get('backdrop', {}).get('name', 'N/A')}\n"
-                       f"<b>Symbol:</b> {cd.get('pattern', {}).get('name', 'N/A')}\n"
-                       f"<b>Owner:</b> @{gift['owner_username']}")
-
+        caption = (f"<b>{gift_name} #{collectible_number}</b>\n\n"
+                   f"<b>Model:</b> {cd.get('model', {}).get('name', 'N/A')}\n"
+                   f"<b>Backdrop:</b> {cd.get('backdrop', {}).get('name', 'N/A')}\n"
+                   f"<b>Symbol:</b> {cd.get('pattern', {}).get('name', 'N/A')}\n"
+                   f"<b>Owner:</b> @{gift['owner_username']}")
+
+        if all(isinstance(cd.get(k), dict) and cd[k].get('name') for k in ('model', 'backdrop', 'pattern')):
+            results.append(_gift_card_inline_result(gift_name, cd['model']['name'], cd['backdrop']['name'], cd['pattern']['name'], caption))
+        else:
             results.append({"type": "photo", "id": str(uuid.uuid4()), "photo_url": model_img, "thumb_url": model_img, "caption": caption, "parse_mode": "HTML"})
     except Exception as e:
         app.logger.error(f"Error in handle_inline_image: {e}", exc_info=True)
@@ -1393,26 +1963,39 @@ def handle_inline_image(from_user, gift_str):
         if conn: put_db_connection(conn)
     return results
 
+def _gift_card_inline_result(gift_name, model_name, backdrop_name, pattern_name, caption):
+    """Inline photo result showing the rendered card: by file_id if it was uploaded before, else by URL."""
+    file_id = get_gift_card_file_id(gift_card_key(gift_name, model_name, backdrop_name, pattern_name, 'full'))
+    if file_id:
+        return {"type": "photo", "id": str(uuid.uuid4()), "photo_file_id": file_id, "caption": caption, "parse_mode": "HTML"}
+    width, height = GIFT_CARD_SIZES['full']
+    return {"type": "photo", "id": str(uuid.uuid4()), "photo_url": get_gift_card_url(gift_name, model_name, backdrop_name, pattern_name),
+            "thumb_url": get_gift_card_url(gift_name, model_name, backdrop_name, pattern_name, 'thumb'),
+            "photo_width": width, "photo_height": height, "caption": caption, "parse_mode": "HTML"}
+
 def handle_inline_create_image(from_user, gift_components_str):
     parts = [p.strip() for p in gift_components_str.split(',', 3)]
     if len(parts) < 3: return []
     
-    gift_name, model_name, backdrop_name = parts[0], parts[1], parts[2]
+    gift_name, model_name, backdrop_name = resolve_gift_name(parts[0]), parts[1], parts[2]
     pattern_name = parts[3] if len(parts) > 3 and parts[3] else "Random"
     
     try:
         all_parts_data = fetch_collectible_parts(gift_name)
         selected_model = next((m for m in all_parts_data.get('models', []) if m['name'] == model_name), None)
-        if not selected_model: return []
-
-        model_img = selected_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(selected_model['name'])}.png"
+        selected_backdrop = next((b for b in all_parts_data.get('backdrops', []) if b['name'] == backdrop_name), None)
+        if pattern_name == "Random":
+            selected_pattern = select_weighted_random(all_parts_data.get('patterns', []))
+        else:
+            selected_pattern = next((p for p in all_parts_data.get('patterns', []) if p['name'] == pattern_name), None)
+        if not selected_model or not selected_backdrop or not selected_pattern: return []
 
         caption = (f"<b>Custom Gift Preview: {gift_name}</b>\n\n"
                    f"<b>Model:</b> {model_name}\n"
                    f"<b>Backdrop:</b> {backdrop_name}\n"
-                   f"<b>Symbol:</b> {pattern_name}")
+                   f"<b>Symbol:</b> {selected_pattern['name']}")
         
-        return [{"type": "photo", "id": str(uuid.uuid4()), "photo_url": model_img, "thumb_url": model_img, "caption": caption, "parse_mode": "HTML"}]
+        return [_gift_card_inline_result(gift_name, model_name, backdrop_name, selected_pattern['name'], caption)]
     except Exception as e:
         app.logger.error(f"Error in handle_inline_create_image: {e}", exc_info=True)
         return []
@@ -1465,45 +2048,594 @@ def _execute_create_and_send(sender_id, sender_username, receiver_id, receiver_u
                 send_telegram_message(sender_id, f"Action failed: Receiver @{receiver_username}'s gift box is now full.")
                 return
 
-            all_parts_data = fetch_collectible_parts(gift_name)
-            selected_model = next((m for m in all_parts_data.get('models', []) if m['name'] == model_name), None)
-            selected_backdrop = next((b for b in all_parts_data.get('backdrops', []) if b['name'] == backdrop_name), None)
-            selected_pattern = next((p for p in all_parts_data.get('patterns', []) if p['name'] == pattern_name), None) if pattern_name else select_weighted_random(all_parts_data.get('patterns', []))
+            all_parts_data = fetch_collectible_parts(gift_name)
+            selected_model = next((m for m in all_parts_data.get('models', []) if m['name'] == model_name), None)
+            selected_backdrop = next((b for b in all_parts_data.get('backdrops', []) if b['name'] == backdrop_name), None)
+            selected_pattern = next((p for p in all_parts_data.get('patterns', []) if p['name'] == pattern_name), None) if pattern_name else select_weighted_random(all_parts_data.get('patterns', []))
+
+            if not all([selected_model, selected_backdrop, selected_pattern]):
+                send_telegram_message(sender_id, f"Could not create gift. Invalid components specified.")
+                return
+
+            gift_type_id = CUSTOM_GIFTS_DATA.get(gift_name, {}).get('id', 'generated_gift')
+            cur.execute("SELECT COALESCE(MAX(collectible_number), 0) + 1 FROM gifts WHERE gift_type_id = %s;", (gift_type_id,))
+            next_number = cur.fetchone()[0]
+            new_instance_id = str(uuid.uuid4())
+            
+            collectible_row = build_collectible_row(cur, gift_name, selected_model, selected_backdrop, selected_pattern, supply=random.randint(2000, 10000), author=get_gift_author(gift_name))
+            
+            cur.execute("INSERT INTO gifts (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, collectible_number) VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s, %s, %s);", (new_instance_id, receiver_id, gift_type_id, gift_name, *collectible_row, next_number))
+            conn.commit()
+            
+            deep_link = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp=gift{gift_type_id}-{next_number}"
+            link_text = f"<b>{gift_name} #{next_number:,}</b>"
+            
+            sender_text = f'You successfully created and sent {link_text} to @{receiver_username}.'
+            send_telegram_message(sender_id, sender_text)
+            
+            receiver_text = f'You have received a new gift, {link_text}, from @{sender_username}!'
+            if comment: receiver_text += f'\n\n<i>{comment}</i>'
+            receiver_markup = {"inline_keyboard": [[{"text": "Check Out Gift", "url": deep_link}]]}
+            send_telegram_message(receiver_id, receiver_text, receiver_markup)
+    except Exception as e:
+        app.logger.error(f"Error in _execute_create_and_send: {e}", exc_info=True)
+        send_telegram_message(sender_id, "An unexpected error occurred while creating the gift.")
+    finally:
+        if conn: put_db_connection(conn)
+
+# --- MEDIA STORAGE ---
+MEDIA_FILENAME_PATTERN = re.compile(r'^[0-9a-f]{32}\.(webp|png|jpg)$')
+media_s3_client = None
+media_s3_client_lock = threading.Lock()
+
+def _get_media_s3_client():
+    global media_s3_client
+    if media_s3_client is None:
+        with media_s3_client_lock:
+            if media_s3_client is None:
+                import boto3
+                media_s3_client = boto3.client('s3', endpoint_url=MEDIA_S3_ENDPOINT_URL)
+    return media_s3_client
+
+def store_media(kind, data, extension, content_type):
+    """Stores `data` under media/<kind>/<content hash>.<extension> and returns its public URL.
+
+    Identical uploads map to the same object, so storing twice is a no-op.
+    """
+    filename = f"{hashlib.sha256(data).hexdigest()[:32]}.{extension}"
+    if MEDIA_S3_BUCKET:
+        _get_media_s3_client().put_object(
+            Bucket=MEDIA_S3_BUCKET, Key=f"{kind}/{filename}", Body=data, ContentType=content_type,
+            CacheControl=f"public, max-age={MEDIA_CACHE_MAX_AGE_SECONDS}, immutable"
+        )
+    else:
+        directory = os.path.join(MEDIA_ROOT, kind)
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+    return f"{MEDIA_PUBLIC_BASE_URL}/{kind}/{filename}"
+
+def _stream_size(stream):
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    return size
+
+def process_avatar_image(source):
+    """Decodes an uploaded image (bytes or file) and re-encodes it as a square AVATAR_SIZE WebP. Raises ValueError if it isn't a usable image."""
+    from PIL import Image, ImageOps
+    stream = io.BytesIO(source) if isinstance(source, bytes) else source
+    if _stream_size(stream) > AVATAR_MAX_UPLOAD_BYTES:
+        raise ValueError(f"Avatar is larger than {AVATAR_MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    try:
+        with Image.open(stream) as img:
+            if img.width * img.height > AVATAR_MAX_PIXELS:
+                raise ValueError("Avatar dimensions are too large.")
+            img = ImageOps.exif_transpose(img)
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+            img = ImageOps.fit(img, (AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, 'WEBP', quality=AVATAR_WEBP_QUALITY, method=4)
+            return out.getvalue()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError("Could not read the avatar image.") from e
+
+def save_avatar(source):
+    return store_media('avatars', process_avatar_image(source), 'webp', 'image/webp')
+
+def prepare_photo_upload(stream):
+    """
+    Checks an uploaded image against Telegram's photo limits and returns a file ready for sendPhoto.
+    Small JPEG/PNG files are passed through untouched; anything bigger or in another format is
+    re-encoded as JPEG into a spooled temp file. Raises ValueError for unusable images.
+    """
+    from PIL import Image
+    size = _stream_size(stream)
+    if size > SEND_IMAGE_MAX_BYTES:
+        raise ValueError(f"Image is larger than {SEND_IMAGE_MAX_BYTES // (1024 * 1024)} MB.")
+    try:
+        img = Image.open(stream)  # Only reads the header
+    except Exception as e:
+        raise ValueError("Could not read the image.") from e
+    if img.width + img.height > SEND_IMAGE_MAX_SIDE_SUM or img.width * img.height > AVATAR_MAX_PIXELS:
+        raise ValueError("Image dimensions are too large.")
+    if img.format in ('JPEG', 'PNG') and size <= SEND_IMAGE_RECOMPRESS_BYTES:
+        stream.seek(0)
+        return stream
+
+    try:
+        img = img.convert('RGBA')
+        flattened = Image.new('RGB', img.size, (255, 255, 255))
+        flattened.paste(img, mask=img.getchannel('A'))
+    except Exception as e:
+        raise ValueError("Could not read the image.") from e
+    out = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY_BYTES)
+    flattened.save(out, 'JPEG', quality=SEND_IMAGE_JPEG_QUALITY, optimize=True)
+    out.seek(0)
+    return out
+
+def decode_data_url(value):
+    """Returns the bytes of a base64 `data:` URL, or None if `value` isn't one."""
+    if not isinstance(value, str) or not value.startswith('data:'):
+        return None
+    header, sep, payload = value.partition(',')
+    if not sep or not header.endswith(';base64'):
+        raise ValueError("Only base64 data URLs are supported.")
+    try:
+        return base64.b64decode(payload, validate=True)
+    except ValueError:
+        raise ValueError("Malformed base64 data URL.")
+
+def normalize_avatar_url(value):
+    """Turns a submitted avatar into what we store: data URLs are uploaded, plain URLs are kept if short."""
+    if value is None:
+        return None
+    raw = decode_data_url(value)
+    if raw is not None:
+        return save_avatar(raw)
+    if not isinstance(value, str) or len(value) > MAX_AVATAR_URL_LENGTH or not value.startswith(('https://', 'http://')):
+        raise ValueError("avatar_url must be an http(s) URL or an image data URL.")
+    return value
+
+@app.route('/media/<kind>/<filename>', methods=['GET'])
+def serve_media(kind, filename):
+    if kind not in ('avatars', 'cards') or not MEDIA_FILENAME_PATTERN.match(filename):
+        abort(404)
+    response = send_from_directory(os.path.join(MEDIA_ROOT, kind), filename, max_age=MEDIA_CACHE_MAX_AGE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def media_object_exists(url):
+    """Whether the object behind a URL returned by store_media is actually in storage."""
+    kind, _, filename = url[len(MEDIA_PUBLIC_BASE_URL) + 1:].partition('/')
+    if MEDIA_S3_BUCKET:
+        try:
+            _get_media_s3_client().head_object(Bucket=MEDIA_S3_BUCKET, Key=f"{kind}/{filename}")
+            return True
+        except Exception:
+            return False
+    return os.path.isfile(os.path.join(MEDIA_ROOT, kind, filename))
+
+def migrate_inline_avatars(batch_size=100):
+    """
+    Moves avatars still stored as data URLs in accounts.avatar_url into media storage.
+    Returns the number moved, or None if media storage isn't persistent (a local MEDIA_ROOT on an
+    ephemeral disk would lose the files on the next deploy). An account keeps its data URL unless
+    the upload is confirmed to be in storage.
+    """
+    if not (MEDIA_S3_BUCKET or MEDIA_ROOT_PERSISTENT):
+        app.logger.error("Refusing to migrate avatars: set MEDIA_S3_BUCKET, or MEDIA_ROOT_PERSISTENT=1 if MEDIA_ROOT is on a persistent disk.")
+        return None
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    migrated, skipped, last_tg_id = 0, 0, None
+    try:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute(
+                    "SELECT tg_id, avatar_url FROM accounts WHERE avatar_url LIKE 'data:%%' AND (%s IS NULL OR tg_id > %s) ORDER BY tg_id LIMIT %s;",
+                    (last_tg_id, last_tg_id, batch_size)
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                for tg_id, avatar_url in rows:
+                    last_tg_id = tg_id
+                    try:
+                        new_url = normalize_avatar_url(avatar_url)
+                    except ValueError as e:
+                        app.logger.warning(f"Keeping unreadable inline avatar for {tg_id}: {e}")
+                        skipped += 1
+                        continue
+                    if not media_object_exists(new_url):
+                        app.logger.warning(f"Keeping inline avatar for {tg_id}: upload to media storage not confirmed.")
+                        skipped += 1
+                        continue
+                    # Only if the user hasn't changed their avatar meanwhile.
+                    cur.execute("UPDATE accounts SET avatar_url = %s WHERE tg_id = %s AND avatar_url = %s;", (new_url, tg_id, avatar_url))
+                    migrated += cur.rowcount
+                conn.commit()
+        app.logger.info(f"Moved {migrated} inline avatars to media storage; kept {skipped} as they were.")
+        return migrated
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Failed to migrate inline avatars: {e}", exc_info=True)
+        return migrated
+    finally:
+        put_db_connection(conn)
+
+# --- ASSET PROXY ---
+# Gift images and parts lists from the CDN and GitHub are served through /assets/<host>/<path>,
+# backed by a disk LRU cache, with ETags and optional ?w= thumbnails. From raw.githubusercontent.com
+# only the app's own repo and the repos customgifts.json links to are proxied. The image URLs in
+# hydrated collectible_data point here (see proxied_asset_url); index.html's assetUrl maps the rest.
+ASSET_GITHUB_RAW_PATTERN = re.compile(r'https://github\.com/([^/"\s]+)/([^/"\s]+)/(?:blob|raw)/([^"?\s]+)\?raw=true')
+ASSET_CONTENT_TYPES = ('image/', 'application/json')
+asset_fetch_locks = tuple(threading.Lock() for _ in range(64))  # Striped by cache key, so memory stays fixed
+asset_cache_bytes_written = 0  # Since the last prune; guarded by asset_cache_bytes_lock
+asset_cache_bytes_lock = threading.Lock()
+
+def canonical_asset_url(url):
+    """The upstream URL the proxy fetches for `url`, or None if the proxy doesn't serve `url`."""
+    if not isinstance(url, str):
+        return None
+    if url.startswith(ASSET_PROXY_BASE_URL + '/'):
+        url = 'https://' + url[len(ASSET_PROXY_BASE_URL) + 1:]
+    url = ASSET_GITHUB_RAW_PATTERN.sub(lambda m: f"https://raw.githubusercontent.com/{m.group(1)}/{m.group(2)}/{m.group(3)}", url)
+    parsed = urlparse(url)
+    if parsed.scheme != 'https' or parsed.netloc not in ASSET_PROXY_HOSTS or parsed.query:
+        return None
+    # requests resolves dot segments (including %2E-encoded ones) before fetching, which would
+    # step out of the allow-listed prefix below, so paths containing them are never proxied.
+    if any(segment in ('', '.', '..') for segment in unquote(parsed.path).split('/')[1:]):
+        return None
+    if parsed.netloc == 'raw.githubusercontent.com':
+        path = parsed.path.lstrip('/')
+        if not path.startswith(ASSET_PROXY_GITHUB_REPOS + tuple(custom_gift_catalog['github_repos'])):
+            return None
+    return url
+
+def proxied_asset_url(url):
+    """`url` pointed at the asset proxy, or unchanged if the proxy doesn't serve it."""
+    upstream_url = canonical_asset_url(url)
+    return f"{ASSET_PROXY_BASE_URL}/{upstream_url[len('https://'):]}" if upstream_url else url
+
+def _asset_cache_paths(upstream_url, width):
+    key = hashlib.sha256(f"{upstream_url}|{width or ''}".encode('utf-8')).hexdigest()
+    directory = os.path.join(ASSET_CACHE_DIR, key[:2])
+    return directory, os.path.join(directory, key)
+
+def _fetch_asset(upstream_url):
+    """Downloads an upstream asset. Returns (content_type, bytes); raises ValueError for unusable responses."""
+    response = requests.get(upstream_url, timeout=10, stream=True)
+    try:
+        if response.status_code == 404:
+            raise FileNotFoundError(upstream_url)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', 'application/octet-stream').split(';')[0].strip()
+        if content_type == 'text/plain' and upstream_url.endswith('.json'):
+            content_type = 'application/json'  # raw.githubusercontent.com serves JSON as text/plain
+        if not content_type.startswith(ASSET_CONTENT_TYPES):
+            raise ValueError(f"Unexpected content type {content_type} from {upstream_url}")
+        chunks, size = [], 0
+        for chunk in response.iter_content(65536):
+            size += len(chunk)
+            if size > ASSET_FETCH_MAX_BYTES:
+                raise ValueError(f"{upstream_url} is larger than {ASSET_FETCH_MAX_BYTES} bytes")
+            chunks.append(chunk)
+        return content_type, b''.join(chunks)
+    finally:
+        response.close()
+
+def _make_asset_thumbnail(content, width):
+    from PIL import Image
+    with Image.open(io.BytesIO(content)) as img:
+        if img.width <= width:
+            return None
+        img = img.convert('RGBA')
+        img.thumbnail((width, round(img.height * width / img.width)), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'WEBP', quality=85, method=4)
+        return out.getvalue()
 
-            if not all([selected_model, selected_backdrop, selected_pattern]):
-                send_telegram_message(sender_id, f"Could not create gift. Invalid components specified.")
-                return
+def get_cached_asset(upstream_url, width=None):
+    """
+    Returns (path, meta) of the cached asset, fetching it (and making the thumbnail) on a miss.
+    meta holds content_type and etag. Concurrent misses for the same asset fetch it once.
+    """
+    global asset_cache_bytes_written
+    directory, path = _asset_cache_paths(upstream_url, width)
+    meta = _read_asset_meta(path)
+    if meta:
+        try:
+            if time.time() - os.path.getmtime(path) > 3600:
+                os.utime(path)  # Recency for the LRU pruning; coarse so hits stay cheap
+            return path, meta
+        except OSError:
+            pass  # Pruned since the meta was read; fetch it again
+
+    with asset_fetch_locks[int(os.path.basename(path)[:8], 16) % len(asset_fetch_locks)]:
+        meta = _read_asset_meta(path)
+        if meta and os.path.exists(path):
+            return path, meta
+        content_type, content = _fetch_asset(upstream_url)
+        if width and content_type.startswith('image/') and content_type != 'image/svg+xml':
+            thumbnail = _make_asset_thumbnail(content, width)
+            if thumbnail:
+                content_type, content = 'image/webp', thumbnail
+        meta = {"content_type": content_type, "etag": hashlib.sha256(content).hexdigest()[:32], "upstream": upstream_url}
+
+        os.makedirs(directory, exist_ok=True)
+        tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+        with open(path + tmp_suffix, 'wb') as f:
+            f.write(content)
+        with open(path + '.json' + tmp_suffix, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(path + tmp_suffix, path)
+        os.replace(path + '.json' + tmp_suffix, path + '.json')  # Meta last: it marks the entry complete
+
+    with asset_cache_bytes_lock:
+        asset_cache_bytes_written += len(content)
+        prune_due = asset_cache_bytes_written > ASSET_CACHE_MAX_BYTES // 20
+        if prune_due:
+            asset_cache_bytes_written = 0
+    if prune_due:
+        submit_background_task(prune_asset_cache, dedup_key="asset_cache_prune")
+    return path, meta
+
+def _read_asset_meta(path):
+    try:
+        with open(path + '.json', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
 
-            gift_type_id = CUSTOM_GIFTS_DATA.get(gift_name, {}).get('id', 'generated_gift')
-            cur.execute("SELECT COALESCE(MAX(collectible_number), 0) + 1 FROM gifts WHERE gift_type_id = %s;", (gift_type_id,))
-            next_number = cur.fetchone()[0]
-            new_instance_id = str(uuid.uuid4())
-            
-            pattern_source_name = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-            model_image_url = selected_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(selected_model['name'])}.png"
-            lottie_model_path = selected_model.get('lottie') if selected_model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(selected_model['name'])}.json"
-            pattern_image_url = f"{CDN_BASE_URL}patterns/{quote(pattern_source_name)}/png/{quote(selected_pattern['name'])}.png"
-            
-            collectible_data = {"model": selected_model, "backdrop": selected_backdrop, "pattern": selected_pattern, "modelImage": model_image_url, "lottieModelPath": lottie_model_path, "patternImage": pattern_image_url, "backdropColors": selected_backdrop.get('hex'), "supply": random.randint(2000, 10000), "author": get_gift_author(gift_name)}
-            
-            cur.execute("INSERT INTO gifts (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, collectible_number) VALUES (%s, %s, %s, %s, TRUE, %s, %s);", (new_instance_id, receiver_id, gift_type_id, gift_name, json.dumps(collectible_data), next_number))
-            conn.commit()
-            
-            deep_link = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp=gift{gift_type_id}-{next_number}"
-            link_text = f"<b>{gift_name} #{next_number:,}</b>"
-            
-            sender_text = f'You successfully created and sent {link_text} to @{receiver_username}.'
-            send_telegram_message(sender_id, sender_text)
-            
-            receiver_text = f'You have received a new gift, {link_text}, from @{sender_username}!'
-            if comment: receiver_text += f'\n\n<i>{comment}</i>'
-            receiver_markup = {"inline_keyboard": [[{"text": "Check Out Gift", "url": deep_link}]]}
-            send_telegram_message(receiver_id, receiver_text, receiver_markup)
+def read_asset_bytes(url):
+    """Asset content through the cache; for server-side use such as card rendering."""
+    upstream_url = canonical_asset_url(url)
+    if not upstream_url:
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        return response.content
+    path, _ = get_cached_asset(upstream_url)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def prune_asset_cache():
+    """Evicts the least recently used assets until the cache is under ASSET_CACHE_MAX_BYTES."""
+    entries, total = [], 0
+    for root, _, files in os.walk(ASSET_CACHE_DIR):
+        for name in files:
+            if name.endswith(('.json', '.tmp')):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= ASSET_CACHE_MAX_BYTES:
+        return
+    entries.sort()
+    removed = 0
+    target = ASSET_CACHE_MAX_BYTES * 9 // 10
+    for _, size, path in entries:
+        if total <= target:
+            break
+        for victim in (path + '.json', path):
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed += 1
+    app.logger.info(f"Evicted {removed} cached assets.")
+
+@app.route('/assets/<host>/<path:asset_path>', methods=['GET'])
+def serve_asset(host, asset_path):
+    width = request.args.get('w', type=int)
+    upstream_url = canonical_asset_url(f"https://{host}/{quote(asset_path)}")
+    if not upstream_url or (width and width not in ASSET_THUMB_WIDTHS):
+        abort(404)
+    try:
+        path, meta = get_cached_asset(upstream_url, width)
+    except FileNotFoundError:
+        abort(404)
+    except (requests.RequestException, ValueError) as e:
+        app.logger.warning(f"Asset proxy could not fetch {upstream_url}: {e}")
+        return jsonify({"error": "Upstream asset unavailable."}), 502
+    response = send_file(path, mimetype=meta['content_type'], etag=meta['etag'], max_age=ASSET_CACHE_MAX_AGE_SECONDS, conditional=True)
+    response.cache_control.public = True
+    return response
+
+# --- GIFT CARD RENDERER ---
+# Share cards (backdrop gradient, tiled pattern, model, name and traits) are rendered once per
+# (gift, model, backdrop, pattern, size) and kept on disk. After the first upload to Telegram the
+# returned file_id is cached under 'card:<key>', so sending the same card again uploads nothing.
+gift_card_source_cache = OrderedDict()  # image URL -> decoded RGBA image
+gift_card_source_cache_lock = threading.Lock()
+GIFT_CARD_SOURCE_CACHE_MAX_ENTRIES = 64
+gift_card_fonts = {}
+gift_card_render_counter = itertools.count(1)  # next() is atomic, so concurrent renders each get their own number
+
+def _gift_card_font(size):
+    from PIL import ImageFont
+    font = gift_card_fonts.get(size)
+    if font is None:
+        try:
+            font = ImageFont.truetype(GIFT_CARD_FONT_PATH, size)
+        except OSError:
+            font = ImageFont.load_default(size)
+        gift_card_fonts[size] = font
+    return font
+
+def _gift_card_color(value, default):
+    from PIL import ImageColor
+    if isinstance(value, int):
+        value = f"#{value & 0xFFFFFF:06x}"
+    try:
+        return ImageColor.getrgb(value)[:3]
+    except (ValueError, TypeError, AttributeError):
+        return default
+
+def _gift_card_source_image(url):
+    from PIL import Image
+    with gift_card_source_cache_lock:
+        img = gift_card_source_cache.get(url)
+        if img is not None:
+            gift_card_source_cache.move_to_end(url)
+            return img
+    img = Image.open(io.BytesIO(read_asset_bytes(url))).convert('RGBA')
+    with gift_card_source_cache_lock:
+        gift_card_source_cache[url] = img
+        while len(gift_card_source_cache) > GIFT_CARD_SOURCE_CACHE_MAX_ENTRIES:
+            gift_card_source_cache.popitem(last=False)
+    return img
+
+def gift_card_key(gift_name, model_name, backdrop_name, pattern_name, size):
+    key = json.dumps([GIFT_CARD_RENDER_VERSION, gift_name, model_name, backdrop_name, pattern_name, size])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def get_gift_card_parts(gift_name, model_name, backdrop_name, pattern_name):
+    """Looks the named traits up in the gift's parts lists. Raises ValueError for unknown ones."""
+    parts = fetch_collectible_parts(gift_name)
+    model = next((m for m in parts.get('models', []) if m.get('name') == model_name), None)
+    backdrop = next((b for b in parts.get('backdrops', []) if b.get('name') == backdrop_name), None)
+    pattern = next((p for p in parts.get('patterns', []) if p.get('name') == pattern_name), None)
+    if not model or not backdrop or not pattern:
+        raise ValueError("Unknown model, backdrop or pattern for this gift.")
+    return model, backdrop, pattern
+
+def _draw_gift_card(gift_name, model, backdrop, pattern, width, height):
+    from PIL import Image, ImageDraw
+    scale = width / 450  # Layout below is in the web app's 450x600 share image units
+
+    # Radial gradient centred at the top edge, like `radial-gradient(circle at 50% 0%, ...)`.
+    colors = backdrop.get('hex') or {}
+    center = _gift_card_color(colors.get('centerColor'), (42, 55, 69))
+    edge = _gift_card_color(colors.get('edgeColor'), (23, 33, 43))
+    radius = (width ** 2 / 4 + height ** 2) ** 0.5
+    step = 128 / radius
+    mask = Image.radial_gradient('L').crop((
+        round(128 - width / 2 * step), 128, round(128 + width / 2 * step), round(128 + height * step)
+    )).resize((width, height), Image.BILINEAR)
+    card = Image.composite(Image.new('RGB', (width, height), edge), Image.new('RGB', (width, height), center), mask).convert('RGBA')
+
+    pattern_source = get_gift_parts_sources(gift_name)['patterns_source']
+    try:
+        tile = _gift_card_source_image(f"{CDN_BASE_URL}patterns/{quote(pattern_source)}/png/{quote(pattern['name'])}.png")
+        tile_width = max(1, round(width * 0.3))
+        tile = tile.resize((tile_width, max(1, round(tile.height * tile_width / tile.width))), Image.LANCZOS)
+        alpha = tile.getchannel('A').point(lambda a: round(a * GIFT_CARD_PATTERN_OPACITY))
+        tile.putalpha(alpha)
+        layer = Image.new('RGBA', (width, height))
+        for y in range(0, height, tile.height):
+            for x in range(0, width, tile_width):
+                layer.paste(tile, (x, y))
+        card = Image.alpha_composite(card, layer)
+    except (requests.RequestException, OSError, ValueError) as e:
+        app.logger.warning(f"Rendering {gift_name} card without pattern {pattern['name']}: {e}")
+
+    model_url = model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(model['name'])}.png"
+    model_img = _gift_card_source_image(model_url).copy()
+    box = round(width * 0.7 - 60 * scale)
+    model_img.thumbnail((box, box), Image.LANCZOS)
+    top = round(30 * scale)
+    card.alpha_composite(model_img, ((width - model_img.width) // 2, top + (box - model_img.height) // 2))
+
+    draw = ImageDraw.Draw(card)
+    y = top + box + round(20 * scale)
+    for text, size, fill in (("Upgraded Gift", 35, (255, 255, 255, 255)), (gift_name, 29, (255, 255, 255, 230))):
+        font = _gift_card_font(round(size * scale))
+        text_width = draw.textlength(text, font=font)
+        draw.text(((width - text_width) / 2, y), text, font=font, fill=fill)
+        y += round((size + 12) * scale)
+    y += round(14 * scale)
+    font = _gift_card_font(round(19 * scale))
+    left, right = round(45 * scale), width - round(45 * scale)
+    for label, value in (("Model", model['name']), ("Backdrop", backdrop['name']), ("Symbol", pattern['name'])):
+        draw.text((left, y), label, font=font, fill=(255, 255, 255, 255))
+        draw.text((right - draw.textlength(value, font=font), y), value, font=font, fill=(255, 255, 255, 180))
+        y += round(29 * scale)
+    return card.convert('RGB')
+
+def render_gift_card(gift_name, model, backdrop, pattern, size='full'):
+    """Returns (key, path) of the rendered card, rendering it only if it isn't cached yet."""
+    if size not in GIFT_CARD_SIZES:
+        raise ValueError(f"Unknown card size: {size}")
+    key = gift_card_key(gift_name, model['name'], backdrop['name'], pattern['name'], size)
+    path = os.path.join(GIFT_CARD_CACHE_DIR, f"{key}.jpg")
+    if os.path.exists(path):
+        return key, path
+
+    card = _draw_gift_card(gift_name, model, backdrop, pattern, *GIFT_CARD_SIZES[size])
+    os.makedirs(GIFT_CARD_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    card.save(tmp_path, 'JPEG', quality=GIFT_CARD_JPEG_QUALITY, optimize=True)
+    os.replace(tmp_path, path)
+
+    if next(gift_card_render_counter) % 100 == 0:
+        submit_background_task(prune_gift_card_cache, dedup_key="gift_card_prune")
+    return key, path
+
+def prune_gift_card_cache():
+    """Deletes the least recently written cards once the cache is over its cap."""
+    try:
+        entries = [e for e in os.scandir(GIFT_CARD_CACHE_DIR) if e.name.endswith('.jpg')]
+    except FileNotFoundError:
+        return
+    excess = len(entries) - GIFT_CARD_CACHE_MAX_FILES
+    if excess <= 0:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    app.logger.info(f"Pruned {excess} cached gift cards.")
+
+def get_gift_card_url(gift_name, model_name, backdrop_name, pattern_name, size='full'):
+    """Public URL that renders (or serves the cached) card; used where Telegram fetches the image itself."""
+    query = f"gift={quote(gift_name)}&model={quote(model_name)}&backdrop={quote(backdrop_name)}&pattern={quote(pattern_name)}&size={size}"
+    return f"{WEBHOOK_URL}/api/gifts/card?{query}"
+
+def get_gift_card_file_id(key):
+    return get_cached_telegram_file_id(f"card:{key}")
+
+def send_gift_card(chat_id, gift_name, model, backdrop, pattern, caption=None):
+    """Sends a card as a photo, by cached file_id when Telegram already has it."""
+    key, path = render_gift_card(gift_name, model, backdrop, pattern)
+    return send_telegram_photo(chat_id, path, caption=caption, cache_key=f"card:{key}")
+
+@app.route('/api/gifts/card', methods=['GET'])
+def get_gift_card():
+    gift_name = resolve_gift_name(request.args.get('gift', ''))
+    size = request.args.get('size', 'full')
+    if not gift_name or size not in GIFT_CARD_SIZES:
+        return jsonify({"error": "gift and a valid size are required"}), 400
+    try:
+        model, backdrop, pattern = get_gift_card_parts(gift_name, request.args.get('model'), request.args.get('backdrop'), request.args.get('pattern'))
+        key, path = render_gift_card(gift_name, model, backdrop, pattern, size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except requests.RequestException as e:
+        app.logger.error(f"Could not fetch images for {gift_name} card: {e}")
+        return jsonify({"error": "Could not fetch the gift images."}), 502
     except Exception as e:
-        app.logger.error(f"Error in _execute_create_and_send: {e}", exc_info=True)
-        send_telegram_message(sender_id, "An unexpected error occurred while creating the gift.")
-    finally:
-        if conn: put_db_connection(conn)
+        app.logger.error(f"Error rendering card for {gift_name}: {e}", exc_info=True)
+        return jsonify({"error": "An internal server error occurred."}), 500
+    response = send_from_directory(GIFT_CARD_CACHE_DIR, f"{key}.jpg", max_age=86400)
+    response.cache_control.public = True
+    return response
 
 # --- NEW/MODIFIED API ENDPOINTS ---
 @app.route('/api/users/subscribe', methods=['POST'])
@@ -1606,8 +2738,7 @@ def admin_impersonate():
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id, username, full_name, avatar_url FROM accounts WHERE LOWER(username) = LOWER(%s);", (target_username,))
-            target_account = cur.fetchone()
+            target_account = resolve_account_by_username(cur, target_username, "tg_id, username, full_name, avatar_url")
             if not target_account:
                 return jsonify({"error": f"User @{target_username} not found."}), 404
             
@@ -1618,6 +2749,83 @@ def admin_impersonate():
     finally:
         if conn: put_db_connection(conn)
 
+# --- SEARCH ---
+SEARCH_RESULT_LIMIT = 5
+SEARCH_TRGM_MIN_LENGTH = 3
+search_trgm_available = None
+
+# Ranked: exact username, username prefix, name prefix, then (with pg_trgm) substring matches.
+# Every branch is limited on its own so each one stays an index scan.
+SEARCH_ACCOUNTS_SQL = """
+    SELECT tg_id, username, full_name, avatar_url, rank FROM (
+        (SELECT tg_id, username, full_name, avatar_url, 0 AS rank FROM accounts
+         WHERE username_lower = %(term)s LIMIT 1)
+        UNION ALL
+        (SELECT tg_id, username, full_name, avatar_url, 1 AS rank FROM accounts
+         WHERE username_lower LIKE %(prefix)s LIMIT %(limit)s)
+        UNION ALL
+        (SELECT tg_id, username, full_name, avatar_url, 2 AS rank FROM accounts
+         WHERE LOWER(full_name) LIKE %(prefix)s LIMIT %(limit)s)
+    ) matches
+    ORDER BY rank, char_length(username) NULLS LAST, username
+"""
+SEARCH_ACCOUNTS_TRGM_SQL = """
+    SELECT tg_id, username, full_name, avatar_url, 3 AS rank FROM accounts
+    WHERE username_lower LIKE %(contains)s OR LOWER(full_name) LIKE %(contains)s
+    ORDER BY GREATEST(similarity(username_lower, %(term)s), similarity(LOWER(full_name), %(term)s)) DESC
+    LIMIT %(limit)s
+"""
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _search_has_trgm(cur):
+    global search_trgm_available
+    if search_trgm_available is None:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm';")
+        search_trgm_available = cur.fetchone() is not None
+    return search_trgm_available
+
+def search_accounts(cur, query, limit=SEARCH_RESULT_LIMIT):
+    term = query.lower()
+    params = {"term": term, "prefix": _escape_like(term) + '%', "contains": '%' + _escape_like(term) + '%', "limit": limit}
+    cur.execute(SEARCH_ACCOUNTS_SQL, params)
+    rows = cur.fetchall()
+    if len(rows) < limit and len(term) >= SEARCH_TRGM_MIN_LENGTH and _search_has_trgm(cur):
+        cur.execute(SEARCH_ACCOUNTS_TRGM_SQL, params)
+        rows += cur.fetchall()
+
+    seen, accounts = set(), []
+    for row in rows:
+        if row['tg_id'] in seen:
+            continue
+        seen.add(row['tg_id'])
+        accounts.append(row)
+        if len(accounts) >= limit:
+            break
+    return accounts
+
+def search_gift_catalog(cur, query, limit=SEARCH_RESULT_LIMIT):
+    key = normalize_gift_name_key(query)
+    if not key:
+        return []
+    cur.execute("""
+        SELECT gift_name, gift_type_id FROM gift_catalog
+        WHERE name_key LIKE %s
+        ORDER BY (name_key = %s) DESC, char_length(name_key), gift_name
+        LIMIT %s;
+    """, (_escape_like(key) + '%', key, limit))
+    rows = cur.fetchall()
+    if len(rows) < limit and len(key) >= SEARCH_TRGM_MIN_LENGTH and _search_has_trgm(cur):
+        cur.execute("""
+            SELECT gift_name, gift_type_id FROM gift_catalog
+            WHERE name_key %% %s AND name_key NOT LIKE %s
+            ORDER BY similarity(name_key, %s) DESC
+            LIMIT %s;
+        """, (key, _escape_like(key) + '%', key, limit - len(rows)))
+        rows += cur.fetchall()
+    return rows
+
 @app.route('/api/search', methods=['GET'])
 def search_handler():
     query = request.args.get('q', '').strip()
@@ -1631,36 +2839,28 @@ def search_handler():
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             # Search for users
-            if query.startswith('@'):
-                search_term = query[1:] + '%'
-            else:
-                search_term = query + '%'
-            
-            cur.execute("""
-                SELECT tg_id, username, full_name, avatar_url FROM accounts 
-                WHERE username ILIKE %s OR full_name ILIKE %s LIMIT 5;
-            """, (search_term, search_term))
-            
-            for row in cur.fetchall():
-                results.append({
-                    "type": "user",
-                    "id": row['tg_id'],
-                    "username": row['username'],
-                    "full_name": row['full_name'],
-                    "avatar_url": row['avatar_url']
-                })
+            user_query = query[1:] if query.startswith('@') else query
+            if user_query:
+                for row in search_accounts(cur, user_query):
+                    results.append({
+                        "type": "user",
+                        "id": row['tg_id'],
+                        "username": row['username'],
+                        "full_name": row['full_name'],
+                        "avatar_url": row['avatar_url']
+                    })
             
-            # Search for gifts
+            # Search for gifts: "Name-Number" finds one collectible, anything else suggests gift names.
             gift_match = re.match(r'^(.+?)-(\d+)$', query)
             if gift_match:
-                gift_name, gift_number = gift_match.group(1).strip(), int(gift_match.group(2))
-                cur.execute("""
-                    SELECT instance_id, gift_name, collectible_number, collectible_data 
-                    FROM gifts WHERE gift_name ILIKE %s AND collectible_number = %s AND is_collectible = TRUE LIMIT 1;
-                """, (gift_name, gift_number))
-                
+                clause, params = gift_identity_clause(gift_match.group(1), int(gift_match.group(2)))
+                cur.execute(f"""
+                    SELECT instance_id, gift_name, collectible_number, collectible_data, model_id, backdrop_id, pattern_id
+                    FROM gifts WHERE {clause} LIMIT 1;
+                """, params)
                 gift_row = cur.fetchone()
                 if gift_row:
+                    gift_row = hydrate_collectible_data(cur, [dict(gift_row)])[0]
                     cd = gift_row['collectible_data']
                     results.append({
                         "type": "gift",
@@ -1668,6 +2868,13 @@ def search_handler():
                         "name": f"{gift_row['gift_name']} #{gift_row['collectible_number']}",
                         "image_url": cd.get('modelImage') if isinstance(cd, dict) else ''
                     })
+            elif not query.startswith('@'):
+                for row in search_gift_catalog(cur, query):
+                    results.append({
+                        "type": "gift_type",
+                        "id": row['gift_type_id'],
+                        "name": row['gift_name']
+                    })
         
         return jsonify(results)
     except Exception as e:
@@ -1678,170 +2885,192 @@ def search_handler():
 
 # --- EXISTING API ENDPOINTS (AS PROMISED, FULLY WRITTEN) ---
 
-@app.route('/webhook', methods=['POST'])
-def webhook_handler():
-    update = request.get_json()
+def handle_callback_query(callback_query):
+    """Handles inline keyboard button presses from bot messages."""
+    user_id = callback_query["from"]["id"]
+    data = callback_query.get("data")
+    if not (data and data.startswith("publish_giveaway_")):
+        return
+
+    giveaway_id = int(data.split('_')[2])
+    answer_callback_query(callback_query['id'], text="Publishing...")
+
     conn = get_db_connection()
-    if not conn: return jsonify({"status": "error", "message": "db connection failed"}), 500
+    if not conn:
+        app.logger.error(f"Dropping callback {callback_query.get('id')}: db connection failed")
+        return
 
     try:
-        if "inline_query" in update:
-            handle_inline_query(update["inline_query"])
-            return jsonify({"status": "ok"}), 200
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("SELECT * FROM giveaways WHERE id = %s AND status = 'pending_setup'", (giveaway_id,))
+            giveaway = cur.fetchone()
+
+            if not giveaway:
+                send_telegram_message(user_id, "This giveaway has already been published or does not exist.")
+                return
+
+            post_result = send_telegram_message(giveaway['channel_id'], "Preparing giveaway...")
+
+            if post_result and post_result.get('ok'):
+                message_id = post_result['result']['message_id']
+                cur.execute("UPDATE giveaways SET status = 'active', message_id = %s, last_update_time = CURRENT_TIMESTAMP WHERE id = %s;", (message_id, giveaway_id))
+                notify_giveaway_scheduler(cur)
+                conn.commit()
+                update_giveaway_message(giveaway_id)
+                send_telegram_message(user_id, "✅ Giveaway published successfully!")
+            else:
+                send_telegram_message(user_id, "❌ Failed to publish giveaway. Please check that the Channel ID is correct and that the bot has permission to post in it.")
+    finally:
+        put_db_connection(conn)
 
-        if "chosen_inline_result" in update:
-            handle_chosen_inline_result(update["chosen_inline_result"])
-            return jsonify({"status": "ok"}), 200
+def handle_bot_message(message):
+    """Handles private messages sent to the bot: giveaway setup, /start, user and gift lookups."""
+    conn = get_db_connection()
+    if not conn:
+        app.logger.error(f"Dropping message from {message.get('chat', {}).get('id')}: db connection failed")
+        return
 
+    try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            if "callback_query" in update:
-                callback_query = update["callback_query"]
-                user_id = callback_query["from"]["id"]
-                data = callback_query.get("data")
-
-                if data and data.startswith("publish_giveaway_"):
-                    giveaway_id = int(data.split('_')[2])
-                    answer_callback_query(callback_query['id'], text="Publishing...")
-                    cur.execute("SELECT * FROM giveaways WHERE id = %s AND status = 'pending_setup'", (giveaway_id,))
-                    giveaway = cur.fetchone()
-
-                    if not giveaway:
-                        send_telegram_message(user_id, "This giveaway has already been published or does not exist.")
-                        return jsonify({"status": "ok"}), 200
-
-                    post_result = send_telegram_message(giveaway['channel_id'], "Preparing giveaway...")
-
-                    if post_result and post_result.get('ok'):
-                        message_id = post_result['result']['message_id']
-                        cur.execute("UPDATE giveaways SET status = 'active', message_id = %s, last_update_time = CURRENT_TIMESTAMP WHERE id = %s;", (message_id, giveaway_id))
-                        conn.commit()
-                        update_giveaway_message(giveaway_id)
-                        send_telegram_message(user_id, "✅ Giveaway published successfully!")
-                    else:
-                        send_telegram_message(user_id, "❌ Failed to publish giveaway. Please check that the Channel ID is correct and that the bot has permission to post in it.")
-
-            elif "message" in update:
-                message = update["message"]
-                chat_id = message["chat"]["id"]
-                text = message.get("text", "")
-
-                cur.execute("SELECT bot_state FROM accounts WHERE tg_id = %s;", (chat_id,))
-                user_row = cur.fetchone()
-                user_state = user_row['bot_state'] if user_row else None
-
-                if user_state and user_state.startswith("awaiting_giveaway"):
-                    handle_giveaway_setup(conn, cur, chat_id, user_state, text)
-
-                elif text.startswith("/start"):
-                    if "giveaway" in text:
-                        try:
-                            giveaway_id = int(text.split('giveaway')[1])
-                            cur.execute("SELECT id, last_update_time, required_channels FROM giveaways WHERE id = %s AND status = 'active'", (giveaway_id,))
-                            giveaway = cur.fetchone()
-                            if not giveaway:
-                                send_telegram_message(chat_id, "This giveaway is no longer active or does not exist.")
+            chat_id = message["chat"]["id"]
+            text = message.get("text", "")
+
+            cur.execute("SELECT bot_state FROM accounts WHERE tg_id = %s;", (chat_id,))
+            user_row = cur.fetchone()
+            user_state = user_row['bot_state'] if user_row else None
+
+            if user_state and user_state.startswith("awaiting_giveaway"):
+                handle_giveaway_setup(conn, cur, chat_id, user_state, text)
+
+            elif text.startswith("/start"):
+                if "giveaway" in text:
+                    try:
+                        giveaway_id = int(text.split('giveaway')[1])
+                        cur.execute("SELECT id, required_channels FROM giveaways WHERE id = %s AND status = 'active'", (giveaway_id,))
+                        giveaway = cur.fetchone()
+                        if not giveaway:
+                            send_telegram_message(chat_id, "This giveaway is no longer active or does not exist.")
+                        else:
+                            unsubscribed_channels = []
+                            if giveaway['required_channels']:
+                                channels_to_check = [c.strip() for c in giveaway['required_channels'].split(',') if c.strip()]
+                                unsubscribed_channels = get_unsubscribed_channels(channels_to_check, chat_id)
+                            
+                            if unsubscribed_channels:
+                                channels_str = ", ".join(unsubscribed_channels)
+                                send_telegram_message(chat_id, f"To participate, you must first subscribe to: {channels_str}\nPlease subscribe and try again.")
                             else:
-                                unsubscribed_channels = []
-                                if giveaway['required_channels']:
-                                    channels_to_check = [c.strip() for c in giveaway['required_channels'].split(',')]
-                                    for channel_username in channels_to_check:
-                                        member_info = get_chat_member(channel_username, chat_id)
-                                        if not member_info or not member_info.get('ok') or member_info['result']['status'] in ['left', 'kicked']:
-                                            unsubscribed_channels.append(channel_username)
-                                
-                                if unsubscribed_channels:
-                                    channels_str = ", ".join(unsubscribed_channels)
-                                    send_telegram_message(chat_id, f"To participate, you must first subscribe to: {channels_str}\nPlease subscribe and try again.")
-                                else:
-                                    cur.execute("INSERT INTO giveaway_participants (giveaway_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", (giveaway_id, chat_id))
-                                    conn.commit()
-                                    send_telegram_message(chat_id, "🎉 You have successfully joined the giveaway! Good luck!")
-
-                                    now = datetime.now(pytz.utc)
-                                    last_update = giveaway.get('last_update_time') or (now - timedelta(seconds=GIVEAWAY_UPDATE_THROTTLE_SECONDS + 1))
-                                    if now - last_update > timedelta(seconds=GIVEAWAY_UPDATE_THROTTLE_SECONDS):
-                                        cur.execute("UPDATE giveaways SET last_update_time = CURRENT_TIMESTAMP WHERE id = %s;", (giveaway_id,))
-                                        conn.commit()
-                                        threading.Thread(target=update_giveaway_message, args=(giveaway_id,)).start()
-                        except (IndexError, ValueError):
-                            send_telegram_message(chat_id, "Invalid giveaway link.")
-                    else:
-                        caption = ("<b>Welcome to the Gift Upgrade Demo!</b>\n\n"
-                                   "This app is a simulation of Telegram's gift and collectible system. "
-                                   "You can buy gifts, upgrade them, and trade them with other users.\n\n"
-                                   "Tap the button below to get started!")
-                        photo_url = "https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/refs/heads/main/IMG_20250706_195911_731.jpg"
-                        reply_markup = {
-                            "inline_keyboard": [
-                                [{"text": "🎁 Open Gift App", "web_app": {"url": WEBAPP_URL}}],
-                                [{"text": "🐞 Report Bug", "url": "https://t.me/Vasiliy939"}]
-                            ]
-                        }
-                        send_telegram_photo(chat_id, photo_url, caption=caption, reply_markup=reply_markup)
-                # --- NEW: Handle Username (@vasya) OR User ID (123456) ---
-                # --- NEW: Handle Username (@vasya) OR User ID (123456) ---
-                elif text.startswith('@') or text.isdigit():
-                    target_identifier = text
-                    user_found = None
-                    start_param = ""
-
-                    with conn.cursor(cursor_factory=DictCursor) as cur: # Ensure cursor is active here
-                        # Case 1: Username
-                        if text.startswith('@'):
-                            username = text[1:] # Remove @
-                            cur.execute("SELECT tg_id, full_name FROM accounts WHERE LOWER(username) = LOWER(%s);", (username,))
-                            user_found = cur.fetchone()
-                            if user_found:
-                                start_param = f"user@{username}"
-
-                        # Case 2: Numeric ID
-                        elif text.isdigit():
-                            tg_id = int(text)
-                            cur.execute("SELECT tg_id, full_name FROM accounts WHERE tg_id = %s;", (tg_id,))
-                            user_found = cur.fetchone()
-                            if user_found:
-                                start_param = f"user{tg_id}"
-
-                    if user_found:
-                        import html # Import html escape function
-                        # Escape the name to handle special chars like <, >, &
-                        safe_full_name = html.escape(user_found['full_name'])
-                        
-                        profile_url = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp={start_param}"
-                        
-                        reply_markup = {
-                            "inline_keyboard": [[
-                                {"text": f"👤 Open Profile", "web_app": {"url": profile_url}}
-                            ]]
-                        }
-                        # Use safe_full_name in the text
-                        send_telegram_message(chat_id, f"Found user!\nTap the button to view their profile.", reply_markup=reply_markup)
-                    else:
-                        send_telegram_message(chat_id, f"Sorry, I couldn't find a user with the identifier in the app's database.")
+                                cur.execute("INSERT INTO giveaway_participants (giveaway_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", (giveaway_id, chat_id))
+                                is_new_participant = cur.rowcount == 1
+                                if is_new_participant:
+                                    cur.execute("UPDATE giveaways SET participant_count = participant_count + 1 WHERE id = %s;", (giveaway_id,))
+                                conn.commit()
+                                send_telegram_message(chat_id, "🎉 You have successfully joined the giveaway! Good luck!")
+
+                                if is_new_participant:
+                                    schedule_giveaway_message_update(giveaway_id)
+                    except (IndexError, ValueError):
+                        send_telegram_message(chat_id, "Invalid giveaway link.")
+                else:
+                    caption = ("<b>Welcome to the Gift Upgrade Demo!</b>\n\n"
+                               "This app is a simulation of Telegram's gift and collectible system. "
+                               "You can buy gifts, upgrade them, and trade them with other users.\n\n"
+                               "Tap the button below to get started!")
+                    photo_url = "https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/refs/heads/main/IMG_20250706_195911_731.jpg"
+                    reply_markup = {
+                        "inline_keyboard": [
+                            [{"text": "🎁 Open Gift App", "web_app": {"url": WEBAPP_URL}}],
+                            [{"text": "🐞 Report Bug", "url": "https://t.me/Vasiliy939"}]
+                        ]
+                    }
+                    send_telegram_photo(chat_id, photo_url, caption=caption, reply_markup=reply_markup)
+            # --- NEW: Handle Username (@vasya) OR User ID (123456) ---
+            # --- NEW: Handle Username (@vasya) OR User ID (123456) ---
+            elif text.startswith('@') or text.isdigit():
+                target_identifier = text
+                user_found = None
+                start_param = ""
+
+                with conn.cursor(cursor_factory=DictCursor) as cur: # Ensure cursor is active here
+                    # Case 1: Username
+                    if text.startswith('@'):
+                        username = text[1:] # Remove @
+                        user_found = resolve_account_by_username(cur, username, "tg_id, full_name")
+                        if user_found:
+                            start_param = f"user@{username}"
+
+                    # Case 2: Numeric ID
+                    elif text.isdigit():
+                        tg_id = int(text)
+                        cur.execute("SELECT tg_id, full_name FROM accounts WHERE tg_id = %s;", (tg_id,))
+                        user_found = cur.fetchone()
+                        if user_found:
+                            start_param = f"user{tg_id}"
+
+                if user_found:
+                    import html # Import html escape function
+                    # Escape the name to handle special chars like <, >, &
+                    safe_full_name = html.escape(user_found['full_name'])
                     
-                    return jsonify({"status": "ok"}), 200
-
-                # --- NEW: Handle GiftName-Number format ---
+                    profile_url = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp={start_param}"
+                    
+                    reply_markup = {
+                        "inline_keyboard": [[
+                            {"text": f"👤 Open Profile", "web_app": {"url": profile_url}}
+                        ]]
+                    }
+                    # Use safe_full_name in the text
+                    send_telegram_message(chat_id, f"Found user!\nTap the button to view their profile.", reply_markup=reply_markup)
                 else:
-                    gift_match = re.match(r'^([\w\s\']{3,25})-([0-9]{1,7})$', text)
-                    if gift_match:
-                        gift_name, collectible_number = gift_match.group(1).strip(), int(gift_match.group(2))
-                        # Check if a gift with that name and number exists
-                        cur.execute("SELECT gift_type_id FROM gifts WHERE gift_name ILIKE %s AND collectible_number = %s AND is_collectible = TRUE LIMIT 1;", (gift_name, collectible_number))
-                        gift_row = cur.fetchone()
-                        if gift_row:
-                            # Use name for the link, backend will resolve it
-                            gift_link = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp=gift{gift_name}-{collectible_number}"
-                            reply_markup = {"inline_keyboard": [[{"text": f"🎁 View {gift_name} #{collectible_number}", "web_app": {"url": gift_link}}]]}
-                            send_telegram_message(chat_id, f"Found gift: {gift_name} #{collectible_number}. Tap below to view it.", reply_markup=reply_markup)
-                        else:
-                            send_telegram_message(chat_id, f"Sorry, I couldn't find the gift '{gift_name} #{collectible_number}'.")
-                        return jsonify({"status": "ok"}), 200
-    
+                    send_telegram_message(chat_id, f"Sorry, I couldn't find a user with the identifier in the app's database.")
+                
+                return
+
+            # --- NEW: Handle GiftName-Number format ---
+            else:
+                gift_match = re.match(r'^([\w\s\']{3,25})-([0-9]{1,7})$', text)
+                if gift_match:
+                    gift_name, collectible_number = gift_match.group(1).strip(), int(gift_match.group(2))
+                    # Check if a gift with that name and number exists
+                    clause, params = gift_identity_clause(gift_name, collectible_number)
+                    cur.execute(f"SELECT gift_type_id FROM gifts WHERE {clause} LIMIT 1;", params)
+                    gift_row = cur.fetchone()
+                    if gift_row:
+                        # Use name for the link, backend will resolve it
+                        gift_link = f"https://t.me/{BOT_USERNAME}/{WEBAPP_SHORT_NAME}?startapp=gift{gift_name}-{collectible_number}"
+                        reply_markup = {"inline_keyboard": [[{"text": f"🎁 View {gift_name} #{collectible_number}", "web_app": {"url": gift_link}}]]}
+                        send_telegram_message(chat_id, f"Found gift: {gift_name} #{collectible_number}. Tap below to view it.", reply_markup=reply_markup)
+                    else:
+                        send_telegram_message(chat_id, f"Sorry, I couldn't find the gift '{gift_name} #{collectible_number}'.")
+                    return
     finally:
-        if conn:
-            put_db_connection(conn)
+        put_db_connection(conn)
+
+def process_telegram_update(update):
+    """Routes a single Telegram update. Runs on the update workers, never on the request thread.
+
+    Inline queries never touch the database here; handlers that need a connection
+    check one out themselves and hold it only for as long as they use it.
+    """
+    if "inline_query" in update:
+        handle_inline_query(update["inline_query"])
+    elif "chosen_inline_result" in update:
+        handle_chosen_inline_result(update["chosen_inline_result"])
+    elif "callback_query" in update:
+        handle_callback_query(update["callback_query"])
+    elif "message" in update:
+        handle_bot_message(update["message"])
 
+@app.route('/webhook', methods=['POST'])
+def webhook_handler():
+    """Acknowledges the update immediately; the actual work happens on the update workers."""
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict):
+        return jsonify({"status": "error", "message": "invalid update"}), 400
+
+    if not enqueue_telegram_update(update):
+        # Telegram retries non-2xx responses, so a full queue just delays the update.
+        return jsonify({"status": "busy"}), 503
     return jsonify({"status": "ok"}), 200
 
 @app.route('/api/account/collection_price', methods=['GET'])
@@ -1850,6 +3079,9 @@ def get_collection_price():
     if not tg_id:
         return jsonify({"error": "tg_id is required"}), 400
 
+    # portalsmp pulls in pyrogram, which takes about a second to import, so only load it here.
+    from portalsmp import search as portals_search, filterFloors
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Database connection failed."}), 500
@@ -1858,11 +3090,11 @@ def get_collection_price():
         with conn.cursor(cursor_factory=DictCursor) as cur:
             # Fetch all collectible gifts for the user
             cur.execute("""
-                SELECT instance_id, gift_name, collectible_data
+                SELECT instance_id, gift_name, collectible_data, model_id, backdrop_id, pattern_id
                 FROM gifts 
                 WHERE owner_id = %s AND is_collectible = TRUE;
             """, (tg_id,))
-            user_gifts = cur.fetchall()
+            user_gifts = hydrate_collectible_data(cur, [dict(row) for row in cur.fetchall()])
 
         if not user_gifts:
             return jsonify({"total_price": 0, "priced_gifts": []}), 200
@@ -1886,7 +3118,7 @@ def get_collection_price():
             
             try:
                 # 1. Primary Method: Search for the exact item's floor price
-                search_result = search(
+                search_result = portals_search(
                     gift_name=gift_name, model=model, backdrop=backdrop, symbol=symbol,
                     sort="price_asc", limit=1, authData=PORTALS_AUTH_TOKEN
                 )
@@ -1945,12 +3177,13 @@ def check_customization_access():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
 
-    member_info = get_chat_member(REQUIRED_GIVEAWAY_CHANNEL, user_id)
-    
-    if member_info and member_info.get('ok'):
-        status = member_info['result']['status']
-        if status in ['creator', 'administrator', 'member']:
-            return jsonify({"access": True}), 200
+    try:
+        status = get_chat_member_status(REQUIRED_GIVEAWAY_CHANNEL, int(user_id))
+    except (ValueError, TypeError):
+        return jsonify({"error": "user_id must be numeric"}), 400
+
+    if status in ['creator', 'administrator', 'member']:
+        return jsonify({"access": True}), 200
 
     return jsonify({"access": False}), 200
 
@@ -1975,10 +3208,7 @@ def api_get_single_market_listing(instance_id):
             if not gift_data:
                 return jsonify({"error": "This gift is no longer for sale or does not exist."}), 404
             
-            result = dict(gift_data)
-            # Ensure collectible_data is parsed JSON, not a string, before sending
-            if isinstance(result.get('collectible_data'), str):
-                result['collectible_data'] = json.loads(result['collectible_data'])
+            result = _update_gifts_with_live_supply(cur, hydrate_collectible_data(cur, [dict(gift_data)]))[0]
                 
             return jsonify(result), 200
             
@@ -2070,6 +3300,9 @@ def api_topup_stars():
 
 @app.route('/api/market/summary', methods=['GET'])
 def api_get_market_summary():
+    etag = resource_etag('market')
+    if is_not_modified(etag):
+        return not_modified_response(etag)
     conn = get_db_connection()
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
@@ -2085,7 +3318,7 @@ def api_get_market_summary():
                 GROUP BY gift_type_id, gift_name, original_image_url;
             """)
             summary = [dict(row) for row in cur.fetchall()]
-            return jsonify(summary), 200
+            return with_etag(jsonify(summary), etag), 200
     except Exception as e:
         app.logger.error(f"Error fetching market summary: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred."}), 500
@@ -2101,19 +3334,15 @@ def api_get_market_listings(gift_type_id):
     symbol = request.args.get('symbol')
 
     # Base query
-    query = "SELECT instance_id, collectible_data, sale_price FROM gifts WHERE is_on_sale = TRUE AND is_collectible = TRUE AND gift_type_id = %s"
+    query = "SELECT instance_id, gift_type_id, gift_name, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, sale_price FROM gifts g WHERE is_on_sale = TRUE AND is_collectible = TRUE AND gift_type_id = %s"
     params = [gift_type_id]
 
     # Add filters
-    if model:
-        query += " AND collectible_data->'model'->>'name' = %s"
-        params.append(model)
-    if backdrop:
-        query += " AND collectible_data->'backdrop'->>'name' = %s"
-        params.append(backdrop)
-    if symbol:
-        query += " AND collectible_data->'pattern'->>'name' = %s"
-        params.append(symbol)
+    for kind, value in (("model", model), ("backdrop", backdrop), ("pattern", symbol)):
+        if value:
+            # Gifts whose stored trait differed from the dictionary copy keep it inline.
+            query += f" AND ({GIFT_TRAIT_ID_COLUMNS[kind]} IN (SELECT id FROM {GIFT_TRAIT_TABLES[kind]} WHERE name = %s) OR collectible_data->'{kind}'->>'name' = %s)"
+            params.extend([value, value])
 
     # Add sorting
     if sort_by == 'price_desc':
@@ -2123,8 +3352,8 @@ def api_get_market_listings(gift_type_id):
     elif sort_by == 'number_desc':
         query += " ORDER BY collectible_number DESC"
     elif sort_by == 'rarity_asc':
-        # Sorting by rarity requires casting the JSONB value to an integer
-        query += " ORDER BY (collectible_data->'model'->>'rarityPermille')::int ASC"
+        # Sorting by rarity requires casting the model's JSONB value to an integer
+        query += " ORDER BY (COALESCE((SELECT data FROM gift_models WHERE id = g.model_id), g.collectible_data->'model')->>'rarityPermille')::int ASC"
     else: # Default to price_asc
         query += " ORDER BY sale_price ASC"
     
@@ -2133,11 +3362,7 @@ def api_get_market_listings(gift_type_id):
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute(query, tuple(params))
-            listings = [dict(row) for row in cur.fetchall()]
-            # Process JSONB data before sending
-            for item in listings:
-                if 'collectible_data' in item and isinstance(item['collectible_data'], str):
-                    item['collectible_data'] = json.loads(item['collectible_data'])
+            listings = _update_gifts_with_live_supply(cur, hydrate_collectible_data(cur, [dict(row) for row in cur.fetchall()]))
             return jsonify(listings), 200
     except Exception as e:
         app.logger.error(f"Error fetching market listings for {gift_type_id}: {e}", exc_info=True)
@@ -2209,29 +3434,53 @@ def api_buy_market_gift(instance_id):
 
 @app.route('/api/profile/<string:identifier>', methods=['GET'])
 def get_user_profile(identifier):
+    viewer_id = request.args.get('viewer_id')
+    # The viewer's version covers their custom gifts setting and subscriptions; gift_stock covers
+    # the live supply counts filled in below.
+    viewer_ids = [int(viewer_id)] if viewer_id and str(viewer_id).isdigit() else []
+
+    # Revalidation from memory: with the account's tg_id and all versions cached (kept current by
+    # the NOTIFY listener), a 304 needs no connection at all.
+    if request.if_none_match:
+        cached_user_id = int(identifier) if identifier.isdigit() else cached_profile_user_id(identifier)
+        if cached_user_id is not None:
+            versions = cached_versions(["gift_stock"] + [f"user:{tg_id}" for tg_id in {cached_user_id, *viewer_ids}])
+            etag = versioned_etag(versions) if versions else None
+            if is_not_modified(etag):
+                return not_modified_response(etag)
+
     conn = get_db_connection()
     if not conn: return jsonify({"error": "Database connection failed."}), 500
-    viewer_id = request.args.get('viewer_id')
     
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            viewer_can_see_custom = has_custom_gifts_enabled(cur, viewer_id)
-
+            cache_generation = resource_version_cache_generation
             # --- CHANGED: Logic to support both Username and ID ---
             if identifier.isdigit():
                 # If identifier is all numbers, search by tg_id
                 cur.execute("SELECT tg_id, username, full_name, avatar_url, bio, phone_number, music_status FROM accounts WHERE tg_id = %s;", (int(identifier),))
+                user_profile = cur.fetchone()
             else:
                 # Otherwise search by username (remove @ if present)
-                clean_username = identifier.lstrip('@')
-                cur.execute("SELECT tg_id, username, full_name, avatar_url, bio, phone_number, music_status FROM accounts WHERE LOWER(username) = LOWER(%s);", (clean_username,))
+                user_profile = resolve_account_by_username(cur, identifier, "tg_id, username, full_name, avatar_url, bio, phone_number, music_status")
             
-            user_profile = cur.fetchone()
             if not user_profile: return jsonify({"error": "User profile not found."}), 404
 
             profile_data = dict(user_profile)
             user_id = profile_data['tg_id']
 
+            supply_version = get_resource_version('gift_stock', cur)
+            versions = get_user_versions(cur, [user_id] + viewer_ids, cache=True)
+            if not identifier.isdigit():
+                cache_profile_username(identifier, user_id, cache_generation)
+            etag = None
+            if supply_version is not None:
+                etag = versioned_etag({"gift_stock": supply_version, **{f"user:{tg_id}": version for tg_id, version in versions.items()}})
+            if is_not_modified(etag):
+                return not_modified_response(etag)
+            profile_data['data_version'] = versions[user_id]
+            viewer_can_see_custom = has_custom_gifts_enabled(cur, viewer_id)
+
             # --- (Rest of the function remains exactly the same) ---
             cur.execute("""
                 SELECT g.*, a.username as owner_username, a.full_name as owner_name, a.avatar_url as owner_avatar,
@@ -2242,14 +3491,10 @@ def get_user_profile(identifier):
                 WHERE g.owner_id = %s AND g.is_hidden = FALSE
                 ORDER BY g.is_pinned DESC, g.pin_order ASC NULLS LAST, g.acquired_date DESC;
             """, (user_id,))
-            gifts = [dict(row) for row in cur.fetchall()]
+            gifts = hydrate_collectible_data(cur, [dict(row) for row in cur.fetchall()])
             gifts = _update_gifts_with_live_supply(cur, gifts)
             if not viewer_can_see_custom:
                 gifts = [g for g in gifts if not is_custom_gift(g['gift_name'])]
-
-            for gift in gifts:
-                if gift.get('collectible_data') and isinstance(gift.get('collectible_data'), str):
-                    gift['collectible_data'] = json.loads(gift['collectible_data'])
             profile_data['owned_gifts'] = gifts
 
             cur.execute("SELECT username FROM collectible_usernames WHERE owner_id = %s;", (user_id,))
@@ -2285,7 +3530,7 @@ def get_user_profile(identifier):
                 cur.execute("SELECT notification_type FROM user_subscriptions WHERE subscriber_id = %s AND target_user_id = %s;", (viewer_id, user_id))
                 profile_data['subscription_status'] = {row['notification_type']: True for row in cur.fetchall()}
             
-            return jsonify(profile_data), 200
+            return with_etag(inventory_response(profile_data), etag), 200
     except Exception as e:
         app.logger.error(f"Error fetching profile for {identifier}: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred."}), 500
@@ -2305,16 +3550,28 @@ def get_or_create_account():
             cur.execute("SELECT * FROM accounts WHERE tg_id = %s;", (tg_id,))
             account = cur.fetchone()
             if not account:
+                try:
+                    avatar_url = normalize_avatar_url(data.get('avatar_url'))
+                except ValueError:
+                    avatar_url = None
                 # Use ON CONFLICT to handle race conditions gracefully
                 cur.execute("""
                     INSERT INTO accounts (tg_id, username, full_name, avatar_url, bio, phone_number) 
                     VALUES (%s, %s, %s, %s, %s, %s) 
                     ON CONFLICT(tg_id) DO NOTHING;
                 """, (
-                    tg_id, data.get('username'), data.get('full_name'), data.get('avatar_url'), 
+                    tg_id, data.get('username'), data.get('full_name'), avatar_url, 
                     'My first account!', 'Not specified'
                 ))
                 conn.commit()
+
+            # Clients send the data_version and supply_version of the copy they hold; if neither the
+            # account nor the live supply counts changed since, skip the rebuild.
+            supply_version = get_resource_version('gift_stock', cur)
+            data_version = get_user_versions(cur, [tg_id])[int(tg_id)]
+            if (data.get('known_version') is not None and str(data['known_version']) == str(data_version)
+                    and supply_version is not None and str(data.get('known_supply_version')) == str(supply_version)):
+                return '', 304
             
             # Fetch the account data again to ensure consistency
             cur.execute("""
@@ -2329,28 +3586,24 @@ def get_or_create_account():
                 SELECT * FROM gifts WHERE owner_id = %s
                 ORDER BY is_pinned DESC, pin_order ASC NULLS LAST, acquired_date DESC;
             """, (tg_id,))
-            gifts = [dict(row) for row in cur.fetchall()]
+            gifts = hydrate_collectible_data(cur, [dict(row) for row in cur.fetchall()])
 
             gifts = _update_gifts_with_live_supply(cur, gifts)
 
             if not account_data.get('custom_gifts_enabled'):
                 gifts = [g for g in gifts if not is_custom_gift(g['gift_name'])]
-            
-            for gift in gifts:
-                if gift.get('collectible_data') and isinstance(gift.get('collectible_data'), str):
-                    gift['collectible_data'] = json.loads(gift['collectible_data'])
             account_data['owned_gifts'] = gifts
 
             cur.execute("SELECT username FROM collectible_usernames WHERE owner_id = %s;", (tg_id,))
             account_data['collectible_usernames'] = [row['username'] for row in cur.fetchall()]
 
-            cur.execute("SELECT id, name FROM collections WHERE owner_id = %s ORDER BY display_order ASC, name ASC;", (tg_id,))
+            cur.execute("SELECT id, name, display_order FROM collections WHERE owner_id = %s ORDER BY display_order ASC, name ASC;", (tg_id,))
             collections_raw = cur.fetchall()
             collections_with_order = []
             for coll in collections_raw:
                 cur.execute("SELECT gift_instance_id FROM gift_collections WHERE collection_id = %s ORDER BY order_in_collection ASC;", (coll['id'],))
                 ordered_ids = [row['gift_instance_id'] for row in cur.fetchall()]
-                collections_with_order.append({ "id": coll['id'], "name": coll['name'], "ordered_instance_ids": ordered_ids })
+                collections_with_order.append({ "id": coll['id'], "name": coll['name'], "display_order": coll['display_order'], "ordered_instance_ids": ordered_ids })
             account_data['collections'] = collections_with_order
             
             # Fetch posts for Wall
@@ -2367,8 +3620,10 @@ def get_or_create_account():
                 post['reactions'] = {row['reaction_emoji']: row['count'] for row in cur.fetchall()}
                 posts.append(post)
             account_data['posts'] = posts
+            account_data['data_version'] = data_version
+            account_data['supply_version'] = supply_version
             
-            return jsonify(account_data), 200
+            return inventory_response(account_data), 200
     except Exception as e:
         if conn: conn.rollback()
         app.logger.error(f"Error in get_or_create_account for {tg_id}: {e}", exc_info=True)
@@ -2376,6 +3631,109 @@ def get_or_create_account():
     finally:
         if conn: put_db_connection(conn)
 
+@app.route('/api/account/changes', methods=['GET'])
+def get_account_changes():
+    """
+    What changed in an account since data version `since`, from the user_change_log table.
+    Returns 304 if nothing did, and {"full_sync": true} when the log can't answer (too old a
+    version, too many changes, or a setting that affects the whole inventory changed).
+    Unless `supply_version` is still current, the result also carries the live supply count of
+    every collectible gift type the account owns.
+    """
+    tg_id = request.args.get('tg_id', type=int)
+    since = request.args.get('since', type=int)
+    known_supply_version = request.args.get('supply_version', type=int)
+    if tg_id is None or since is None:
+        return jsonify({"error": "tg_id and since are required."}), 400
+    conn = get_db_connection()
+    if not conn: return jsonify({"error": "Database connection failed."}), 500
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            supply_version = get_resource_version('gift_stock', cur)
+            supply_changed = supply_version is None or known_supply_version != supply_version
+            cur.execute("SELECT version, log_floor FROM user_versions WHERE tg_id = %s;", (tg_id,))
+            row = cur.fetchone()
+            data_version, log_floor = (row['version'], row['log_floor']) if row else (0, 0)
+            if since == data_version and not supply_changed:
+                return '', 304
+            if since > data_version or since < log_floor:
+                return jsonify({"data_version": data_version, "full_sync": True}), 200
+
+            # Only the last operation per entity matters.
+            cur.execute("""
+                SELECT DISTINCT ON (entity, entity_id) entity, entity_id, op
+                FROM user_change_log WHERE tg_id = %s AND version > %s AND version <= %s
+                ORDER BY entity, entity_id, version DESC;
+            """, (tg_id, since, data_version))
+            changes = {}
+            for change in cur.fetchall():
+                changes.setdefault(change['entity'], {})[change['entity_id']] = change['op']
+            if 'settings' in changes or sum(len(ids) for ids in changes.values()) > USER_CHANGES_MAX_ENTITIES:
+                return jsonify({"data_version": data_version, "full_sync": True}), 200
+
+            upserted = {entity: [i for i, op in ids.items() if op == 'upsert'] for entity, ids in changes.items()}
+            removed = {entity: [i for i, op in ids.items() if op == 'delete'] for entity, ids in changes.items()}
+            result = {"data_version": data_version, "supply_version": supply_version, "full_sync": False}
+
+            gifts, gift_ids = [], upserted.get('gift', [])
+            if gift_ids:
+                cur.execute("SELECT * FROM gifts WHERE owner_id = %s AND instance_id = ANY(%s);", (tg_id, gift_ids))
+                gifts = _update_gifts_with_live_supply(cur, hydrate_collectible_data(cur, [dict(r) for r in cur.fetchall()]))
+                if not has_custom_gifts_enabled(cur, tg_id):
+                    gifts = [g for g in gifts if not is_custom_gift(g['gift_name'])]
+            # Upserted gifts that are gone again (or hidden by the custom gifts setting) count as removed.
+            returned_ids = {g['instance_id'] for g in gifts}
+            result['gifts'] = {"upserted": gifts, "removed": removed.get('gift', []) + [i for i in gift_ids if i not in returned_ids]}
+
+            collections, collection_ids = [], [int(i) for i in upserted.get('collection', [])]
+            if collection_ids:
+                cur.execute("SELECT id, name, display_order FROM collections WHERE owner_id = %s AND id = ANY(%s);", (tg_id, collection_ids))
+                for coll in cur.fetchall():
+                    cur.execute("SELECT gift_instance_id FROM gift_collections WHERE collection_id = %s ORDER BY order_in_collection ASC;", (coll['id'],))
+                    ordered_ids = [r['gift_instance_id'] for r in cur.fetchall()]
+                    collections.append({"id": coll['id'], "name": coll['name'], "display_order": coll['display_order'], "ordered_instance_ids": ordered_ids})
+            returned_ids = {c['id'] for c in collections}
+            result['collections'] = {"upserted": collections, "removed": [int(i) for i in removed.get('collection', [])] + [i for i in collection_ids if i not in returned_ids]}
+
+            posts, post_ids = [], [int(i) for i in upserted.get('post', [])]
+            if post_ids:
+                cur.execute("SELECT id, content, views, created_at FROM posts WHERE owner_id = %s AND id = ANY(%s);", (tg_id, post_ids))
+                for post_row in cur.fetchall():
+                    post = dict(post_row)
+                    cur.execute("""
+                        SELECT reaction_emoji, COUNT(*) as count
+                        FROM post_reactions
+                        WHERE post_id = %s
+                        GROUP BY reaction_emoji;
+                    """, (post['id'],))
+                    post['reactions'] = {r['reaction_emoji']: r['count'] for r in cur.fetchall()}
+                    posts.append(post)
+            returned_ids = {p['id'] for p in posts}
+            result['posts'] = {"upserted": posts, "removed": [int(i) for i in removed.get('post', [])] + [i for i in post_ids if i not in returned_ids]}
+
+            if 'account' in changes:
+                cur.execute("SELECT * FROM accounts WHERE tg_id = %s;", (tg_id,))
+                account_row = cur.fetchone()
+                account = dict(account_row) if account_row else {}
+                cur.execute("SELECT username FROM collectible_usernames WHERE owner_id = %s;", (tg_id,))
+                account['collectible_usernames'] = [r['username'] for r in cur.fetchall()]
+                result['account'] = account
+
+            if supply_changed:
+                cur.execute("""
+                    SELECT gift_type_id, COUNT(*) AS live_count FROM gifts
+                    WHERE is_collectible = TRUE AND gift_type_id IN (SELECT gift_type_id FROM gifts WHERE owner_id = %s AND is_collectible = TRUE)
+                    GROUP BY gift_type_id;
+                """, (tg_id,))
+                result['supply'] = {r['gift_type_id']: r['live_count'] for r in cur.fetchall()}
+
+            return jsonify(result), 200
+    except Exception as e:
+        app.logger.error(f"Error fetching account changes for {tg_id}: {e}", exc_info=True)
+        return jsonify({"error": "An internal server error occurred."}), 500
+    finally:
+        if conn: put_db_connection(conn)
+
 @app.route('/api/account', methods=['PUT'])
 def update_account():
     data = request.get_json()
@@ -2393,14 +3751,21 @@ def update_account():
             
             # Build a dynamic query to update only the fields provided
             if 'username' in data: 
+                existing = resolve_account_by_username(cur, data['username'], "tg_id")
+                if existing and str(existing[0]) != str(tg_id):
+                    return jsonify({"error": "This username is already taken."}), 409
                 update_fields.append("username = %s")
                 update_values.append(data['username'])
             if 'full_name' in data: 
                 update_fields.append("full_name = %s")
                 update_values.append(data['full_name'])
             if 'avatar_url' in data: 
+                try:
+                    avatar_url = normalize_avatar_url(data['avatar_url'])
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
                 update_fields.append("avatar_url = %s")
-                update_values.append(data['avatar_url'])
+                update_values.append(avatar_url)
             if 'bio' in data: 
                 update_fields.append("bio = %s")
                 update_values.append(data['bio'])
@@ -2451,6 +3816,35 @@ def update_account():
     finally:
         if conn: put_db_connection(conn)
 
+@app.route('/api/account/avatar', methods=['POST'])
+def upload_avatar():
+    """Multipart avatar upload (`tg_id` + `avatar` file); replaces sending the image as a data URL."""
+    request.max_content_length = AVATAR_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+    tg_id = request.form.get('tg_id')
+    upload = request.files.get('avatar')
+    if not tg_id or not upload:
+        return jsonify({"error": "tg_id and an avatar file are required"}), 400
+    try:
+        avatar_url = save_avatar(upload.stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({"error": "Database connection failed."}), 500
+    try:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE accounts SET avatar_url = %s WHERE tg_id = %s;", (avatar_url, tg_id))
+            if cur.rowcount == 0:
+                return jsonify({"error": "Account not found."}), 404
+        conn.commit()
+        return jsonify({"avatar_url": avatar_url}), 200
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Error saving avatar for {tg_id}: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+    finally:
+        put_db_connection(conn)
+
 @app.route('/api/account/settings', methods=['POST'])
 def update_account_settings():
     data = request.get_json()
@@ -2501,9 +3895,7 @@ def add_gift():
             if cur.fetchone()[0] >= GIFT_LIMIT_PER_USER:
                 return jsonify({"error": f"Gift limit of {GIFT_LIMIT_PER_USER} reached."}), 403
 
-            price = 0
-            if is_custom_gift(gift_name):
-                price = CUSTOM_GIFTS_DATA[gift_name].get('price', 0)
+            price = get_custom_gift_price(gift_name)
             
             if price > 0:
                 cur.execute("SELECT stars_balance FROM accounts WHERE tg_id = %s FOR UPDATE;", (owner_id,))
@@ -2513,7 +3905,7 @@ def add_gift():
                     return jsonify({"error": f"Insufficient Stars balance. This gift costs {price} Stars."}), 402
                 cur.execute("UPDATE accounts SET stars_balance = stars_balance - %s WHERE tg_id = %s;", (price, owner_id))
 
-            is_limited = gift_type_id in [g['id'] for g in CUSTOM_GIFTS_DATA.values() if 'limit' in g]
+            is_limited = is_limited_gift_type(gift_type_id)
             if is_limited:
                 cur.execute("SELECT remaining_stock FROM limited_gifts_stock WHERE gift_type_id = %s FOR UPDATE;", (gift_type_id,))
                 stock_row = cur.fetchone()
@@ -2584,34 +3976,21 @@ def upgrade_gift():
                 app.logger.error(f"Could not determine all parts for '{gift_name}'.")
                 return jsonify({"error": f"Could not determine all parts for '{gift_name}'."}), 500
             
-            pattern_source_name = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-            model_image_url = selected_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(selected_model['name'])}.png"
-            lottie_model_path = selected_model.get('lottie') if selected_model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(selected_model['name'])}.json"
-            pattern_image_url = f"{CDN_BASE_URL}patterns/{quote(pattern_source_name)}/png/{quote(selected_pattern['name'])}.png"
-            
-            collectible_data = {
-                "model": selected_model, "backdrop": selected_backdrop, "pattern": selected_pattern,
-                "modelImage": model_image_url, "lottieModelPath": lottie_model_path,
-                "patternImage": pattern_image_url, "backdropColors": selected_backdrop.get('hex'), 
-                "supply": live_supply_count, # Use the live count here
-                "author": get_gift_author(gift_name)
-            }
-            
-            cur.execute("""UPDATE gifts SET collectible_data = %s, collectible_number = %s, lottie_path = NULL WHERE instance_id = %s;""", (json.dumps(collectible_data), next_number, instance_id))
+            collectible_row = build_collectible_row(
+                cur, gift_name, selected_model, selected_backdrop, selected_pattern,
+                supply=live_supply_count, # Use the live count here
+                author=get_gift_author(gift_name)
+            )
             
-            conn.commit()
+            cur.execute("""UPDATE gifts SET collectible_data = %s, model_id = %s, backdrop_id = %s, pattern_id = %s, collectible_number = %s, lottie_path = NULL WHERE instance_id = %s;""", (*collectible_row, next_number, instance_id))
             
-            # Finally, update the supply for all other collectibles of the same type
-            cur.execute("""
-                UPDATE gifts
-                SET collectible_data = collectible_data || jsonb_build_object('supply', %s)
-                WHERE gift_type_id = %s AND is_collectible = TRUE;
-            """, (live_supply_count, gift_type_id))
             conn.commit()
+            # Other collectibles of this type keep their stored supply; responses fill in the live
+            # count (_update_gifts_with_live_supply), so rewriting every holder's row would only
+            # bump their user versions and change logs for nothing.
 
             cur.execute("SELECT * FROM gifts WHERE instance_id = %s;", (instance_id,))
-            upgraded_gift = dict(cur.fetchone())
-            if isinstance(upgraded_gift.get('collectible_data'), str): upgraded_gift['collectible_data'] = json.loads(upgraded_gift['collectible_data'])
+            upgraded_gift = hydrate_collectible_data(cur, [dict(cur.fetchone())])[0]
             return jsonify(upgraded_gift), 200
     except Exception as e:
         if conn: conn.rollback()
@@ -2683,12 +4062,11 @@ def search_friend():
                     "SELECT tg_id, username, full_name, avatar_url FROM accounts WHERE tg_id = %s AND tg_id != %s;",
                     (int(query), user_id)
                 )
+                user_found = cur.fetchone()
             else:
-                cur.execute(
-                    "SELECT tg_id, username, full_name, avatar_url FROM accounts WHERE LOWER(username) = LOWER(%s) AND tg_id != %s;",
-                    (query.lstrip('@'), user_id)
-                )
-            user_found = cur.fetchone()
+                user_found = resolve_account_by_username(cur, query, "tg_id, username, full_name, avatar_url")
+                if user_found and str(user_found['tg_id']) == str(user_id):
+                    user_found = None
             if user_found:
                 return jsonify(dict(user_found)), 200
             else:
@@ -2745,7 +4123,7 @@ def send_gift_to_friend():
                 return jsonify({"error": "Receiver's gift box is full."}), 403
 
             gift_name = data['gift_name']
-            price = CUSTOM_GIFTS_DATA.get(gift_name, {}).get('price', 0)
+            price = get_custom_gift_price(gift_name)
             
             if price > 0:
                 cur.execute("SELECT stars_balance FROM accounts WHERE tg_id = %s FOR UPDATE;", (sender_id,))
@@ -2755,7 +4133,7 @@ def send_gift_to_friend():
                     return jsonify({"error": f"Insufficient Stars. This gift costs {price}."}), 402
                 cur.execute("UPDATE accounts SET stars_balance = stars_balance - %s WHERE tg_id = %s;", (price, sender_id))
 
-            is_limited = 'limit' in CUSTOM_GIFTS_DATA.get(gift_name, {})
+            is_limited = is_limited_gift_type(gift_type_id)
             if is_limited:
                 cur.execute("SELECT remaining_stock FROM limited_gifts_stock WHERE gift_type_id = %s FOR UPDATE;", (gift_type_id,))
                 stock = cur.fetchone()
@@ -2951,32 +4329,21 @@ def clone_gift():
                 return jsonify({"error": "Could not match scraped part names to available data."}), 500
 
             new_instance_id = str(uuid.uuid4())
-            gift_type_id = next((g['id'] for g in CUSTOM_GIFTS_DATA.values() if g['name'] == gift_name), gift_name.replace(" ", ""))
+            gift_type_id = CUSTOM_GIFTS_DATA.get(gift_name, {}).get('id') or gift_name.replace(" ", "")
 
             cur.execute("INSERT INTO gifts (instance_id, owner_id, gift_type_id, gift_name) VALUES (%s, %s, %s, %s);", (new_instance_id, owner_id, gift_type_id, gift_name))
             cur.execute("SELECT COALESCE(MAX(collectible_number), 0) + 1 FROM gifts WHERE gift_type_id = %s;", (gift_type_id,))
             next_number = cur.fetchone()[0]
             
-            pattern_source_name = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-            
-            model_image_url = custom_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(custom_model['name'])}.png"
-            lottie_model_path = custom_model.get('lottie') if custom_model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(custom_model['name'])}.json"
-            pattern_image_url = f"{CDN_BASE_URL}patterns/{quote(pattern_source_name)}/png/{quote(custom_pattern['name'])}.png"
-
-            collectible_data = {
-                "model": custom_model, "backdrop": custom_backdrop, "pattern": custom_pattern,
-                "modelImage": model_image_url,
-                "lottieModelPath": lottie_model_path,
-                "patternImage": pattern_image_url,
-                "backdropColors": custom_backdrop.get('hex'), "supply": random.randint(2000, 10000),
-                "author": get_gift_author(gift_name)
-            }
-            cur.execute("""UPDATE gifts SET is_collectible = TRUE, collectible_data = %s, collectible_number = %s WHERE instance_id = %s;""", (json.dumps(collectible_data), next_number, new_instance_id))
+            collectible_row = build_collectible_row(
+                cur, gift_name, custom_model, custom_backdrop, custom_pattern,
+                supply=random.randint(2000, 10000), author=get_gift_author(gift_name)
+            )
+            cur.execute("""UPDATE gifts SET is_collectible = TRUE, collectible_data = %s, model_id = %s, backdrop_id = %s, pattern_id = %s, collectible_number = %s WHERE instance_id = %s;""", (*collectible_row, next_number, new_instance_id))
             conn.commit()
 
             cur.execute("SELECT * FROM gifts WHERE instance_id = %s;", (new_instance_id,))
-            cloned_gift = dict(cur.fetchone())
-            cloned_gift['collectible_data'] = json.loads(cloned_gift['collectible_data'])
+            cloned_gift = hydrate_collectible_data(cur, [dict(cur.fetchone())])[0]
         
         return jsonify(cloned_gift), 201
 
@@ -2991,6 +4358,9 @@ def clone_gift():
 
 @app.route('/api/gifts/stock', methods=['GET'])
 def get_limited_gift_stock():
+    etag = resource_etag('gift_stock')
+    if is_not_modified(etag):
+        return not_modified_response(etag)
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Database connection failed."}), 500
@@ -3018,7 +4388,7 @@ def get_limited_gift_stock():
                     'collectible_count': row['collectible_count']
                 } for row in cur.fetchall()
             }
-            return jsonify(stock_data), 200
+            return with_etag(jsonify(stock_data), etag), 200
     except Exception as e:
         app.logger.error(f"Error fetching limited gift stock: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred."}), 500
@@ -3034,18 +4404,13 @@ def get_gift_by_details(gift_identifier, collectible_number):
     
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            # Check if the identifier is a name or a numeric-like ID
-            if not gift_identifier.isnumeric():
-                # It's a name, so we need to resolve it to a gift_type_id
-                cur.execute("SELECT gift_type_id FROM gifts WHERE gift_name ILIKE %s LIMIT 1;", (gift_identifier,))
-                id_row = cur.fetchone()
-                if not id_row:
-                    return jsonify({"error": "Gift name not found."}), 404
-                gift_type_id_resolved = id_row['gift_type_id']
+            # Numeric identifiers are gift type ids; names and custom type ids go through the in-memory resolver.
+            if gift_identifier.isnumeric():
+                clause, params = "g.gift_type_id = %s AND g.collectible_number = %s AND g.is_collectible = TRUE", [gift_identifier, collectible_number]
             else:
-                gift_type_id_resolved = gift_identifier
+                clause, params = gift_identity_clause(gift_identifier, collectible_number, alias="g")
 
-            cur.execute("""SELECT g.*, a.username as owner_username, a.full_name as owner_name, a.avatar_url as owner_avatar FROM gifts g JOIN accounts a ON g.owner_id = a.tg_id WHERE g.gift_type_id = %s AND g.collectible_number = %s AND g.is_collectible = TRUE;""", (gift_type_id_resolved, collectible_number))
+            cur.execute(f"""SELECT g.*, a.username as owner_username, a.full_name as owner_name, a.avatar_url as owner_avatar FROM gifts g JOIN accounts a ON g.owner_id = a.tg_id WHERE {clause};""", params)
             gift_data = cur.fetchone()
             if not gift_data: return jsonify({"error": "Collectible gift not found."}), 404
 
@@ -3053,11 +4418,10 @@ def get_gift_by_details(gift_identifier, collectible_number):
                 if not has_custom_gifts_enabled(cur, viewer_id):
                     return jsonify({"error": "Sorry, you cannot see this gift.", "reason": "custom_content_disabled"}), 403
 
-            result = dict(gift_data)
-            if isinstance(result.get('collectible_data'), str): result['collectible_data'] = json.loads(result.get('collectible_data'))
+            result = hydrate_collectible_data(cur, [dict(gift_data)])[0]
             return jsonify(result), 200
     except Exception as e:
-        app.logger.error(f"Error fetching deep-linked gift {gift_type_id}-{collectible_number}: {e}", exc_info=True)
+        app.logger.error(f"Error fetching deep-linked gift {gift_identifier}-{collectible_number}: {e}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
     finally:
         if conn: put_db_connection(conn)
@@ -3251,11 +4615,11 @@ def batch_add_gifts():
                 g_type = gift['gift_type_id']
                 
                 # Calculate Price
-                price = CUSTOM_GIFTS_DATA.get(g_name, {}).get('price', 0)
+                price = get_custom_gift_price(g_name)
                 total_price += price
 
                 # Calculate Stock
-                if g_name in CUSTOM_GIFTS_DATA and 'limit' in CUSTOM_GIFTS_DATA[g_name]:
+                if is_limited_gift_type(g_type):
                     stock_updates[g_type] = stock_updates.get(g_type, 0) + 1
 
             # Deduct Balance
@@ -3276,13 +4640,13 @@ def batch_add_gifts():
 
             # 3. Batch Insert
             # Prepare data for execute_values
-            # Columns: instance_id, owner_id, sender_id, gift_type_id, gift_name, original_image_url, lottie_path, is_collectible, collectible_data, collectible_number
+            # Columns: instance_id, owner_id, sender_id, gift_type_id, gift_name, original_image_url, lottie_path, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, collectible_number
             
             insert_values = []
             
             # If we need to assign collectible numbers for Custom/Pre-upgraded gifts in this batch
             for gift in gifts_list:
-                col_data = None
+                collectible_row = (None, None, None, None)
                 col_num = None
                 is_col = False
                 
@@ -3300,22 +4664,10 @@ def batch_add_gifts():
                     # or do a rough estimate. Let's do a quick count.
                     # Optimization: Just use a placeholder supply or 10000 for batch speed
                     
-                    pattern_source = CUSTOM_GIFTS_DATA.get(gift['gift_name'], {}).get("patterns_source", gift['gift_name'])
-                    
-                    # Reconstruct the collectible object
-                    c_data = {
-                        "model": parts['model'],
-                        "backdrop": parts['backdrop'],
-                        "pattern": parts['pattern'],
-                        # FIX: Use .get('image') to avoid 500 error if key is missing
-                        "modelImage": parts['model'].get('image') or f"{CDN_BASE_URL}models/{quote(gift['gift_name'])}/png/{quote(parts['model']['name'])}.png",
-                        "lottieModelPath": parts['model'].get('lottie') or f"{CDN_BASE_URL}models/{quote(gift['gift_name'])}/lottie/{quote(parts['model']['name'])}.json",
-                        "patternImage": f"{CDN_BASE_URL}patterns/{quote(pattern_source)}/png/{quote(parts['pattern']['name'])}.png",
-                        "backdropColors": parts['backdrop']['hex'],
-                        "supply": 5000, 
-                        "author": get_gift_author(gift['gift_name'])
-                    }
-                    col_data = json.dumps(c_data)
+                    collectible_row = build_collectible_row(
+                        cur, gift['gift_name'], parts['model'], parts['backdrop'], parts['pattern'],
+                        supply=5000, author=get_gift_author(gift['gift_name'])
+                    )
                     col_num = next_num
                     is_col = True
 
@@ -3323,13 +4675,13 @@ def batch_add_gifts():
                     gift['instance_id'], owner_id, owner_id, 
                     gift['gift_type_id'], gift['gift_name'], 
                     gift['original_image_url'], gift.get('lottie_path'),
-                    is_col, col_data, col_num
+                    is_col, *collectible_row, col_num
                 ))
 
             execute_values(cur, """
                 INSERT INTO gifts (
                     instance_id, owner_id, sender_id, gift_type_id, gift_name, 
-                    original_image_url, lottie_path, is_collectible, collectible_data, collectible_number
+                    original_image_url, lottie_path, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, collectible_number
                 ) VALUES %s
             """, insert_values)
 
@@ -3380,25 +4732,18 @@ def batch_upgrade_gifts():
                 cur.execute("SELECT COALESCE(MAX(collectible_number), 0) + 1 FROM gifts WHERE gift_type_id = %s;", (gift['gift_type_id'],))
                 next_number = cur.fetchone()[0]
 
-                pattern_source = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-                
-                # Construct data
-                c_data = {
-                    "model": model, "backdrop": backdrop, "pattern": pattern,
-                    "modelImage": model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(model['name'])}.png",
-                    "lottieModelPath": model.get('lottie') or f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(model['name'])}.json",
-                    "patternImage": f"{CDN_BASE_URL}patterns/{quote(pattern_source)}/png/{quote(pattern['name'])}.png",
-                    "backdropColors": backdrop['hex'],
-                    "supply": 5000, # Placeholder
-                    "author": get_gift_author(gift_name)
-                }
+                collectible_row = build_collectible_row(
+                    cur, gift_name, model, backdrop, pattern,
+                    supply=5000, # Placeholder
+                    author=get_gift_author(gift_name)
+                )
                 
                 # Update DB row
                 cur.execute("""
                     UPDATE gifts 
-                    SET is_collectible = TRUE, collectible_data = %s, collectible_number = %s, lottie_path = NULL 
+                    SET is_collectible = TRUE, collectible_data = %s, model_id = %s, backdrop_id = %s, pattern_id = %s, collectible_number = %s, lottie_path = NULL 
                     WHERE instance_id = %s;
-                """, (json.dumps(c_data), next_number, gift['instance_id']))
+                """, (*collectible_row, next_number, gift['instance_id']))
 
             conn.commit()
             return jsonify({"message": "Batch upgrade complete"}), 200
@@ -3440,8 +4785,7 @@ def batch_gift_action():
                 if not receiver_username:
                     return jsonify({"error": "receiver_username is required for transfer"}), 400
 
-                cur.execute("SELECT tg_id, username FROM accounts WHERE username = %s;", (receiver_username,))
-                receiver = cur.fetchone()
+                receiver = resolve_account_by_username(cur, receiver_username)
                 if not receiver: return jsonify({"error": "Receiver username not found."}), 404
                 receiver_id, receiver_username = receiver['tg_id'], receiver['username']
 
@@ -3538,8 +4882,7 @@ def transfer_gift():
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (receiver_username,))
-            receiver = cur.fetchone()
+            receiver = resolve_account_by_username(cur, receiver_username, "tg_id")
             if not receiver: return jsonify({"error": "Receiver username not found."}), 404
             receiver_id = receiver['tg_id']
 
@@ -3581,19 +4924,57 @@ def transfer_gift():
 
 @app.route('/api/gifts/send_image', methods=['POST'])
 def send_generated_image():
-    data = request.get_json()
-    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
+    # Bigger bodies are rejected with 413 while they stream in, before anything is buffered.
+    # Room for base64 so old clients that still post imageDataUrl JSON get the same image limit.
+    request.max_content_length = SEND_IMAGE_MAX_BYTES * 4 // 3 + MULTIPART_OVERHEAD_BYTES
+    upload = None
+    if request.mimetype == 'multipart/form-data':
+        # Werkzeug spools file parts above 500 KB to a temp file instead of keeping them in memory.
+        data = request.form
+        upload = request.files.get('image')
+    else:
+        data = request.get_json(silent=True)
+        if not data: return jsonify({"error": "Invalid JSON payload"}), 400
 
     image_data_url = data.get('imageDataUrl')
+    instance_id = data.get('instanceId')
     user_id = data.get('userId')
     caption = data.get('caption', None)
 
-    if not image_data_url or not user_id: return jsonify({"error": "imageDataUrl and userId are required"}), 400
+    if not (upload or image_data_url or instance_id) or not user_id: return jsonify({"error": "instanceId (or an image) and userId are required"}), 400
+
+    if instance_id:
+        # Rendered and cached server-side; repeat sends reuse Telegram's file_id.
+        conn = get_db_connection()
+        if not conn: return jsonify({"error": "Database connection failed."}), 500
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT gift_name, collectible_data, model_id, backdrop_id, pattern_id FROM gifts WHERE instance_id = %s AND is_collectible = TRUE;", (instance_id,))
+                gift = cur.fetchone()
+                if gift: gift = hydrate_collectible_data(cur, [dict(gift)])[0]
+        finally:
+            put_db_connection(conn)
+        cd = gift['collectible_data'] if gift else None
+        if not cd or not all(isinstance(cd.get(k), dict) and cd[k].get('name') for k in ('model', 'backdrop', 'pattern')):
+            return jsonify({"error": "Collectible gift not found."}), 404
+        try:
+            result = send_gift_card(user_id, gift['gift_name'], cd['model'], cd['backdrop'], cd['pattern'], caption=caption)
+        except Exception as e:
+            app.logger.error(f"Error rendering card for gift {instance_id}: {e}", exc_info=True)
+            return jsonify({"error": "Could not render the gift image."}), 500
+        if result and result.get('ok'):
+            return jsonify({"message": "Image sent successfully"}), 200
+        error_message = result.get('description') if result else "Unknown Telegram API error"
+        return jsonify({"error": "Failed to send image via Telegram API", "details": error_message}), 502
 
     try:
-        header, encoded_data = image_data_url.split(',', 1)
-        image_bytes = base64.b64decode(encoded_data)
-        result = send_telegram_photo(user_id, image_bytes, caption=caption)
+        if upload:
+            stream = upload.stream
+        else:
+            image_bytes = decode_data_url(image_data_url)
+            if image_bytes is None: raise ValueError("imageDataUrl must be a data URL.")
+            stream = io.BytesIO(image_bytes)
+        result = send_telegram_photo(user_id, prepare_photo_upload(stream), caption=caption)
 
         if result and result.get('ok'):
             return jsonify({"message": "Image sent successfully"}), 200
@@ -3602,9 +4983,9 @@ def send_generated_image():
             app.logger.error(f"Telegram API failed to send image to {user_id}: {error_message}")
             return jsonify({"error": "Failed to send image via Telegram API", "details": error_message}), 502
 
-    except (ValueError, TypeError, IndexError) as e:
-        app.logger.error(f"Error decoding base64 image for user {user_id}: {e}", exc_info=True)
-        return jsonify({"error": "Invalid base64 image data format"}), 400
+    except (ValueError, TypeError) as e:
+        app.logger.warning(f"Rejected image upload from {user_id}: {e}")
+        return jsonify({"error": str(e) or "Invalid image data"}), 400
     except Exception as e:
         app.logger.error(f"Unexpected error sending generated image to {user_id}: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred"}), 500
@@ -3640,8 +5021,7 @@ def create_post():
             # Mention notifications
             mentioned_users = set(re.findall(r'@([a-zA-Z0-9_]{5,32})', content))
             for username in mentioned_users:
-                cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (username,))
-                mentioned_user = cur.fetchone()
+                mentioned_user = resolve_account_by_username(cur, username, "tg_id")
                 if mentioned_user:
                      # Check if the mentioned user is subscribed to the poster for mentions
                     cur.execute("SELECT subscriber_id FROM user_subscriptions WHERE target_user_id = %s AND notification_type = 'mentions' AND subscriber_id = %s;", (owner_id, mentioned_user['tg_id']))
@@ -3992,17 +5372,20 @@ def get_stats_ultimate():
 
             # 5. Gift & Collection Insights
             rarity_counts = {'Common': 0, 'Uncommon': 0, 'Rare': 0, 'Epic': 0, 'Legendary': 0, 'Mythic': 0}
-            cur.execute("SELECT collectible_data FROM gifts WHERE is_collectible = TRUE AND collectible_data IS NOT NULL;")
-            for row in cur.fetchall():
-                cd = row[0]
-                if isinstance(cd, dict) and 'model' in cd and isinstance(cd['model'], dict):
-                    permille = cd['model'].get('rarityPermille', 1000)
-                    if permille <= 1: rarity_counts['Mythic'] += 1
-                    elif permille <= 10: rarity_counts['Legendary'] += 1
-                    elif permille <= 50: rarity_counts['Epic'] += 1
-                    elif permille <= 100: rarity_counts['Rare'] += 1
-                    elif permille <= 300: rarity_counts['Uncommon'] += 1
-                    else: rarity_counts['Common'] += 1
+            # Grouped in SQL by model rarity; rows not yet moved to gift_models still carry the model inline.
+            cur.execute("""
+                SELECT COALESCE(m.data->>'rarityPermille', g.collectible_data->'model'->>'rarityPermille', '1000')::numeric AS permille, COUNT(*)
+                FROM gifts g LEFT JOIN gift_models m ON m.id = g.model_id
+                WHERE g.is_collectible = TRUE AND (m.id IS NOT NULL OR jsonb_typeof(g.collectible_data->'model') = 'object')
+                GROUP BY 1;
+            """)
+            for permille, count in cur.fetchall():
+                if permille <= 1: rarity_counts['Mythic'] += count
+                elif permille <= 10: rarity_counts['Legendary'] += count
+                elif permille <= 50: rarity_counts['Epic'] += count
+                elif permille <= 100: rarity_counts['Rare'] += count
+                elif permille <= 300: rarity_counts['Uncommon'] += count
+                else: rarity_counts['Common'] += count
             
             cur.execute("""
                 SELECT gift_name, COUNT(*) as upgrade_count FROM gifts WHERE is_collectible = TRUE
@@ -4048,6 +5431,24 @@ def get_stats_ultimate():
     finally:
         if conn: put_db_connection(conn)
             
+@app.route('/api/metrics', methods=['GET'])
+def get_internal_metrics():
+    """Operational metrics for the current worker process. Requires API key authentication."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header is missing or invalid"}), 401
+    
+    token = auth_header.split(' ')[1]
+    if not token or token != TRANSFER_API_KEY:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return jsonify({
+        "pid": os.getpid(),
+        "background_tasks": get_background_task_stats(),
+        "telegram_updates": get_telegram_update_queue_stats(),
+        "pending_inline_actions": get_pending_inline_action_stats()
+    }), 200
+
 @app.route('/api/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def catch_all(path):
     app.logger.warning(f"Unhandled API call: {request.method} /api/{path}")
@@ -4059,54 +5460,67 @@ def process_giveaway_winners(giveaway_id):
     conn = get_db_connection()
     if not conn: return
 
+    giveaway = None
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("SELECT g.*, a.username as creator_username FROM giveaways g JOIN accounts a ON g.creator_id = a.tg_id WHERE g.id = %s", (giveaway_id,))
             giveaway = cur.fetchone()
             if not giveaway: return
 
-            cur.execute("SELECT user_id FROM giveaway_participants WHERE giveaway_id = %s;", (giveaway_id,))
-            participants = [p['user_id'] for p in cur.fetchall()]
-            cur.execute("SELECT g.* FROM gifts g JOIN giveaway_gifts gg ON g.instance_id = gg.gift_instance_id WHERE gg.giveaway_id = %s;", (giveaway_id,))
+            cur.execute("SELECT g.instance_id, g.gift_name, g.collectible_number FROM gifts g JOIN giveaway_gifts gg ON g.instance_id = gg.gift_instance_id WHERE gg.giveaway_id = %s ORDER BY gg.id;", (giveaway_id,))
             gifts = cur.fetchall()
 
-            if not participants:
+            # Sample the winners in SQL: ORDER BY random() with a LIMIT is a single scan with a
+            # top-k sort, so the participant list never has to be shipped to Python.
+            num_winners = 1 if giveaway['winner_rule'] == 'single' else len(gifts)
+            cur.execute("""
+                SELECT p.user_id, a.username
+                FROM giveaway_participants p
+                JOIN accounts a ON a.tg_id = p.user_id
+                WHERE p.giveaway_id = %s
+                ORDER BY random()
+                LIMIT %s;
+            """, (giveaway_id, max(num_winners, 1)))
+            winners = cur.fetchall()
+
+            if not winners:
                 send_telegram_message(giveaway['creator_id'], f"😔 Your giveaway in channel ID {giveaway['channel_id']} has ended, but there were no participants.")
                 cur.execute("UPDATE giveaways SET status = 'finished' WHERE id = %s;", (giveaway_id,))
                 conn.commit()
                 return
 
-            rewards_text_list = []
             emojis = ["🥇", "🥈", "🥉"]
             
             if giveaway['winner_rule'] == 'single':
-                winner_id = random.choice(participants)
-                cur.execute("UPDATE gifts SET owner_id = %s, acquired_date = CURRENT_TIMESTAMP WHERE instance_id IN (SELECT gift_instance_id FROM giveaway_gifts WHERE giveaway_id = %s);", (winner_id, giveaway_id))
-                cur.execute("SELECT username FROM accounts WHERE tg_id = %s;", (winner_id,))
-                winner_username = cur.fetchone()['username']
-                
+                winner = winners[0]
+                assignments = [(gift['instance_id'], winner['user_id']) for gift in gifts]
+                rewards_text_list = []
                 for i, gift in enumerate(gifts):
                     emoji = emojis[i] if i < len(emojis) else "🏅"
                     rewards_text_list.append(f'{emoji} {gift["gift_name"]} #{gift["collectible_number"]:,}')
                 
-                results_text = f"🏆 <b>Giveaway Results</b> 🏆\n\nCongratulations to our winner @{winner_username} who gets all the prizes!\n\n{' '.join(rewards_text_list)}"
+                results_text = f"🏆 <b>Giveaway Results</b> 🏆\n\nCongratulations to our winner @{winner['username']} who gets all the prizes!\n\n{' '.join(rewards_text_list)}"
             else: # multiple
-                num_winners = min(len(gifts), len(participants))
-                selected_winner_ids = random.sample(participants, k=num_winners)
+                assignments = []
                 winner_lines = []
-                for i, winner_id in enumerate(selected_winner_ids):
-                    gift = gifts[i]
-                    cur.execute("UPDATE gifts SET owner_id = %s, acquired_date = CURRENT_TIMESTAMP WHERE instance_id = %s;", (winner_id, gift['instance_id']))
-                    cur.execute("SELECT username FROM accounts WHERE tg_id = %s;", (winner_id,))
-                    winner_username = cur.fetchone()['username']
+                for i, (gift, winner) in enumerate(zip(gifts, winners)):
+                    assignments.append((gift['instance_id'], winner['user_id']))
                     emoji = emojis[i] if i < len(emojis) else "🏅"
-                    winner_lines.append(f'{emoji} {gift["gift_name"]} #{gift["collectible_number"]:,} ➔ @{winner_username}')
+                    winner_lines.append(f'{emoji} {gift["gift_name"]} #{gift["collectible_number"]:,} ➔ @{winner["username"]}')
                 
                 results_text = "🏆 <b>Giveaway Results</b> 🏆\n\nCongratulations to our winners:\n\n" + "\n".join(winner_lines)
 
-            send_telegram_message(giveaway['channel_id'], results_text, disable_web_page_preview=True)
+            # Transfer every gift to its winner in one statement.
+            if assignments:
+                execute_values(cur, """
+                    UPDATE gifts SET owner_id = v.winner_id, acquired_date = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(instance_id, winner_id)
+                    WHERE gifts.instance_id = v.instance_id;
+                """, assignments, template="(%s, %s::bigint)")
+
             cur.execute("UPDATE giveaways SET status = 'finished' WHERE id = %s;", (giveaway_id,))
             conn.commit()
+            send_telegram_message(giveaway['channel_id'], results_text, disable_web_page_preview=True)
 
     except Exception as e:
         if conn: conn.rollback()
@@ -4117,71 +5531,136 @@ def process_giveaway_winners(giveaway_id):
         if conn: put_db_connection(conn)
 
 def process_all_finished_giveaways():
+    """Claims every active giveaway whose deadline has passed and processes its winners. Returns False on failure."""
     app.logger.info("Running process_all_finished_giveaways...")
     conn = get_db_connection()
     if not conn: 
         app.logger.error("Could not get DB connection to process winners.")
-        return
+        return False
 
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT id FROM giveaways WHERE status = 'active' AND end_date <= CURRENT_TIMESTAMP;")
+            # Claim the rows in one statement so two processes can never pick the same giveaway.
+            cur.execute("""
+                UPDATE giveaways SET status = 'processing'
+                WHERE status = 'active' AND end_date <= CURRENT_TIMESTAMP
+                RETURNING id;
+            """)
             giveaway_ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
             
             if giveaway_ids:
-                app.logger.info(f"Found finished giveaways: {giveaway_ids}. Setting status to 'processing'.")
-                cur.execute("UPDATE giveaways SET status = 'processing' WHERE id = ANY(%s);", (giveaway_ids,))
-                conn.commit()
-                
+                app.logger.info(f"Found finished giveaways: {giveaway_ids}. Set status to 'processing'.")
                 for gid in giveaway_ids:
-                    processing_thread = threading.Thread(target=process_giveaway_winners, args=(gid,))
-                    processing_thread.start()
+                    submit_background_task(process_giveaway_winners, gid, dedup_key=f"giveaway_winners:{gid}")
             else:
                 app.logger.info("No giveaways found that have ended.")
+            return True
     except Exception as e:
+        if conn: conn.rollback()
         app.logger.error(f"Error during process_all_finished_giveaways: {e}", exc_info=True)
+        return False
     finally:
         if conn: put_db_connection(conn)
 
+def notify_giveaway_scheduler(cur=None):
+    """
+    Wakes the giveaway scheduler so a newly published deadline is picked up immediately.
+    The in-process event covers the current worker; the NOTIFY (sent on commit) reaches
+    the leader when it lives in another worker.
+    """
+    giveaway_wakeup_event.set()
+    if cur is not None:
+        cur.execute("SELECT pg_notify(%s, '');", (GIVEAWAY_NOTIFY_CHANNEL,))
+
+def _load_giveaway_timers():
+    """Returns a heap of (end_date, giveaway_id) for every active giveaway."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT end_date, id FROM giveaways WHERE status = 'active' AND end_date IS NOT NULL;")
+            timers = [(row[0], row[1]) for row in cur.fetchall()]
+        heapq.heapify(timers)
+        return timers
+    finally:
+        put_db_connection(conn)
 
-def check_finished_giveaways():
-    NO_GIVEAWAYS_SLEEP_SECONDS = 3600
+def _wait_for_giveaway_wakeup(listen_conn, timeout):
+    """Blocks until the timeout passes, a NOTIFY arrives or the in-process event is set."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if giveaway_wakeup_event.is_set():
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Short slices so the in-process event is noticed quickly as well.
+        ready, _, _ = select.select([listen_conn], [], [], min(remaining, 1.0))
+        if ready:
+            listen_conn.poll()
+            if listen_conn.notifies:
+                listen_conn.notifies.clear()
+                break
+    giveaway_wakeup_event.clear()
+
+def _run_giveaway_scheduler_as_leader(listen_conn):
+    while True:
+        timers = _load_giveaway_timers()
+        if timers is None:
+            app.logger.warning("DB connection failed in giveaway scheduler. Retrying in 30 seconds.")
+            _wait_for_giveaway_wakeup(listen_conn, 30)
+            continue
+
+        now_utc = datetime.now(pytz.utc)
+        if timers and timers[0][0] <= now_utc:
+            if not process_all_finished_giveaways():
+                # Avoid spinning on a due giveaway that cannot be claimed right now.
+                _wait_for_giveaway_wakeup(listen_conn, 30)
+            continue
+
+        if timers:
+            next_end_date = timers[0][0]
+            wait_seconds = min((next_end_date - now_utc).total_seconds(), GIVEAWAY_SCHEDULER_MAX_SLEEP_SECONDS)
+            app.logger.info(f"Next giveaway ends at {next_end_date}. Sleeping for up to {wait_seconds:.0f} seconds.")
+        else:
+            wait_seconds = GIVEAWAY_SCHEDULER_MAX_SLEEP_SECONDS
+            app.logger.info(f"No active giveaways. Sleeping for up to {wait_seconds / 60:.0f} minutes.")
+        _wait_for_giveaway_wakeup(listen_conn, max(wait_seconds, 0))
 
+def run_giveaway_scheduler():
+    """
+    Background loop that finishes giveaways at their deadline.
+    Every worker runs it, but only the holder of the Postgres advisory lock acts as the
+    scheduler; the others just retry the lock so one of them takes over if the leader dies.
+    """
     while True:
+        listen_conn = None
         try:
-            conn = get_db_connection()
-            if not conn:
-                app.logger.warning("DB connection failed in checker loop. Retrying in 5 minutes.")
-                time.sleep(300)
+            # A dedicated connection: the advisory lock and LISTEN are tied to the session.
+            listen_conn = psycopg2.connect(DATABASE_URL)
+            listen_conn.autocommit = True
+            with listen_conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s);", (GIVEAWAY_SCHEDULER_LOCK_ID,))
+                is_leader = cur.fetchone()[0]
+                if is_leader:
+                    cur.execute(f"LISTEN {GIVEAWAY_NOTIFY_CHANNEL};")
+
+            if not is_leader:
+                listen_conn.close()
+                listen_conn = None
+                time.sleep(GIVEAWAY_LEADER_RETRY_SECONDS)
                 continue
-            
-            next_giveaway_end_date = None
-            try:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT end_date FROM giveaways WHERE status = 'active' ORDER BY end_date ASC LIMIT 1;")
-                    result = cur.fetchone()
-                    if result:
-                        next_giveaway_end_date = result[0]
-            finally:
-                if conn: put_db_connection(conn)
-
-            if next_giveaway_end_date:
-                now_utc = datetime.now(pytz.utc)
-                wait_seconds = (next_giveaway_end_date - now_utc).total_seconds()
-
-                if wait_seconds > 0:
-                    sleep_duration = wait_seconds + 1
-                    app.logger.info(f"Next giveaway ends at {next_giveaway_end_date}. Sleeping for {sleep_duration:.0f} seconds.")
-                    time.sleep(sleep_duration)
-            else:
-                app.logger.info(f"No active giveaways. Sleeping for {NO_GIVEAWAYS_SLEEP_SECONDS / 60} minutes.")
-                time.sleep(NO_GIVEAWAYS_SLEEP_SECONDS)
-
-            process_all_finished_giveaways()
 
+            app.logger.info("This worker is now the giveaway scheduler leader.")
+            _run_giveaway_scheduler_as_leader(listen_conn)
         except Exception as e:
-             app.logger.error(f"Critical error in giveaway checker loop: {e}", exc_info=True)
-             time.sleep(300)
+            app.logger.error(f"Critical error in giveaway scheduler: {e}", exc_info=True)
+            time.sleep(GIVEAWAY_LEADER_RETRY_SECONDS)
+        finally:
+            if listen_conn and not listen_conn.closed:
+                listen_conn.close()
 
 @app.route('/api/transfer_gift', methods=['POST'])
 def api_transfer_gift():
@@ -4212,20 +5691,19 @@ def api_transfer_gift():
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (sender_username,))
-            sender = cur.fetchone()
+            sender = resolve_account_by_username(cur, sender_username, "tg_id")
             if not sender: return jsonify({"error": f"Sender '{sender_username}' not found."}), 404
             sender_id = sender['tg_id']
 
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (receiver_username,))
-            receiver = cur.fetchone()
+            receiver = resolve_account_by_username(cur, receiver_username, "tg_id")
             if not receiver: return jsonify({"error": f"Receiver '{receiver_username}' not found."}), 404
             receiver_id = receiver['tg_id']
 
-            cur.execute("""
+            clause, params = gift_identity_clause(gift_name, collectible_number)
+            cur.execute(f"""
                 SELECT instance_id, gift_type_id FROM gifts 
-                WHERE owner_id = %s AND gift_name = %s AND collectible_number = %s AND is_collectible = TRUE;
-            """, (sender_id, gift_name, collectible_number))
+                WHERE owner_id = %s AND {clause};
+            """, [sender_id] + params)
             gift = cur.fetchone()
             if not gift:
                 return jsonify({"error": f"Gift '{gift_name} #{collectible_number}' not found or not owned by '{sender_username}'."}), 404
@@ -4283,13 +5761,11 @@ def create_and_transfer_random_gift():
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (sender_username,))
-            sender = cur.fetchone()
+            sender = resolve_account_by_username(cur, sender_username, "tg_id")
             if not sender: return jsonify({"error": f"Sender '{sender_username}' not found."}), 404
             sender_id = sender['tg_id']
 
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (receiver_username,))
-            receiver = cur.fetchone()
+            receiver = resolve_account_by_username(cur, receiver_username, "tg_id")
             if not receiver: return jsonify({"error": f"Receiver '{receiver_username}' not found."}), 404
             receiver_id = receiver['tg_id']
 
@@ -4311,23 +5787,16 @@ def create_and_transfer_random_gift():
             next_number = cur.fetchone()[0]
             new_instance_id = str(uuid.uuid4())
             
-            pattern_source_name = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-            model_image_url = selected_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(selected_model['name'])}.png"
-            lottie_model_path = selected_model.get('lottie') if selected_model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(selected_model['name'])}.json"
-            pattern_image_url = f"{CDN_BASE_URL}patterns/{quote(pattern_source_name)}/png/{quote(selected_pattern['name'])}.png"
-
-            collectible_data = {
-                "model": selected_model, "backdrop": selected_backdrop, "pattern": selected_pattern,
-                "modelImage": model_image_url, "lottieModelPath": lottie_model_path,
-                "patternImage": pattern_image_url, "backdropColors": selected_backdrop.get('hex'), 
-                "supply": random.randint(2000, 10000)
-            }
+            collectible_row = build_collectible_row(
+                cur, gift_name, selected_model, selected_backdrop, selected_pattern,
+                supply=random.randint(2000, 10000)
+            )
             
             cur.execute("""
                 INSERT INTO gifts 
-                (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, collectible_number) 
-                VALUES (%s, %s, %s, %s, TRUE, %s, %s);
-            """, (new_instance_id, receiver_id, gift_type_id, gift_name, json.dumps(collectible_data), next_number))
+                (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, collectible_number) 
+                VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s, %s, %s);
+            """, (new_instance_id, receiver_id, gift_type_id, gift_name, *collectible_row, next_number))
 
             conn.commit()
 
@@ -4368,13 +5837,11 @@ def create_and_transfer_custom_gift():
     if not conn: return jsonify({"error": "Database connection failed."}), 500
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (sender_username,))
-            sender = cur.fetchone()
+            sender = resolve_account_by_username(cur, sender_username, "tg_id")
             if not sender: return jsonify({"error": f"Sender '{sender_username}' not found."}), 404
             sender_id = sender['tg_id']
 
-            cur.execute("SELECT tg_id FROM accounts WHERE username = %s;", (receiver_username,))
-            receiver = cur.fetchone()
+            receiver = resolve_account_by_username(cur, receiver_username, "tg_id")
             if not receiver: return jsonify({"error": f"Receiver '{receiver_username}' not found."}), 404
             receiver_id = receiver['tg_id']
             
@@ -4411,23 +5878,16 @@ def create_and_transfer_custom_gift():
             next_number = cur.fetchone()[0]
             new_instance_id = str(uuid.uuid4())
             
-            pattern_source_name = CUSTOM_GIFTS_DATA.get(gift_name, {}).get("patterns_source", gift_name)
-            model_image_url = selected_model.get('image') or f"{CDN_BASE_URL}models/{quote(gift_name)}/png/{quote(selected_model['name'])}.png"
-            lottie_model_path = selected_model.get('lottie') if selected_model.get('lottie') is not None else f"{CDN_BASE_URL}models/{quote(gift_name)}/lottie/{quote(selected_model['name'])}.json"
-            pattern_image_url = f"{CDN_BASE_URL}patterns/{quote(pattern_source_name)}/png/{quote(selected_pattern['name'])}.png"
-
-            collectible_data = {
-                "model": selected_model, "backdrop": selected_backdrop, "pattern": selected_pattern,
-                "modelImage": model_image_url, "lottieModelPath": lottie_model_path,
-                "patternImage": pattern_image_url, "backdropColors": selected_backdrop.get('hex'),
-                "supply": random.randint(2000, 10000)
-            }
+            collectible_row = build_collectible_row(
+                cur, gift_name, selected_model, selected_backdrop, selected_pattern,
+                supply=random.randint(2000, 10000)
+            )
             
             cur.execute("""
                 INSERT INTO gifts 
-                (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, collectible_number) 
-                VALUES (%s, %s, %s, %s, TRUE, %s, %s);
-            """, (new_instance_id, receiver_id, gift_type_id, gift_name, json.dumps(collectible_data), next_number))
+                (instance_id, owner_id, gift_type_id, gift_name, is_collectible, collectible_data, model_id, backdrop_id, pattern_id, collectible_number) 
+                VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s, %s, %s);
+            """, (new_instance_id, receiver_id, gift_type_id, gift_name, *collectible_row, next_number))
 
             conn.commit()
 
@@ -4467,8 +5927,7 @@ def get_user_data_by_username(username):
 
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT tg_id, username, full_name, avatar_url, bio, phone_number, created_at FROM accounts WHERE LOWER(username) = LOWER(%s);", (username,))
-            user_profile = cur.fetchone()
+            user_profile = resolve_account_by_username(cur, username, "tg_id, username, full_name, avatar_url, bio, phone_number, created_at")
 
             if not user_profile:
                 return jsonify({"error": "User profile not found."}), 404
@@ -4480,16 +5939,7 @@ def get_user_data_by_username(username):
                 ORDER BY is_pinned DESC, pin_order ASC NULLS LAST, acquired_date DESC;
             """, (user_id,))
             
-            gifts = []
-            for row in cur.fetchall():
-                gift_dict = dict(row)
-                if gift_dict.get('collectible_data') and isinstance(gift_dict.get('collectible_data'), str):
-                    try:
-                        gift_dict['collectible_data'] = json.loads(gift_dict['collectible_data'])
-                    except json.JSONDecodeError:
-                        app.logger.warning(f"Could not parse collectible_data for gift {gift_dict['instance_id']}")
-                        gift_dict['collectible_data'] = None
-                gifts.append(gift_dict)
+            gifts = _update_gifts_with_live_supply(cur, hydrate_collectible_data(cur, [dict(row) for row in cur.fetchall()]))
 
             response_data = {
                 "profile": dict(user_profile),
@@ -4504,18 +5954,61 @@ def get_user_data_by_username(username):
         if conn: put_db_connection(conn)
 
 # --- APP STARTUP & MAIN ---
+# Importing this module has no side effects. One-time setup (webhook, migrations) runs once per
+# deploy via `python app.py setup`, which gunicorn.conf.py calls before forking workers. Each
+# worker starts its own background services on its first request.
+background_services_started = False
+background_services_lock = threading.Lock()
+
+def run_startup_tasks():
+    set_webhook()
+    init_db()
+
+def start_background_services():
+    global background_services_started
+    if background_services_started:
+        return
+    with background_services_lock:
+        if background_services_started:
+            return
+        giveaway_thread = threading.Thread(target=run_giveaway_scheduler, daemon=True, name="giveaway-scheduler")
+        giveaway_thread.start()
+        threading.Thread(target=run_resource_version_listener, daemon=True, name="resource-versions").start()
+        threading.Thread(target=run_pending_inline_action_expiry, daemon=True, name="inline-action-expiry").start()
+        refresh_gift_name_index()  # Before any handler runs, so none builds it on a second connection
+        background_services_started = True
+
+def stop_background_services():
+    """
+    Winds a worker down: queued updates may schedule giveaway edits and background tasks, so they
+    are drained first and the executor is shut down last. Safe to call more than once.
+    """
+    drain_telegram_update_queues()
+    flush_pending_giveaway_message_updates()
+    shutdown_background_tasks()
+
+@app.before_request
+def ensure_background_services():
+    start_background_services()
+
 if __name__ != '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.error')
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
-    set_webhook()
-    init_db()
-    giveaway_thread = threading.Thread(target=check_finished_giveaways, daemon=True)
-    giveaway_thread.start()
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'setup':
+        app.logger.setLevel(logging.INFO)
+        run_startup_tasks()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate-avatars':
+        app.logger.setLevel(logging.INFO)
+        sys.exit(0 if migrate_inline_avatars() is not None else 1)
+
     print("Starting Flask server for local development...")
     init_db()
-    giveaway_thread = threading.Thread(target=check_finished_giveaways, daemon=True)
-    giveaway_thread.start()
-    app.run(debug=True, port=int(os.environ.get('PORT', 5001)))
+    start_background_services()
+    try:
+        app.run(debug=True, port=int(os.environ.get('PORT', 5001)))
+    finally:
+        stop_background_services()  # gunicorn.conf.py's worker_exit does this for workers
@@ -0,0 +1,53 @@
+"""Times init_db(): a full migration run on an empty schema, then the already-current fast path.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/boot_benchmark.py [--runs 50] [--reset]
+
+--reset drops and recreates the public schema first, so only use it on a scratch database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--reset", action="store_true", help="drop the public schema before the first run")
+    args = parser.parse_args()
+
+    database_url = os.environ.get("BENCH_DATABASE_URL")
+    if not database_url:
+        sys.exit("BENCH_DATABASE_URL must point at a scratch database.")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import app as app_module
+
+    if args.reset:
+        conn = app_module.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+            conn.commit()
+        finally:
+            app_module.put_db_connection(conn)
+
+    started = time.perf_counter()
+    app_module.init_db()
+    print(f"first init_db: {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    timings = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        app_module.init_db()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"current schema ({args.runs} runs): p50={statistics.median(timings):.2f}ms max={timings[-1]:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
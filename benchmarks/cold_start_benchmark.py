@@ -0,0 +1,42 @@
+"""Measures how long a fresh worker process takes to import app.py.
+
+Usage:
+    python benchmarks/cold_start_benchmark.py [--runs 10] [--target 0.5]
+
+Each run is a new interpreter, so nothing is cached between runs except the OS file cache.
+Importing must not touch the network or the database, so no real credentials are needed.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target", type=float, default=0.5, help="p50 import time budget in seconds")
+    args = parser.parse_args()
+
+    app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "postgresql://benchmark@127.0.0.1:1/benchmark")
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+    timings = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=app_dir, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    timings.sort()
+
+    p50 = statistics.median(timings)
+    print(f"import app ({args.runs} runs): p50={p50 * 1000:.0f}ms max={timings[-1] * 1000:.0f}ms target={args.target * 1000:.0f}ms")
+    sys.exit(0 if p50 <= args.target else 1)
+
+
+if __name__ == "__main__":
+    main()
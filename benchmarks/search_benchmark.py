@@ -0,0 +1,76 @@
+"""Seeds a scratch database with synthetic accounts and times /api/search against it.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/search_benchmark.py [--accounts 1000000] [--runs 200] [--cleanup]
+
+Never point BENCH_DATABASE_URL at production: the seeded rows are real inserts.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BENCH_TG_ID_OFFSET = 900_000_000_000
+QUERIES = ["bench_user_1", "bench_user_12345", "@bench_user_99", "Bench User 4242", "user_777", "PlushPepe-1", "plush"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--cleanup", action="store_true", help="delete the seeded accounts afterwards")
+    args = parser.parse_args()
+
+    database_url = os.environ.get("BENCH_DATABASE_URL")
+    if not database_url:
+        sys.exit("BENCH_DATABASE_URL must point at a scratch database.")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import app as app_module
+
+    app_module.init_db()
+    conn = app_module.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            started = time.perf_counter()
+            cur.execute("""
+                INSERT INTO accounts (tg_id, username, full_name)
+                SELECT %s + g, 'bench_user_' || g, 'Bench User ' || g FROM generate_series(1, %s) AS g
+                ON CONFLICT (tg_id) DO NOTHING;
+            """, (BENCH_TG_ID_OFFSET, args.accounts))
+            cur.execute("ANALYZE accounts;")
+            conn.commit()
+            print(f"seeded {args.accounts:,} accounts in {time.perf_counter() - started:.1f}s")
+
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + app_module.SEARCH_ACCOUNTS_SQL,
+                        {"term": "bench_user_12345", "prefix": "bench_user_12345%", "contains": "%bench_user_12345%", "limit": 5})
+            print("\n".join(row[0] for row in cur.fetchall()))
+    finally:
+        app_module.put_db_connection(conn)
+
+    client = app_module.app.test_client()
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            response = client.get("/api/search", query_string={"q": query})
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        timings.sort()
+        print(f"{query!r:24} p50={statistics.median(timings):7.2f}ms p95={timings[int(len(timings) * 0.95) - 1]:7.2f}ms results={len(response.get_json())}")
+
+    if args.cleanup:
+        conn = app_module.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM accounts WHERE tg_id > %s AND tg_id <= %s;", (BENCH_TG_ID_OFFSET, BENCH_TG_ID_OFFSET + args.accounts))
+            conn.commit()
+        finally:
+            app_module.put_db_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Gunicorn settings. Picked up automatically when gunicorn is started from the repo root.
+
+One-time setup (webhook registration, schema migrations) runs once in the master before any
+worker is forked, in a child process, so the master never opens database connections that
+workers would inherit.
+"""
+import os
+import subprocess
+import sys
+
+STARTUP_TIMEOUT_SECONDS = int(os.environ.get("STARTUP_TIMEOUT_SECONDS", 300))
+
+
+def on_starting(server):
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        result = subprocess.run([sys.executable, os.path.join(app_dir, "app.py"), "setup"], cwd=app_dir, timeout=STARTUP_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        server.log.error(f"Startup tasks did not finish within {STARTUP_TIMEOUT_SECONDS}s; starting workers anyway.")
+        return
+    if result.returncode != 0:
+        server.log.error(f"Startup tasks exited with code {result.returncode}; starting workers anyway.")
+
+
+def post_worker_init(worker):
+    # Start the scheduler now rather than waiting for the worker's first request.
+    from app import start_background_services
+    start_background_services()
+
+
+def worker_exit(server, worker):
+    # Finish queued updates, pending giveaway edits and background tasks before the worker goes.
+    from app import stop_background_services
+    stop_background_services()
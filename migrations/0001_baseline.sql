@@ -0,0 +1,243 @@
+-- Baseline schema: everything init_db() used to create at boot.
+-- Every statement is idempotent so this also applies cleanly to databases created before migrations existed.
+
+-- accounts table with stars_balance and music_status
+CREATE TABLE IF NOT EXISTS accounts (
+    tg_id BIGINT PRIMARY KEY,
+    username VARCHAR(255) UNIQUE,
+    full_name VARCHAR(255),
+    avatar_url TEXT,
+    bio TEXT,
+    phone_number VARCHAR(50) UNIQUE,
+    bot_state VARCHAR(255),
+    music_status TEXT,
+    stars_balance NUMERIC(20, 2) DEFAULT 0.0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    username_lower VARCHAR(255) GENERATED ALWAYS AS (LOWER(username)) STORED
+);
+-- Add unique constraint if it doesn't exist
+DO $$ BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'accounts_phone_number_key'
+    ) THEN
+        ALTER TABLE accounts ADD CONSTRAINT accounts_phone_number_key UNIQUE (phone_number);
+    END IF;
+END $$;
+-- Add new columns to existing accounts table if they don't exist
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='accounts' AND column_name='stars_balance') THEN
+        ALTER TABLE accounts ADD COLUMN stars_balance NUMERIC(20, 2) DEFAULT 0.0;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='accounts' AND column_name='music_status') THEN
+        ALTER TABLE accounts ADD COLUMN music_status TEXT;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='accounts' AND column_name='username_lower') THEN
+        ALTER TABLE accounts ADD COLUMN username_lower VARCHAR(255) GENERATED ALWAYS AS (LOWER(username)) STORED;
+    END IF;
+END $$;
+-- username_lower backs every username lookup. It is unique unless legacy rows differ only by case.
+-- text_pattern_ops serves both equality and LIKE 'abc%' prefix search under any collation.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_accounts_username_lower') THEN
+        IF EXISTS (SELECT 1 FROM accounts WHERE username_lower IS NOT NULL GROUP BY username_lower HAVING COUNT(*) > 1) THEN
+            RAISE NOTICE 'Usernames differing only by case exist; username_lower stays non-unique.';
+            CREATE INDEX IF NOT EXISTS idx_accounts_username_lower_pattern ON accounts (username_lower text_pattern_ops);
+        ELSE
+            CREATE UNIQUE INDEX uq_accounts_username_lower ON accounts (username_lower text_pattern_ops);
+            DROP INDEX IF EXISTS idx_accounts_username_lower_pattern;
+        END IF;
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_accounts_full_name_lower_pattern ON accounts (LOWER(full_name) text_pattern_ops);
+
+-- gifts table with is_on_sale and sale_price
+CREATE TABLE IF NOT EXISTS gifts (
+    instance_id VARCHAR(50) PRIMARY KEY,
+    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    sender_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL, -- NEW
+    gift_type_id VARCHAR(255) NOT NULL, gift_name VARCHAR(255) NOT NULL,
+    original_image_url TEXT, lottie_path TEXT, is_collectible BOOLEAN DEFAULT FALSE,
+    collectible_data JSONB, collectible_number INT,
+    acquired_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    is_hidden BOOLEAN DEFAULT FALSE, is_pinned BOOLEAN DEFAULT FALSE, is_worn BOOLEAN DEFAULT FALSE,
+    pin_order INT, is_on_sale BOOLEAN DEFAULT FALSE, sale_price INT
+);
+-- Add new columns to existing gifts table if they don't exist
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='is_on_sale') THEN
+        ALTER TABLE gifts ADD COLUMN is_on_sale BOOLEAN DEFAULT FALSE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='sale_price') THEN
+        ALTER TABLE gifts ADD COLUMN sale_price INT;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='gifts' AND column_name='sender_id') THEN
+        ALTER TABLE gifts ADD COLUMN sender_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS friends (
+    id SERIAL PRIMARY KEY,
+    user_one_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    user_two_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_one_id, user_two_id)
+);
+CREATE INDEX IF NOT EXISTS idx_friends_user_one ON friends (user_one_id);
+
+-- Indexes for gifts table
+CREATE INDEX IF NOT EXISTS idx_gifts_owner_id ON gifts (owner_id);
+CREATE INDEX IF NOT EXISTS idx_gifts_type_and_number ON gifts (gift_type_id, collectible_number);
+CREATE INDEX IF NOT EXISTS idx_gifts_name_lower_number ON gifts (LOWER(gift_name), collectible_number) WHERE is_collectible = TRUE;
+CREATE INDEX IF NOT EXISTS idx_gifts_pin_order ON gifts (owner_id, pin_order);
+
+-- Other tables
+CREATE TABLE IF NOT EXISTS collectible_usernames (
+    id SERIAL PRIMARY KEY,
+    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    username VARCHAR(255) UNIQUE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_collectible_usernames_lower ON collectible_usernames (LOWER(username));
+
+CREATE TABLE IF NOT EXISTS posts (
+    id SERIAL PRIMARY KEY,
+    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    views INT DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_posts_owner_id ON posts (owner_id);
+
+CREATE TABLE IF NOT EXISTS post_reactions (
+    id SERIAL PRIMARY KEY,
+    post_id INT REFERENCES posts(id) ON DELETE CASCADE,
+    user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    reaction_emoji VARCHAR(10) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(post_id, user_id, reaction_emoji)
+);
+CREATE INDEX IF NOT EXISTS idx_post_reactions_post_id ON post_reactions (post_id);
+
+CREATE TABLE IF NOT EXISTS user_subscriptions (
+    id SERIAL PRIMARY KEY,
+    subscriber_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    target_user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    notification_type VARCHAR(20) NOT NULL, -- 'mentions' or 'new_posts'
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(subscriber_id, target_user_id, notification_type)
+);
+CREATE INDEX IF NOT EXISTS idx_user_subscriptions_target ON user_subscriptions (target_user_id, notification_type);
+
+CREATE TABLE IF NOT EXISTS giveaways (
+    id SERIAL PRIMARY KEY,
+    creator_id BIGINT REFERENCES accounts(tg_id) ON DELETE SET NULL,
+    channel_id BIGINT,
+    end_date TIMESTAMP WITH TIME ZONE,
+    winner_rule VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending_setup',
+    message_id BIGINT,
+    last_update_time TIMESTAMP WITH TIME ZONE,
+    required_channels TEXT,
+    participant_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='giveaways' AND column_name='required_channels') THEN
+        ALTER TABLE giveaways ADD COLUMN required_channels TEXT;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS giveaway_gifts (
+    id SERIAL PRIMARY KEY,
+    giveaway_id INT REFERENCES giveaways(id) ON DELETE CASCADE,
+    gift_instance_id VARCHAR(50) REFERENCES gifts(instance_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS giveaway_participants (
+    id SERIAL PRIMARY KEY,
+    giveaway_id INT REFERENCES giveaways(id) ON DELETE CASCADE,
+    user_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    join_date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(giveaway_id, user_id)
+);
+-- Participant counter kept on the giveaway row so message edits don't COUNT(*) the participants.
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='giveaways' AND column_name='participant_count') THEN
+        ALTER TABLE giveaways ADD COLUMN participant_count INT NOT NULL DEFAULT 0;
+        UPDATE giveaways g SET participant_count = (SELECT COUNT(*) FROM giveaway_participants p WHERE p.giveaway_id = g.id);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS users_with_custom_gifts_enabled (
+    tg_id BIGINT PRIMARY KEY REFERENCES accounts(tg_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS collections (
+    id SERIAL PRIMARY KEY,
+    owner_id BIGINT REFERENCES accounts(tg_id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL,
+    display_order INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(owner_id, name)
+);
+CREATE TABLE IF NOT EXISTS gift_collections (
+    id SERIAL PRIMARY KEY,
+    gift_instance_id VARCHAR(50) REFERENCES gifts(instance_id) ON DELETE CASCADE,
+    collection_id INT REFERENCES collections(id) ON DELETE CASCADE,
+    order_in_collection INT,
+    UNIQUE(gift_instance_id, collection_id)
+);
+CREATE INDEX IF NOT EXISTS idx_collections_owner_id ON collections (owner_id);
+CREATE INDEX IF NOT EXISTS idx_gift_collections_collection_id ON gift_collections (collection_id);
+
+CREATE TABLE IF NOT EXISTS limited_gifts_stock (
+    gift_type_id VARCHAR(255) PRIMARY KEY,
+    total_stock INT NOT NULL,
+    remaining_stock INT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pending_inline_actions (
+    result_id VARCHAR(64) PRIMARY KEY,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_pending_inline_actions_created_at ON pending_inline_actions (created_at);
+
+-- Search: gift name catalog and trigram indexes
+CREATE TABLE IF NOT EXISTS gift_catalog (
+    gift_name VARCHAR(255) PRIMARY KEY,
+    gift_type_id VARCHAR(255) NOT NULL,
+    name_key VARCHAR(255) GENERATED ALWAYS AS (regexp_replace(LOWER(gift_name), '[^0-9a-z]', '', 'g')) STORED,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_gift_catalog_name_key ON gift_catalog (name_key text_pattern_ops);
+CREATE OR REPLACE FUNCTION gift_catalog_sync() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO gift_catalog (gift_name, gift_type_id)
+    SELECT DISTINCT ON (gift_name) gift_name, gift_type_id FROM new_gifts
+    ON CONFLICT (gift_name) DO NOTHING;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_gift_catalog_sync') THEN
+        CREATE TRIGGER trg_gift_catalog_sync AFTER INSERT ON gifts
+        REFERENCING NEW TABLE AS new_gifts
+        FOR EACH STATEMENT EXECUTE PROCEDURE gift_catalog_sync();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM gift_catalog) THEN
+        INSERT INTO gift_catalog (gift_name, gift_type_id)
+        SELECT DISTINCT ON (gift_name) gift_name, gift_type_id FROM gifts ORDER BY gift_name
+        ON CONFLICT (gift_name) DO NOTHING;
+    END IF;
+END $$;
+-- pg_trgm needs the contrib package and enough privileges; search falls back to prefix matching without it.
+DO $$ BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available: %', SQLERRM;
+END $$;
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS idx_accounts_username_lower_trgm ON accounts USING gin (username_lower gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_accounts_full_name_lower_trgm ON accounts USING gin (LOWER(full_name) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_gift_catalog_name_key_trgm ON gift_catalog USING gin (name_key gin_trgm_ops);
+    END IF;
+END $$;
@@ -0,0 +1,7 @@
+-- Telegram file_ids of photos we already uploaded, so resending the same image costs no upload.
+-- source_key is 'url:<url>', 'sha256:<content hash>' or a caller-chosen key such as 'card:<card key>'.
+CREATE TABLE IF NOT EXISTS telegram_media_cache (
+    source_key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,66 @@
+-- Trait dictionaries: each model, backdrop and pattern is stored once per gift name and gifts point
+-- at them by id. Gift names, not gift_type_id, key the dictionaries because generated gifts all
+-- share gift_type_id 'generated_gift'. collectible_data keeps only per-gift fields (supply, author);
+-- the trait objects and the URLs derived from them are rebuilt when responses are hydrated.
+CREATE TABLE IF NOT EXISTS gift_models (
+    id SERIAL PRIMARY KEY,
+    gift_name VARCHAR(255) NOT NULL,
+    name TEXT NOT NULL,
+    data JSONB NOT NULL,
+    UNIQUE (gift_name, name)
+);
+CREATE TABLE IF NOT EXISTS gift_backdrops (
+    id SERIAL PRIMARY KEY,
+    gift_name VARCHAR(255) NOT NULL,
+    name TEXT NOT NULL,
+    data JSONB NOT NULL,
+    UNIQUE (gift_name, name)
+);
+CREATE TABLE IF NOT EXISTS gift_patterns (
+    id SERIAL PRIMARY KEY,
+    gift_name VARCHAR(255) NOT NULL,
+    name TEXT NOT NULL,
+    data JSONB NOT NULL,
+    UNIQUE (gift_name, name)
+);
+
+ALTER TABLE gifts ADD COLUMN IF NOT EXISTS model_id INTEGER REFERENCES gift_models(id);
+ALTER TABLE gifts ADD COLUMN IF NOT EXISTS backdrop_id INTEGER REFERENCES gift_backdrops(id);
+ALTER TABLE gifts ADD COLUMN IF NOT EXISTS pattern_id INTEGER REFERENCES gift_patterns(id);
+
+-- Backfill the dictionaries from existing rows; the first copy seen of a trait wins.
+INSERT INTO gift_models (gift_name, name, data)
+SELECT DISTINCT ON (gift_name, collectible_data->'model'->>'name') gift_name, collectible_data->'model'->>'name', collectible_data->'model'
+FROM gifts WHERE is_collectible = TRUE AND jsonb_typeof(collectible_data->'model') = 'object' AND collectible_data->'model'->>'name' IS NOT NULL
+ORDER BY gift_name, collectible_data->'model'->>'name', acquired_date
+ON CONFLICT (gift_name, name) DO NOTHING;
+INSERT INTO gift_backdrops (gift_name, name, data)
+SELECT DISTINCT ON (gift_name, collectible_data->'backdrop'->>'name') gift_name, collectible_data->'backdrop'->>'name', collectible_data->'backdrop'
+FROM gifts WHERE is_collectible = TRUE AND jsonb_typeof(collectible_data->'backdrop') = 'object' AND collectible_data->'backdrop'->>'name' IS NOT NULL
+ORDER BY gift_name, collectible_data->'backdrop'->>'name', acquired_date
+ON CONFLICT (gift_name, name) DO NOTHING;
+INSERT INTO gift_patterns (gift_name, name, data)
+SELECT DISTINCT ON (gift_name, collectible_data->'pattern'->>'name') gift_name, collectible_data->'pattern'->>'name', collectible_data->'pattern'
+FROM gifts WHERE is_collectible = TRUE AND jsonb_typeof(collectible_data->'pattern') = 'object' AND collectible_data->'pattern'->>'name' IS NOT NULL
+ORDER BY gift_name, collectible_data->'pattern'->>'name', acquired_date
+ON CONFLICT (gift_name, name) DO NOTHING;
+
+-- A gift only points at a dictionary row holding exactly its own trait object, so nothing is lost
+-- when that object is dropped from collectible_data below.
+UPDATE gifts g SET model_id = t.id FROM gift_models t
+WHERE g.model_id IS NULL AND t.gift_name = g.gift_name AND t.name = g.collectible_data->'model'->>'name' AND t.data = g.collectible_data->'model';
+UPDATE gifts g SET backdrop_id = t.id FROM gift_backdrops t
+WHERE g.backdrop_id IS NULL AND t.gift_name = g.gift_name AND t.name = g.collectible_data->'backdrop'->>'name' AND t.data = g.collectible_data->'backdrop';
+UPDATE gifts g SET pattern_id = t.id FROM gift_patterns t
+WHERE g.pattern_id IS NULL AND t.gift_name = g.gift_name AND t.name = g.collectible_data->'pattern'->>'name' AND t.data = g.collectible_data->'pattern';
+
+-- Only rows whose three traits all matched are slimmed, and of the derived fields only those equal
+-- to what hydration would rebuild are dropped; stored URLs that differ stay and win on hydration.
+UPDATE gifts
+SET collectible_data = collectible_data - 'model' - 'backdrop' - 'pattern'
+    - CASE WHEN collectible_data->'backdropColors' IS NOT DISTINCT FROM collectible_data->'backdrop'->'hex' THEN 'backdropColors' ELSE '' END
+    - CASE WHEN collectible_data->'modelImage' IS NOT DISTINCT FROM collectible_data->'model'->'image' THEN 'modelImage' ELSE '' END
+    - CASE WHEN collectible_data->'lottieModelPath' IS NOT DISTINCT FROM collectible_data->'model'->'lottie' THEN 'lottieModelPath' ELSE '' END
+WHERE model_id IS NOT NULL AND backdrop_id IS NOT NULL AND pattern_id IS NOT NULL AND collectible_data ? 'model';
+
+CREATE INDEX IF NOT EXISTS idx_gifts_on_sale_traits ON gifts (gift_type_id, model_id, backdrop_id, pattern_id) WHERE is_on_sale = TRUE;
@@ -0,0 +1,72 @@
+-- Version counters for shared API resources, used to build weak ETags. Triggers bump them in the
+-- same transaction as the write and NOTIFY on commit, so app workers can keep the current versions
+-- in memory and answer conditional GETs without a query.
+CREATE TABLE IF NOT EXISTS resource_versions (
+    resource VARCHAR(255) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_resource_version(resource_name TEXT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO resource_versions (resource, version) VALUES (resource_name, 1)
+    ON CONFLICT (resource) DO UPDATE SET version = resource_versions.version + 1, updated_at = CURRENT_TIMESTAMP;
+    -- Identical payloads are folded into one notification per transaction.
+    PERFORM pg_notify('resource_versions', resource_name);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_resource_version_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_resource_version(TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The gifts triggers run once per statement and look at the changed rows through transition
+-- tables, so a bulk write bumps each resource at most once and a statement that touches nothing
+-- relevant (most gift writes) takes no lock on resource_versions at all.
+-- 'market': /api/market/summary (lowest price per gift type among listed collectibles).
+-- 'gift_stock': /api/gifts/stock (limited stock plus collectible counts per gift type).
+CREATE OR REPLACE FUNCTION bump_gift_resource_versions_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF EXISTS (SELECT 1 FROM new_rows WHERE is_on_sale) THEN PERFORM bump_resource_version('market'); END IF;
+        IF EXISTS (SELECT 1 FROM new_rows WHERE is_collectible) THEN PERFORM bump_resource_version('gift_stock'); END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF EXISTS (SELECT 1 FROM old_rows WHERE is_on_sale) THEN PERFORM bump_resource_version('market'); END IF;
+        IF EXISTS (SELECT 1 FROM old_rows WHERE is_collectible) THEN PERFORM bump_resource_version('gift_stock'); END IF;
+    ELSE
+        IF EXISTS (
+            SELECT 1 FROM old_rows o JOIN new_rows n ON n.instance_id = o.instance_id
+            WHERE (o.is_on_sale OR n.is_on_sale) AND
+                (o.is_on_sale, o.sale_price, o.is_collectible, o.gift_type_id, o.gift_name, o.original_image_url) IS DISTINCT FROM
+                (n.is_on_sale, n.sale_price, n.is_collectible, n.gift_type_id, n.gift_name, n.original_image_url)
+        ) THEN PERFORM bump_resource_version('market'); END IF;
+        IF EXISTS (
+            SELECT 1 FROM old_rows o JOIN new_rows n ON n.instance_id = o.instance_id
+            WHERE o.is_collectible IS DISTINCT FROM n.is_collectible OR
+                (n.is_collectible AND o.gift_type_id IS DISTINCT FROM n.gift_type_id)
+        ) THEN PERFORM bump_resource_version('gift_stock'); END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event.
+DROP TRIGGER IF EXISTS gifts_resource_versions_insert ON gifts;
+CREATE TRIGGER gifts_resource_versions_insert AFTER INSERT ON gifts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_gift_resource_versions_trigger();
+DROP TRIGGER IF EXISTS gifts_resource_versions_update ON gifts;
+CREATE TRIGGER gifts_resource_versions_update AFTER UPDATE ON gifts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_gift_resource_versions_trigger();
+DROP TRIGGER IF EXISTS gifts_resource_versions_delete ON gifts;
+CREATE TRIGGER gifts_resource_versions_delete AFTER DELETE ON gifts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_gift_resource_versions_trigger();
+
+DROP TRIGGER IF EXISTS limited_gifts_stock_changed ON limited_gifts_stock;
+CREATE TRIGGER limited_gifts_stock_changed AFTER INSERT OR UPDATE OR DELETE ON limited_gifts_stock
+FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_version_trigger('gift_stock');
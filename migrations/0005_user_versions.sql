@@ -0,0 +1,95 @@
+-- One data version per account, covering everything /api/account and /api/profile return for it:
+-- account fields, gifts, collections, collectible usernames, posts and their reactions, and the
+-- viewer-specific bits (custom gifts setting, subscriptions). Triggers bump it in the writing
+-- transaction, so no write path can forget to. A missing row means version 0.
+-- Not covered on purpose: post view counters (bumped on every view) and other users' usernames
+-- shown next to gifts and reactions; those refresh with the account's next real change.
+-- Also not covered: the live supply counts in collectible_data, which change whenever anyone
+-- mints a collectible. Responses pair this version with the 'gift_stock' resource version
+-- (see 0004_resource_versions.sql) for those.
+CREATE TABLE IF NOT EXISTS user_versions (
+    tg_id BIGINT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_user_version(user_id BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO user_versions (tg_id, version) VALUES (user_id, 1)
+    ON CONFLICT (tg_id) DO UPDATE SET version = user_versions.version + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bumps the account(s) named by column TG_ARGV[0] of the old and new row.
+CREATE OR REPLACE FUNCTION bump_user_versions_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    old_user BIGINT;
+    new_user BIGINT;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN old_user := (to_jsonb(OLD) ->> TG_ARGV[0])::BIGINT; END IF;
+    IF TG_OP <> 'DELETE' THEN new_user := (to_jsonb(NEW) ->> TG_ARGV[0])::BIGINT; END IF;
+    IF old_user IS NOT NULL THEN PERFORM bump_user_version(old_user); END IF;
+    IF new_user IS NOT NULL AND new_user IS DISTINCT FROM old_user THEN PERFORM bump_user_version(new_user); END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bumps the owner of the parent row: TG_ARGV = (parent table, parent id column in this table).
+CREATE OR REPLACE FUNCTION bump_parent_owner_version_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    parent_id BIGINT;
+    owner BIGINT;
+BEGIN
+    parent_id := (to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END) ->> TG_ARGV[1])::BIGINT;
+    EXECUTE format('SELECT owner_id FROM %I WHERE id = $1', TG_ARGV[0]) INTO owner USING parent_id;
+    -- A cascading delete has already removed the parent, whose own trigger did the bump.
+    IF owner IS NOT NULL THEN PERFORM bump_user_version(owner); END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS accounts_user_version_insert ON accounts;
+CREATE TRIGGER accounts_user_version_insert AFTER INSERT ON accounts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('tg_id');
+DROP TRIGGER IF EXISTS accounts_user_version_update ON accounts;
+CREATE TRIGGER accounts_user_version_update AFTER UPDATE ON accounts
+FOR EACH ROW WHEN (
+    (OLD.username, OLD.full_name, OLD.avatar_url, OLD.bio, OLD.phone_number, OLD.music_status, OLD.stars_balance) IS DISTINCT FROM
+    (NEW.username, NEW.full_name, NEW.avatar_url, NEW.bio, NEW.phone_number, NEW.music_status, NEW.stars_balance))
+EXECUTE FUNCTION bump_user_versions_trigger('tg_id');
+
+DROP TRIGGER IF EXISTS gifts_user_version_insert_delete ON gifts;
+CREATE TRIGGER gifts_user_version_insert_delete AFTER INSERT OR DELETE ON gifts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+DROP TRIGGER IF EXISTS gifts_user_version_update ON gifts;
+CREATE TRIGGER gifts_user_version_update AFTER UPDATE ON gifts
+FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+
+DROP TRIGGER IF EXISTS collections_user_version ON collections;
+CREATE TRIGGER collections_user_version AFTER INSERT OR UPDATE OR DELETE ON collections
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+DROP TRIGGER IF EXISTS gift_collections_user_version ON gift_collections;
+CREATE TRIGGER gift_collections_user_version AFTER INSERT OR UPDATE OR DELETE ON gift_collections
+FOR EACH ROW EXECUTE FUNCTION bump_parent_owner_version_trigger('collections', 'collection_id');
+
+DROP TRIGGER IF EXISTS collectible_usernames_user_version ON collectible_usernames;
+CREATE TRIGGER collectible_usernames_user_version AFTER INSERT OR UPDATE OR DELETE ON collectible_usernames
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+
+DROP TRIGGER IF EXISTS posts_user_version_insert_delete ON posts;
+CREATE TRIGGER posts_user_version_insert_delete AFTER INSERT OR DELETE ON posts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+DROP TRIGGER IF EXISTS posts_user_version_update ON posts;
+CREATE TRIGGER posts_user_version_update AFTER UPDATE ON posts
+FOR EACH ROW WHEN ((OLD.owner_id, OLD.content) IS DISTINCT FROM (NEW.owner_id, NEW.content))
+EXECUTE FUNCTION bump_user_versions_trigger('owner_id');
+DROP TRIGGER IF EXISTS post_reactions_user_version ON post_reactions;
+CREATE TRIGGER post_reactions_user_version AFTER INSERT OR UPDATE OR DELETE ON post_reactions
+FOR EACH ROW EXECUTE FUNCTION bump_parent_owner_version_trigger('posts', 'post_id');
+
+DROP TRIGGER IF EXISTS custom_gifts_setting_user_version ON users_with_custom_gifts_enabled;
+CREATE TRIGGER custom_gifts_setting_user_version AFTER INSERT OR DELETE ON users_with_custom_gifts_enabled
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('tg_id');
+DROP TRIGGER IF EXISTS user_subscriptions_user_version ON user_subscriptions;
+CREATE TRIGGER user_subscriptions_user_version AFTER INSERT OR UPDATE OR DELETE ON user_subscriptions
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('subscriber_id');
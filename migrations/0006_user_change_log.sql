@@ -0,0 +1,128 @@
+-- Per-account change log behind GET /api/account/changes. Every user_versions bump now also
+-- records which entity changed (a gift, collection or post, the account itself, or a setting),
+-- so a client holding version N can fetch just what changed since N.
+-- Supply counts are not logged: upgrades don't rewrite other holders' gifts, and the changes
+-- endpoint returns a separate 'supply' map when the 'gift_stock' resource version moved.
+-- Only the most recent 2000 versions per account are kept; log_floor is the oldest version the
+-- log can still answer from. Accounts that existed before this migration start with a floor at
+-- their current version.
+ALTER TABLE user_versions ADD COLUMN IF NOT EXISTS log_floor BIGINT NOT NULL DEFAULT 0;
+UPDATE user_versions SET log_floor = version WHERE log_floor < version;
+
+CREATE TABLE IF NOT EXISTS user_change_log (
+    id BIGSERIAL PRIMARY KEY,
+    tg_id BIGINT NOT NULL,
+    version BIGINT NOT NULL,
+    entity VARCHAR(20) NOT NULL,  -- 'gift', 'collection', 'post', 'account', 'settings', 'subscriptions'
+    entity_id VARCHAR(255),
+    op VARCHAR(10) NOT NULL,  -- 'upsert' or 'delete'
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_user_change_log_user_version ON user_change_log (tg_id, version);
+
+CREATE OR REPLACE FUNCTION record_user_change(user_id BIGINT, change_entity TEXT, change_entity_id TEXT, change_op TEXT) RETURNS VOID AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    INSERT INTO user_versions (tg_id, version) VALUES (user_id, 1)
+    ON CONFLICT (tg_id) DO UPDATE SET version = user_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING version INTO new_version;
+    INSERT INTO user_change_log (tg_id, version, entity, entity_id, op)
+    VALUES (user_id, new_version, change_entity, change_entity_id, change_op);
+    -- Trim in steps rather than on every write.
+    IF new_version % 100 = 0 AND new_version > 2000 THEN
+        DELETE FROM user_change_log WHERE tg_id = user_id AND version <= new_version - 2000;
+        UPDATE user_versions SET log_floor = GREATEST(log_floor, new_version - 2000) WHERE tg_id = user_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV = (account column, entity, entity id column). A row that moves between accounts is a
+-- delete for the old one and an upsert for the new one.
+CREATE OR REPLACE FUNCTION bump_user_versions_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    old_user BIGINT;
+    new_user BIGINT;
+    old_entity_id TEXT;
+    new_entity_id TEXT;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        old_user := (to_jsonb(OLD) ->> TG_ARGV[0])::BIGINT;
+        old_entity_id := to_jsonb(OLD) ->> TG_ARGV[2];
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        new_user := (to_jsonb(NEW) ->> TG_ARGV[0])::BIGINT;
+        new_entity_id := to_jsonb(NEW) ->> TG_ARGV[2];
+    END IF;
+    IF old_user IS NOT NULL AND (TG_OP = 'DELETE' OR new_user IS DISTINCT FROM old_user) THEN
+        PERFORM record_user_change(old_user, TG_ARGV[1], old_entity_id, 'delete');
+    END IF;
+    IF new_user IS NOT NULL THEN
+        PERFORM record_user_change(new_user, TG_ARGV[1], new_entity_id, 'upsert');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV = (parent table, parent id column in this table, entity): the parent row counts as changed.
+CREATE OR REPLACE FUNCTION bump_parent_owner_version_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    parent_id BIGINT;
+    owner BIGINT;
+BEGIN
+    parent_id := (to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END) ->> TG_ARGV[1])::BIGINT;
+    EXECUTE format('SELECT owner_id FROM %I WHERE id = $1', TG_ARGV[0]) INTO owner USING parent_id;
+    -- A cascading delete has already removed the parent, whose own trigger logged it.
+    IF owner IS NOT NULL THEN PERFORM record_user_change(owner, TG_ARGV[2], parent_id::TEXT, 'upsert'); END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS bump_user_version(BIGINT);
+
+-- Same triggers as 0005, now saying what changed.
+DROP TRIGGER IF EXISTS accounts_user_version_insert ON accounts;
+CREATE TRIGGER accounts_user_version_insert AFTER INSERT ON accounts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('tg_id', 'account', 'tg_id');
+DROP TRIGGER IF EXISTS accounts_user_version_update ON accounts;
+CREATE TRIGGER accounts_user_version_update AFTER UPDATE ON accounts
+FOR EACH ROW WHEN (
+    (OLD.username, OLD.full_name, OLD.avatar_url, OLD.bio, OLD.phone_number, OLD.music_status, OLD.stars_balance) IS DISTINCT FROM
+    (NEW.username, NEW.full_name, NEW.avatar_url, NEW.bio, NEW.phone_number, NEW.music_status, NEW.stars_balance))
+EXECUTE FUNCTION bump_user_versions_trigger('tg_id', 'account', 'tg_id');
+
+DROP TRIGGER IF EXISTS gifts_user_version_insert_delete ON gifts;
+CREATE TRIGGER gifts_user_version_insert_delete AFTER INSERT OR DELETE ON gifts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'gift', 'instance_id');
+DROP TRIGGER IF EXISTS gifts_user_version_update ON gifts;
+CREATE TRIGGER gifts_user_version_update AFTER UPDATE ON gifts
+FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'gift', 'instance_id');
+
+DROP TRIGGER IF EXISTS collections_user_version ON collections;
+CREATE TRIGGER collections_user_version AFTER INSERT OR UPDATE OR DELETE ON collections
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'collection', 'id');
+DROP TRIGGER IF EXISTS gift_collections_user_version ON gift_collections;
+CREATE TRIGGER gift_collections_user_version AFTER INSERT OR UPDATE OR DELETE ON gift_collections
+FOR EACH ROW EXECUTE FUNCTION bump_parent_owner_version_trigger('collections', 'collection_id', 'collection');
+
+DROP TRIGGER IF EXISTS collectible_usernames_user_version ON collectible_usernames;
+CREATE TRIGGER collectible_usernames_user_version AFTER INSERT OR UPDATE OR DELETE ON collectible_usernames
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'account', 'owner_id');
+
+DROP TRIGGER IF EXISTS posts_user_version_insert_delete ON posts;
+CREATE TRIGGER posts_user_version_insert_delete AFTER INSERT OR DELETE ON posts
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'post', 'id');
+DROP TRIGGER IF EXISTS posts_user_version_update ON posts;
+CREATE TRIGGER posts_user_version_update AFTER UPDATE ON posts
+FOR EACH ROW WHEN ((OLD.owner_id, OLD.content) IS DISTINCT FROM (NEW.owner_id, NEW.content))
+EXECUTE FUNCTION bump_user_versions_trigger('owner_id', 'post', 'id');
+DROP TRIGGER IF EXISTS post_reactions_user_version ON post_reactions;
+CREATE TRIGGER post_reactions_user_version AFTER INSERT OR UPDATE OR DELETE ON post_reactions
+FOR EACH ROW EXECUTE FUNCTION bump_parent_owner_version_trigger('posts', 'post_id', 'post');
+
+DROP TRIGGER IF EXISTS custom_gifts_setting_user_version ON users_with_custom_gifts_enabled;
+CREATE TRIGGER custom_gifts_setting_user_version AFTER INSERT OR DELETE ON users_with_custom_gifts_enabled
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('tg_id', 'settings', 'tg_id');
+DROP TRIGGER IF EXISTS user_subscriptions_user_version ON user_subscriptions;
+CREATE TRIGGER user_subscriptions_user_version AFTER INSERT OR UPDATE OR DELETE ON user_subscriptions
+FOR EACH ROW EXECUTE FUNCTION bump_user_versions_trigger('subscriber_id', 'subscriptions', 'target_user_id');
@@ -0,0 +1,21 @@
+-- Announces user_versions bumps on the 'resource_versions' channel as 'user:<tg_id>', so workers
+-- can keep account versions in memory like shared resource versions (see 0004) and revalidate
+-- /api/profile without a query. Otherwise the same as record_user_change in 0006.
+CREATE OR REPLACE FUNCTION record_user_change(user_id BIGINT, change_entity TEXT, change_entity_id TEXT, change_op TEXT) RETURNS VOID AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    INSERT INTO user_versions (tg_id, version) VALUES (user_id, 1)
+    ON CONFLICT (tg_id) DO UPDATE SET version = user_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING version INTO new_version;
+    INSERT INTO user_change_log (tg_id, version, entity, entity_id, op)
+    VALUES (user_id, new_version, change_entity, change_entity_id, change_op);
+    -- Trim in steps rather than on every write.
+    IF new_version % 100 = 0 AND new_version > 2000 THEN
+        DELETE FROM user_change_log WHERE tg_id = user_id AND version <= new_version - 2000;
+        UPDATE user_versions SET log_floor = GREATEST(log_floor, new_version - 2000) WHERE tg_id = user_id;
+    END IF;
+    -- Identical payloads are folded into one notification per transaction.
+    PERFORM pg_notify('resource_versions', 'user:' || user_id);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,48 @@
+"""Checks which upstream URLs the asset proxy is willing to fetch.
+
+Usage:
+    python -m unittest discover tests
+
+canonical_asset_url is the only gate between /assets/<host>/<path> and an outgoing request, so
+anything it accepts must stay inside ASSET_PROXY_HOSTS and the raw.githubusercontent.com allow-list
+after requests has normalised the URL.
+"""
+import os
+import sys
+import unittest
+
+import requests
+
+os.environ.setdefault("DATABASE_URL", "postgresql://test@127.0.0.1:1/test")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as app_module  # noqa: E402
+
+ALLOWED_RAW = "https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/main/x.png"
+
+
+class CanonicalAssetUrlTest(unittest.TestCase):
+    def test_allow_listed_repo_is_served(self):
+        self.assertEqual(app_module.canonical_asset_url(ALLOWED_RAW), ALLOWED_RAW)
+
+    def test_other_repo_is_refused(self):
+        self.assertIsNone(app_module.canonical_asset_url("https://raw.githubusercontent.com/evil/repo/main/x.png"))
+
+    def test_dot_segments_are_refused(self):
+        for path in ("%2E%2E/%2E%2E/evil/repo/main/x.png", "../../evil/repo/main/x.png", "./main/x.png", "main//x.png"):
+            with self.subTest(path=path):
+                self.assertIsNone(app_module.canonical_asset_url(f"https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/{path}"))
+
+    def test_serve_asset_route_refuses_traversal(self):
+        client = app_module.app.test_client()
+        response = client.get("/assets/raw.githubusercontent.com/Vasiliy-katsyka/upgrade/%2E%2E/%2E%2E/evil/repo/main/x.png")
+        self.assertEqual(response.status_code, 404)
+
+    def test_accepted_urls_stay_inside_the_allow_list_after_requests_prepares_them(self):
+        prepared = requests.Request("GET", app_module.canonical_asset_url(ALLOWED_RAW)).prepare().url
+        self.assertTrue(prepared.startswith("https://raw.githubusercontent.com/Vasiliy-katsyka/upgrade/"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Counts database pool checkouts per Telegram update type.
+
+Usage:
+    python -m unittest discover tests
+
+process_telegram_update must not check out a connection before it knows the update type, and no
+handler may hold more than one at a time. get_db_connection/put_db_connection are replaced by a
+counting fake and outgoing Telegram calls by no-ops, so no database or network is needed. The fake
+cursor answers the sender, recipient and gift lookups, so the inline handlers run through the gift
+name index (which starts unbuilt) instead of stopping at the first lookup.
+"""
+import os
+import sys
+import unittest
+
+os.environ.setdefault("DATABASE_URL", "postgresql://test@127.0.0.1:1/test")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as app_module  # noqa: E402
+
+
+# Query fragment -> the row fetchone() returns for it; anything else finds nothing.
+FAKE_ROWS = {
+    "SELECT username FROM accounts WHERE tg_id": {"username": "alice"},
+    "FROM accounts WHERE username_lower": {"tg_id": 6, "username": "bob"},
+    "FROM gifts WHERE owner_id": {"instance_id": "i1", "gift_type_id": "t1", "gift_name": "Plush Pepe", "collectible_data": {}, "model_id": None, "backdrop_id": None, "pattern_id": None},
+    "INSERT INTO pending_inline_actions": {"result_id": "r1"},
+}
+
+
+class FakeCursor:
+    def __init__(self):
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.row = next((row for fragment, row in FAKE_ROWS.items() if fragment in query), None)
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        return []
+
+
+class FakeConnection:
+    closed = False
+
+    def cursor(self, **kwargs):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class CountingPool:
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak = 0
+
+    def get(self):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        return FakeConnection()
+
+    def put(self, conn):
+        self.in_use -= 1
+
+
+class UpdatePoolCheckoutTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = CountingPool()
+        patches = {
+            "get_db_connection": self.pool.get,
+            "put_db_connection": self.pool.put,
+            "answer_inline_query": lambda *args, **kwargs: None,
+            "answer_callback_query": lambda *args, **kwargs: None,
+            "send_telegram_message": lambda *args, **kwargs: None,
+            "submit_background_task": lambda *args, **kwargs: False,
+            "_execute_gift_transfer": lambda **kwargs: None,
+        }
+        for name, replacement in patches.items():
+            original = getattr(app_module, name)
+            setattr(app_module, name, replacement)
+            self.addCleanup(setattr, app_module, name, original)
+        app_module.inline_lookup_cache.clear()
+        self.addCleanup(app_module.inline_lookup_cache.clear)
+        # As in a fresh worker: the first inline query must not build the index on a second connection.
+        original_index = dict(app_module.gift_name_index)
+        app_module.gift_name_index["built_at"] = 0.0
+        self.addCleanup(app_module.gift_name_index.update, original_index)
+
+    def assert_checkouts(self, update, expected):
+        app_module.process_telegram_update(update)
+        self.assertEqual(self.pool.checkouts, expected)
+        self.assertLessEqual(self.pool.peak, 1)
+        self.assertEqual(self.pool.in_use, 0)
+
+    def test_inline_query_help_needs_no_connection(self):
+        self.assert_checkouts({"update_id": 1, "inline_query": {"id": "q1", "from": {"id": 5}, "query": ""}}, 0)
+
+    def test_inline_query_send_checks_out_one_connection(self):
+        self.assert_checkouts({"update_id": 2, "inline_query": {"id": "q2", "from": {"id": 5}, "query": "send bob PlushPepe-1"}}, 1)
+
+    def test_chosen_inline_result_for_help_needs_no_connection(self):
+        self.assert_checkouts({"update_id": 3, "chosen_inline_result": {"result_id": "help_send", "from": {"id": 5}, "query": ""}}, 0)
+
+    def test_chosen_inline_result_send_checks_out_one_connection(self):
+        chosen = {"result_id": "send:5:0123456789abcdef", "from": {"id": 5}, "query": "send bob PlushPepe-1"}
+        self.assert_checkouts({"update_id": 4, "chosen_inline_result": chosen}, 1)
+
+    def test_unrelated_callback_query_needs_no_connection(self):
+        self.assert_checkouts({"update_id": 5, "callback_query": {"id": "c1", "from": {"id": 5}, "data": "noop"}}, 0)
+
+    def test_giveaway_callback_query_checks_out_one_connection(self):
+        callback = {"id": "c2", "from": {"id": 5}, "data": "publish_giveaway_7"}
+        self.assert_checkouts({"update_id": 6, "callback_query": callback}, 1)
+
+    def test_message_checks_out_one_connection(self):
+        message = {"message_id": 1, "chat": {"id": 5, "type": "private"}, "from": {"id": 5}, "text": "hello"}
+        self.assert_checkouts({"update_id": 7, "message": message}, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()